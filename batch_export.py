@@ -0,0 +1,185 @@
+"""
+Пакетный экспорт без окна: те же команды FFmpeg, что и у редактора
+
+Параметры - JSON в формате "📋 Копировать JSON" (get_uniquify_params); ключи,
+которых в нём нет, берутся по умолчанию (command_builder.DEFAULT_PARAMS).
+Файлы обрабатываются параллельно, не больше --workers процессов FFmpeg сразу.
+Модуль не импортирует customtkinter - работает на сервере без дисплея:
+    python batch_export.py params.json "videos/*.mp4" --output-dir out
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import json
+import os
+import time
+
+from command_builder import DEFAULT_PARAMS, CommandBuilder, ParamsSnapshot, probe_video
+from ffmpeg_process import run_with_progress, shutdown_processes
+
+
+# Одновременных экспортов по умолчанию: кодировщик и так занимает несколько
+# ядер, второй процесс загружает машину, пока первый декодирует или пишет
+BATCH_WORKERS = 2
+
+
+class HeadlessEditor(CommandBuilder):
+    """Построители команд редактора для одного видео без окна (параметры - ParamsSnapshot)
+
+    Свойства видео читаются через ffprobe (ошибки не перехватываются).
+    """
+
+    def __init__(self, video_path, ffmpeg_path="ffmpeg", ffprobe_path="ffprobe", export_jobs=1):
+        video = probe_video(ffprobe_path, video_path)
+        self.video_path = video_path
+        self.video_width = video["width"]
+        self.video_height = video["height"]
+        self.video_fps = video["fps"]
+        self.video_duration = video["duration"]
+        self.video_sample_rate = video["sample_rate"]
+        self.video_codec = video["video_codec"]
+        self.audio_codec = video["audio_codec"]
+
+        self.ffmpeg_path = ffmpeg_path
+        self.keyframe_index = None
+        self.export_jobs = export_jobs
+
+
+def expand_inputs(patterns):
+    """Пути к видео по списку путей и масок glob (без повторов, в порядке перечисления)"""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) or ([pattern] if os.path.isfile(pattern) else [])
+        if not matches:
+            print(f"Нет файлов: {pattern}")
+        for path in matches:
+            if os.path.isfile(path) and os.path.abspath(path) not in map(os.path.abspath, paths):
+                paths.append(path)
+    return paths
+
+
+def output_paths(inputs, output_dir):
+    """Пути результатов: имена исходников в output_dir
+
+    Если имена совпадают (a/clip.mp4 и b/clip.mp4), в output_dir повторяются
+    папки исходников относительно их общего каталога (out/a/clip.mp4). Если
+    общего каталога нет (разные диски Windows), к повторам добавляется номер
+    (clip.mp4, clip_1.mp4).
+    """
+    names = [os.path.basename(path) for path in inputs]
+    if len(set(names)) == len(names):
+        return [os.path.join(output_dir, name) for name in names]
+
+    sources = [os.path.abspath(path) for path in inputs]
+    try:
+        root = os.path.commonpath([os.path.dirname(path) for path in sources])
+    except ValueError:
+        # Номер не должен совпасть с именем другого исходника (регистр в Windows не важен)
+        originals = {name.lower() for name in names}
+        taken = set()
+        paths = []
+        for name in names:
+            stem, extension = os.path.splitext(name)
+            candidate, number = name, 0
+            while candidate.lower() in taken or (number and candidate.lower() in originals):
+                number += 1
+                candidate = f"{stem}_{number}{extension}"
+            taken.add(candidate.lower())
+            paths.append(os.path.join(output_dir, candidate))
+        return paths
+    return [os.path.join(output_dir, os.path.relpath(path, root)) for path in sources]
+
+
+def export_file(params, input_path, output_path, ffmpeg_path, ffprobe_path, export_jobs):
+    """Экспорт одного файла (params - ParamsSnapshot); возвращает (код возврата, stderr)"""
+    try:
+        editor = HeadlessEditor(input_path, ffmpeg_path, ffprobe_path, export_jobs)
+    except Exception as e:
+        return 1, f"ffprobe: {e}"
+    cmd = editor.build_ffmpeg_command(params, input_path, output_path)
+    try:
+        return run_with_progress(cmd, lambda report: None)
+    except OSError as e:
+        return 1, str(e)
+
+
+def run_batch(params, inputs, output_dir, workers=BATCH_WORKERS, ffmpeg_path="ffmpeg", ffprobe_path="ffprobe"):
+    """Экспорт всех inputs в output_dir (имена файлов сохраняются, см. output_paths)
+
+    params - ParamsSnapshot, общий для всех файлов. Возвращает число неудачных файлов.
+    """
+    jobs = []
+    for input_path, output_path in zip(inputs, output_paths(inputs, output_dir)):
+        if os.path.abspath(output_path) == os.path.abspath(input_path):
+            print(f"Пропущен {input_path}: результат перезаписал бы исходник")
+            continue
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        jobs.append((input_path, output_path))
+
+    failed = len(inputs) - len(jobs)
+    workers = max(1, min(workers, len(jobs) or 1))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        started = time.monotonic()
+        futures = {
+            pool.submit(export_file, params, input_path, output_path, ffmpeg_path, ffprobe_path, workers):
+                (input_path, output_path)
+            for input_path, output_path in jobs
+        }
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                input_path, output_path = futures[future]
+                returncode, stderr_tail = future.result()
+                elapsed = time.monotonic() - started
+                if returncode == 0:
+                    print(f"[{elapsed:7.1f} с] ✅ {input_path} -> {output_path}")
+                else:
+                    failed += 1
+                    print(f"[{elapsed:7.1f} с] ❌ {input_path}\n{stderr_tail[-1000:]}")
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            # Запущенные FFmpeg останавливаются, недописанные файлы остаются
+            shutdown_processes()
+            raise
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетный экспорт FFmpeg Editor без окна")
+    parser.add_argument("params", help="JSON параметров (📋 Копировать JSON в редакторе)")
+    parser.add_argument("inputs", nargs="*", help="видео или маски glob (\"videos/*.mp4\")")
+    parser.add_argument("-l", "--list", help="файл со списком видео (по пути в строке)")
+    parser.add_argument("-o", "--output-dir", required=True, help="папка результатов")
+    parser.add_argument("-j", "--workers", type=int, default=BATCH_WORKERS,
+                        help="одновременных процессов FFmpeg")
+    parser.add_argument("--ffmpeg", default="ffmpeg", help="путь к FFmpeg")
+    parser.add_argument("--ffprobe", default="ffprobe", help="путь к FFprobe")
+    args = parser.parse_args()
+
+    with open(args.params, encoding="utf-8") as f:
+        values = json.load(f)
+    unknown = sorted(set(values) - set(DEFAULT_PARAMS))
+    if unknown:
+        print(f"Неизвестные параметры пропущены: {', '.join(unknown)}")
+    try:
+        params = ParamsSnapshot.from_dict(values)
+    except ValueError as e:
+        parser.error(str(e))
+
+    patterns = list(args.inputs)
+    if args.list:
+        with open(args.list, encoding="utf-8") as f:
+            patterns.extend(line.strip() for line in f if line.strip())
+    inputs = expand_inputs(patterns)
+    if not inputs:
+        parser.error("не найдено ни одного видео")
+
+    print(f"Файлов: {len(inputs)}, одновременно: {min(args.workers, len(inputs))}")
+    failed = run_batch(params, inputs, args.output_dir, args.workers, args.ffmpeg, args.ffprobe)
+    print(f"Готово: {len(inputs) - failed} из {len(inputs)}")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
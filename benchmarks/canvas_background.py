@@ -0,0 +1,89 @@
+"""
+Бенчмарк фона Canvas: обычный путь (boxblur в увеличенном кадре) против
+пирамиды (boxblur в уменьшенном кадре, см. canvas_background_filter)
+
+Источник - синтетический testsrc2, поэтому видео не нужно. Для каждого
+размытия выводится время обоих путей и сходство результатов (SSIM, PSNR).
+
+    python benchmarks/canvas_background.py --size 1920x1080 --blur 25 50
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from command_builder import canvas_background_filter, even_size  # noqa: E402
+
+
+def source_args(width, height, duration):
+    return ["-f", "lavfi", "-i", f"testsrc2=s={width}x{height}:r=30:d={duration}"]
+
+
+def run_ffmpeg(ffmpeg_path, args):
+    result = subprocess.run([ffmpeg_path, "-hide_banner", "-nostdin", *args], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-1000:])
+    return result.stderr
+
+
+def time_path(ffmpeg_path, source, background, repeat):
+    """Лучшее время из repeat запусков ветки фона (вывод в null)"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        # Фон в итоговом графе Canvas обрабатывается в gbrap (см. build_canvas_filter)
+        run_ffmpeg(ffmpeg_path, [*source, "-vf", f"format=gbrap,{background}", "-f", "null", "-"])
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def compare_paths(ffmpeg_path, source, classic, fast):
+    """SSIM и PSNR пирамиды относительно обычного пути"""
+    graph = (
+        f"[0:v]format=gbrap,split=2[a][b];[a]{classic}[x];[b]{fast}[y];"
+        f"[x][y]ssim[s];[s]null"
+    )
+    stderr = run_ffmpeg(ffmpeg_path, [*source, "-filter_complex", graph, "-f", "null", "-"])
+    ssim = re.search(r"All:([\d.]+)", stderr)
+    graph = graph.replace("ssim", "psnr")
+    stderr = run_ffmpeg(ffmpeg_path, [*source, "-filter_complex", graph, "-f", "null", "-"])
+    psnr = re.search(r"average:([\d.]+|inf)", stderr)
+    return (float(ssim.group(1)) if ssim else None), (psnr.group(1) if psnr else None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ffmpeg", default="ffmpeg")
+    parser.add_argument("--size", default="1920x1080", help="размер кадра WxH")
+    parser.add_argument("--duration", type=float, default=2.0, help="длительность источника, с")
+    parser.add_argument("--zoom", type=float, default=1.15, help="Zoom фона (canvas_bg_zoom)")
+    parser.add_argument("--blur", type=int, nargs="+", default=[15, 25, 50], help="размытие фона (canvas_blur)")
+    parser.add_argument("--repeat", type=int, default=2, help="запусков на замер (берётся лучший)")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    bg_w, bg_h = even_size(width * args.zoom), even_size(height * args.zoom)
+    source = source_args(width, height, args.duration)
+
+    print(f"{args.size}, {args.duration:g} с, zoom {args.zoom}")
+    print(f"{'blur':>5} {'обычный, с':>11} {'пирамида, с':>12} {'ускорение':>10} {'SSIM':>8} {'PSNR':>7}")
+    for blur in args.blur:
+        classic = canvas_background_filter(width, height, bg_w, bg_h, blur)
+        fast = canvas_background_filter(width, height, bg_w, bg_h, blur, fast=True)
+        classic_time = time_path(args.ffmpeg, source, classic, args.repeat)
+        fast_time = time_path(args.ffmpeg, source, fast, args.repeat)
+        ssim, psnr = compare_paths(args.ffmpeg, source, classic, fast)
+        print(
+            f"{blur:>5} {classic_time:>11.2f} {fast_time:>12.2f} {classic_time / fast_time:>9.1f}x "
+            f"{ssim if ssim is not None else '-':>8} {psnr or '-':>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Параллельный экспорт по частям
+
+Видео делится на сегменты по ключевым кадрам, и каждый сегмент кодируется
+отдельным процессом FFmpeg с тем же графом фильтров (одновременно не больше
+workers процессов). Затем сегменты склеиваются concat-демуксером без
+перекодирования, а аудио кодируется целиком при итоговом мультиплексировании:
+сжатое аудио, склеенное по частям, даёт щелчки и сдвиг на стыках.
+
+Границы точные по кадрам: сегмент [S, E) читается с -ss чуть раньше S и -t
+E - S, кадры сохраняют свои метки времени (-fps_mode passthrough), а
+длительность каждого сегмента в списке concat задаётся явно - поэтому метки
+времени непрерывны, и видео не расходится с аудио на стыках. При изменённой
+скорости сегменты, как и обычный экспорт, идут с постоянной частотой
+исходника, а конец сегмента - число кадров на её сетке.
+"""
+
+import concurrent.futures
+import os
+from fractions import Fraction
+import shutil
+import tempfile
+import threading
+import time
+
+from ffmpeg_process import run_with_progress
+from thread_tuning import thread_args
+
+
+# Сегменты короче не выделяются: запуск процесса и первый GOP дороже выигрыша
+MIN_SEGMENT_SECONDS = 4.0
+
+# Сегментов на процесс: разные части видео кодируются с разной скоростью,
+# несколько сегментов на процесс выравнивают нагрузку к концу экспорта
+SEGMENTS_PER_WORKER = 2
+
+# -ss чуть раньше ключевого кадра: ffprobe округляет время до микросекунд
+SEEK_MARGIN = 1e-5
+
+
+def plan_segments(keyframes, duration, count, min_duration=MIN_SEGMENT_SECONDS):
+    """Границы сегментов [(начало, конец)] по ключевым кадрам
+
+    Границы - ключевые кадры, ближайшие к равным долям длительности;
+    конец последнего сегмента - None (до конца файла).
+    """
+    bounds = [0.0]
+    for i in range(1, count):
+        target = duration * i / count
+        keyframe = min(keyframes, key=lambda t: abs(t - target), default=None)
+        if keyframe is None:
+            break
+        if keyframe - bounds[-1] >= min_duration and duration - keyframe >= min_duration:
+            bounds.append(keyframe)
+
+    return [(start, end) for start, end in zip(bounds, bounds[1:] + [None])]
+
+
+class ChunkedExport:
+    """Экспорт одного файла сегментами в пуле процессов FFmpeg
+
+    video_args - граф и кодирование видео (["-vf", ..., "-b:v", ...]),
+    audio_args - кодирование аудио (["-b:a", ..., "-af", ...]),
+    output_args - опции итогового файла (метаданные).
+    time_scale - во сколько раз граф растягивает время (1 / скорость),
+    frame_rate - постоянная частота кадров результата ("30000/1001") при
+    time_scale != 1; None - кадры сохраняют свои метки времени.
+    work_dir - готовый каталог сегментов (удаляется после run); None - создаётся
+    рядом с результатом.
+    """
+
+    def __init__(self, ffmpeg_path, input_path, output_path, segments, video_args, audio_args,
+                 output_args=(), time_scale=1.0, frame_rate=None, workers=None, work_dir=None):
+        self.ffmpeg_path = ffmpeg_path
+        self.input_path = input_path
+        self.output_path = output_path
+        self.segments = segments
+        self.video_args = list(video_args)
+        self.audio_args = list(audio_args)
+        self.output_args = list(output_args)
+        self.time_scale = time_scale
+        self.frame_rate = frame_rate
+        self.workers = workers or os.cpu_count() or 1
+        self.work_dir = work_dir
+
+        self._lock = threading.Lock()
+        self._processes = set()
+        self._cancelled = False
+
+    def segment_command(self, start, end, path, jobs=None):
+        """Команда кодирования видео сегмента [start, end) в path
+
+        jobs - одновременных процессов на машине: по нему делятся потоки
+        (thread_tuning); None - без опций потоков.
+        """
+        input_threads, output_threads = [], []
+        if jobs is not None:
+            input_threads, output_threads = thread_args("-filter_complex" in self.video_args, jobs)
+
+        cmd = [self.ffmpeg_path, "-y", "-nostdin", *input_threads]
+        if start > 0:
+            cmd.extend(["-ss", f"{max(start - SEEK_MARGIN, 0):.6f}"])
+        if end is not None and self.frame_rate is None:
+            cmd.extend(["-t", f"{end - start:.6f}"])
+        cmd.extend(["-i", self.input_path, *self.video_args, *output_threads, "-an", "-sn", "-dn"])
+        if self.frame_rate is None:
+            cmd.extend(["-fps_mode", "passthrough"])
+        else:
+            cmd.extend(["-fps_mode", "cfr", "-r", self.frame_rate])
+            if end is not None:
+                # Конец сегмента - число кадров на сетке частоты: кадр исходника
+                # после E нужен для повторов до стыка (замедление), а кадр за
+                # стыком не попадает в результат (ускорение)
+                frames = round((end - start) * self.time_scale * Fraction(self.frame_rate))
+                cmd.extend(["-frames:v", str(frames)])
+        cmd.append(path)
+        return cmd
+
+    def concat_list(self, paths):
+        """Список для concat-демуксера с явной длительностью сегментов"""
+        lines = ["ffconcat version 1.0"]
+        for (start, end), path in zip(self.segments, paths):
+            lines.append(f"file '{os.path.basename(path)}'")
+            if end is not None:
+                lines.append(f"duration {(end - start) * self.time_scale:.6f}")
+        return "\n".join(lines) + "\n"
+
+    def mux_command(self, list_path):
+        """Склейка сегментов без перекодирования + аудио исходника"""
+        cmd = [
+            self.ffmpeg_path, "-y", "-nostdin",
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-i", self.input_path,
+            "-map", "0:v", "-map", "1:a?",
+            "-c:v", "copy",
+            *self.audio_args,
+        ]
+        # Метаданные исходника, если их не очищают
+        if "-map_metadata" not in self.output_args:
+            cmd.extend(["-map_metadata", "1"])
+        cmd.extend([*self.output_args, self.output_path])
+        return cmd
+
+    def run(self, on_progress):
+        """Экспорт; on_progress(report) - как у run_with_progress, по всем сегментам
+
+        Возвращает (код возврата, последние строки stderr).
+        """
+        _, extension = os.path.splitext(self.output_path)
+        work_dir = self.work_dir or tempfile.mkdtemp(
+            prefix=".chunks_", dir=os.path.dirname(os.path.abspath(self.output_path))
+        )
+        # Сегменты в контейнере результата: кодек по умолчанию тот же, что у обычного экспорта
+        paths = [os.path.join(work_dir, f"segment_{i:04d}{extension}") for i in range(len(self.segments))]
+
+        done_time = [0.0] * len(self.segments)
+        sizes = [0] * len(self.segments)
+        fps = [0.0] * len(self.segments)
+        started = time.monotonic()
+
+        def report(done=False):
+            out_time = sum(done_time)
+            elapsed = time.monotonic() - started
+            on_progress({
+                "out_time": out_time,
+                "fps": sum(fps) or None,
+                "speed": out_time / elapsed if elapsed > 0 and out_time > 0 else None,
+                "total_size": sum(sizes),
+                "done": done,
+            })
+
+        def on_segment_progress(i, segment_report):
+            with self._lock:
+                if segment_report["out_time"] is not None:
+                    done_time[i] = segment_report["out_time"]
+                sizes[i] = segment_report["total_size"] or sizes[i]
+                fps[i] = 0.0 if segment_report["done"] else segment_report["fps"] or 0.0
+                report()
+
+        try:
+            returncode, stderr_tail = self._encode_segments(paths, on_segment_progress)
+            if returncode != 0:
+                return returncode, stderr_tail
+
+            list_path = os.path.join(work_dir, "segments.ffconcat")
+            with open(list_path, "w", encoding="utf-8") as f:
+                f.write(self.concat_list(paths))
+
+            returncode, stderr_tail = run_with_progress(
+                self.mux_command(list_path), lambda _: None, on_start=self._track
+            )
+            if returncode == 0:
+                report(done=True)
+            return returncode, stderr_tail
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _encode_segments(self, paths, on_segment_progress):
+        """Кодирование всех сегментов в пуле локальных процессов
+
+        on_segment_progress(номер, report) - прогресс сегмента.
+        Возвращает (код возврата, stderr) первой ошибки или (0, "").
+        """
+        def encode(i):
+            if self._cancelled:
+                return 1, "экспорт отменён"
+            start, end = self.segments[i]
+            return run_with_progress(
+                # Потоков на процесс - поровну, иначе процессы мешают друг другу
+                self.segment_command(start, end, paths[i], jobs=self.workers),
+                lambda segment_report: on_segment_progress(i, segment_report),
+                on_start=self._track
+            )
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(encode, i) for i in range(len(self.segments))]
+            for future in concurrent.futures.as_completed(futures):
+                returncode, stderr_tail = future.result()
+                if returncode != 0:
+                    # Остальные сегменты уже не нужны
+                    self.cancel()
+                    return returncode, stderr_tail
+        return 0, ""
+
+    def _track(self, process):
+        """Учёт запущенного процесса (для отмены)"""
+        with self._lock:
+            if self._cancelled:
+                process.kill()
+            self._processes.add(process)
+
+    def cancel(self):
+        """Остановка всех процессов экспорта"""
+        with self._lock:
+            self._cancelled = True
+            processes = list(self._processes)
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
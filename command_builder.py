@@ -0,0 +1,1092 @@
+"""
+Построение команд FFmpeg по параметрам редактора - без Tk
+
+Граф фильтров, аудио, метаданные и команды экспорта строятся здесь, чтобы
+их могли использовать и окно редактора (ffmpeg_editor), и пакетная обработка
+без дисплея (batch_export). Модуль не импортирует customtkinter.
+"""
+
+import json
+import math
+from fractions import Fraction
+import os
+import random
+import shutil
+import tempfile
+
+from ffmpeg_process import PROBE_TIMEOUT, escape_filter_path, run_subprocess
+from media_cache import export_artifact_key, rounded_mask_path
+from preview_engine import RAW_OUTPUT_ARGS, fit_filter_args
+from chunked_export import SEGMENTS_PER_WORKER, ChunkedExport, plan_segments
+from render_farm import FARM_SEGMENTS, FarmExport
+from thread_tuning import thread_args
+
+
+# Параметры редактора и их значения по умолчанию; тип значения задаёт тип
+# переменной в окне (bool, int, float, str)
+DEFAULT_PARAMS = {
+    # Цветокоррекция
+    "brightness": 0.0,
+    "contrast": 1.0,
+    "saturation": 1.0,
+    "gamma": 1.0,
+    "gamma_r": 1.0,
+    "gamma_g": 1.0,
+    "gamma_b": 1.0,
+    
+    # Резкость и размытие
+    "sharpen": 0.0,
+    "blur": 0.0,
+    
+    # Шумоподавление
+    "denoise_strength": 0.0,
+    
+    # Виньетка
+    "vignette": 0.0,
+    
+    # Поворот и отражение
+    "rotation": 0,
+    "hflip": False,
+    "vflip": False,
+    
+    # Масштабирование
+    "scale_width": "",
+    "scale_height": "",
+    
+    # Обрезка (0 - без обрезки)
+    "crop_x": 0,
+    "crop_y": 0,
+    "crop_w": 0,
+    "crop_h": 0,
+    
+    # Скорость
+    "speed": 1.0,
+    
+    # Цветовые эффекты
+    "hue": 0.0,
+    "colorize": False,
+    "negate": False,
+    
+    # Дополнительные фильтры
+    "eq_preset": "none",
+    "custom_filter": "",
+    
+    # ========== УНИКАЛИЗАЦИЯ ==========
+    # Canvas Effect
+    "canvas_enabled": False,
+    "canvas_scale": 0.85,  # 0.7 - 1.0
+    "canvas_blur": 25.0,      # 0 - 50
+    "canvas_bg_fast": False,  # Размытие фона в уменьшенном кадре
+    "canvas_corner_radius": 20.0,  # 0 - 50
+    "canvas_corner_smooth": 1.0,  # 0.5 - 3.0 (множитель области скругления)
+    "canvas_bg_zoom": 1.15,  # 1.0 - 1.3
+    "canvas_noise": 0.0,  # 0 - 30 (интенсивность шума)
+    "canvas_vignette": 0.3,  # 0 - 1.0
+    
+    # Audio Pitch
+    "audio_pitch": 1.0,  # 0.95 - 1.05
+    "audio_pitch_enabled": False,
+    
+    # Metadata
+    "clear_metadata": True,
+    "random_metadata": True,
+}
+
+
+class ParamsSnapshot:
+    """Неизменяемый снимок параметров редактора: snapshot.brightness и т.д.
+    
+    Окно снимает параметры один раз в потоке интерфейса и передаёт снимок
+    построителям по значению - превью и экспорт в фоновых потоках не
+    обращаются к переменным Tk. Отсутствующие ключи - DEFAULT_PARAMS, значения
+    приводятся к типу значения по умолчанию (как DoubleVar/IntVar окна).
+    Равенство и хэш - по кортежу значений, собранному при создании.
+    """
+    
+    __slots__ = (*DEFAULT_PARAMS, "_values", "_hash")
+    
+    def __init__(self, **values):
+        unknown = set(values) - set(DEFAULT_PARAMS)
+        if unknown:
+            raise TypeError(f"Неизвестные параметры: {', '.join(sorted(unknown))}")
+        for name, default in DEFAULT_PARAMS.items():
+            object.__setattr__(self, name, type(default)(values.get(name, default)))
+        object.__setattr__(self, "_values", tuple(getattr(self, name) for name in DEFAULT_PARAMS))
+        object.__setattr__(self, "_hash", hash(self._values))
+        
+    @classmethod
+    def from_dict(cls, values):
+        """Снимок из словаря (get_uniquify_params, JSON); чужие ключи пропускаются
+        
+        JSON правится вручную, поэтому типы проверяются: "false" или null вместо
+        флага - ValueError с именем параметра, а не молчаливое приведение.
+        """
+        known = {name: value for name, value in values.items() if name in DEFAULT_PARAMS}
+        for name, value in known.items():
+            default = DEFAULT_PARAMS[name]
+            if isinstance(default, bool):
+                valid = isinstance(value, bool)
+            elif isinstance(default, (int, float)):
+                valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+                if isinstance(default, int) and valid:
+                    valid = float(value).is_integer()
+            else:
+                valid = isinstance(value, str)
+            if not valid:
+                raise ValueError(
+                    f"Параметр {name}: ожидается {type(default).__name__}, получено {value!r}"
+                )
+        return cls(**known)
+        
+    def replace(self, **changes):
+        """Новый снимок с изменёнными значениями"""
+        return ParamsSnapshot(**{**self.as_dict(), **changes})
+        
+    def as_dict(self):
+        return dict(zip(DEFAULT_PARAMS, self._values))
+        
+    def __setattr__(self, name, value):
+        raise AttributeError("ParamsSnapshot неизменяем, используйте replace()")
+        
+    def __reduce__(self):
+        # copy и pickle (процессы пакетного экспорта) не могут идти через __setattr__
+        return ParamsSnapshot.from_dict, (self.as_dict(),)
+        
+    def __eq__(self, other):
+        if not isinstance(other, ParamsSnapshot):
+            return NotImplemented
+        return self._hash == other._hash and self._values == other._values
+        
+    def __hash__(self):
+        return self._hash
+        
+    def __repr__(self):
+        changed = ", ".join(
+            f"{name}={value!r}" for name, value in self.as_dict().items() if value != DEFAULT_PARAMS[name]
+        )
+        return f"ParamsSnapshot({changed})"
+
+
+# preview_size без уменьшения: граф превью в разрешении исходника
+FULL_RESOLUTION = (math.inf, math.inf)
+
+# Черновое размытие выполняется в кадре, уменьшенном не больше чем во столько раз
+DRAFT_BLUR_MAX_FACTOR = 4
+
+# Пресеты масштаба (вкладка "Геометрия") и экспорт в несколько разрешений за один
+# проход: видеобитрейт каждого варианта
+SCALE_PRESETS = [
+    ("1920x1080", "1080p"),
+    ("1280x720", "720p"),
+    ("640x480", "480p"),
+    ("3840x2160", "4K"),
+]
+RENDITION_BITRATES = {"1080p": "8M", "720p": "5M", "480p": "2M"}
+
+# Кодеки, которые контейнер принимает при копировании потока без перекодирования
+# (None - любые). Для остальных контейнеров и кодеков экспорт перекодирует поток
+CONTAINER_CODECS = {
+    ".mp4": {"h264", "hevc", "av1", "vp9", "mpeg4", "mpeg2video",
+             "aac", "mp3", "ac3", "eac3", "opus", "flac", "alac"},
+    ".mov": {"h264", "hevc", "mpeg4", "mpeg2video", "prores", "mjpeg",
+             "aac", "mp3", "ac3", "alac", "pcm_s16le", "pcm_s24le"},
+    ".mkv": None,
+    ".webm": {"vp8", "vp9", "av1", "opus", "vorbis"},
+    ".avi": {"h264", "mpeg4", "msmpeg4v3", "mjpeg", "mp3", "ac3", "pcm_s16le"},
+}
+
+# Кодеки (видео, аудио), которыми FFmpeg кодирует в контейнер по умолчанию -
+# экспорт не задаёт -c:v/-c:a. Готовое кодирование из кэша перепаковывается
+# только в контейнер с теми же кодеками
+CONTAINER_DEFAULT_CODECS = {
+    ".mp4": ("h264", "aac"),
+    ".mov": ("h264", "aac"),
+    ".mkv": ("h264", "vorbis"),
+    ".webm": ("vp9", "opus"),
+    ".avi": ("mpeg4", "mp3"),
+}
+
+
+def container_accepts(output_path, codec):
+    """Можно ли скопировать поток кодека codec в контейнер файла output_path"""
+    if not codec:
+        return False  # Кодек исходника неизвестен
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension not in CONTAINER_CODECS:
+        return False
+    codecs = CONTAINER_CODECS[extension]
+    return codecs is None or codec in codecs
+
+
+def preview_factor(width, height, preview_size):
+    """Во сколько раз уменьшить кадр width x height, чтобы он вписался в область превью"""
+    if not preview_size or width <= 0 or height <= 0:
+        return 1.0
+    return min(1.0, preview_size[0] / width, preview_size[1] / height)
+
+
+def even_size(value):
+    """Округление размера вниз до чётного (не меньше 2)"""
+    value = int(value)
+    return max(2, value if value % 2 == 0 else value - 1)
+
+
+def odd_size(value, minimum=1):
+    """Округление размера ядра фильтра до нечётного (не меньше minimum)"""
+    value = max(minimum, int(round(value)))
+    return value if value % 2 == 1 else value + 1
+
+
+# Быстрый фон Canvas: размытие в кадре, уменьшенном не больше чем в
+# PYRAMID_MAX_FACTOR раз, так чтобы радиус boxblur в нём был около PYRAMID_RADIUS
+PYRAMID_MAX_FACTOR = 8
+PYRAMID_RADIUS = 4
+
+
+def draft_blur_filter(radius):
+    """Черновая замена boxblur=radius:1 - размытие в уменьшенном кадре
+    
+    После обратного увеличения размер может отличаться от исходного на пару
+    пикселей (iw/d округляется) - в черновике это незаметно.
+    """
+    factor = min(DRAFT_BLUR_MAX_FACTOR, int(radius // 2))
+    if factor < 2:
+        return f"boxblur={radius}:1"
+    return (
+        f"scale=iw/{factor}:-2:flags=area,boxblur={round(radius / factor, 2)}:1,"
+        f"scale=iw*{factor}:-2:flags=bilinear"
+    )
+
+
+def canvas_background_filter(w, h, bg_w, bg_h, blur, fast=False):
+    """Ветка фона Canvas: увеличение до bg_w x bg_h, boxblur, обрезка до w x h
+    
+    fast=True: пирамида - фон уменьшается в d раз, размывается там и
+    увеличивается обратно. Радиус boxblur делится на d, а число проходов
+    подбирается так, чтобы дисперсия размытия (проход радиуса r даёт
+    r(r+1)/3) в пересчёте на полное разрешение осталась прежней.
+    """
+    classic = f"scale={bg_w}:{bg_h},boxblur={blur}:{blur},crop={w}:{h}"
+    if not fast or blur <= 0:
+        return classic
+        
+    d = min(PYRAMID_MAX_FACTOR, blur // PYRAMID_RADIUS)
+    if d <= 1:
+        return classic
+        
+    low_w, low_h = even_size(bg_w / d), even_size(bg_h / d)
+    radius = max(1, int(round(blur / d)))
+    # boxblur требует радиус не больше половины меньшей стороны (цветность вдвое меньше)
+    if radius * 4 > min(low_w, low_h):
+        return classic
+    power = max(1, int(round(blur * blur * (blur + 1) / (d * d * radius * (radius + 1)))))
+    crop_w, crop_h = min(low_w, even_size(w / d)), min(low_h, even_size(h / d))
+    return (
+        f"scale={low_w}:{low_h}:flags=area,boxblur={radius}:{power},"
+        f"crop={crop_w}:{crop_h},scale={w}:{h}:flags=bilinear"
+    )
+
+
+def video_rotation(stream):
+    """Поворот видеопотока ffprobe в градусах (матрица отображения или старый тег rotate)"""
+    for side_data in stream.get("side_data_list", []):
+        if "rotation" in side_data:
+            return int(round(float(side_data["rotation"])))
+    try:
+        return int(stream.get("tags", {}).get("rotate", 0))
+    except ValueError:
+        return 0
+
+
+def probe_video(ffprobe_path, video_path):
+    """Свойства видео через ffprobe: размер, fps, длительность, sample rate и кодеки
+    
+    Размер - после поворота по метаданным (телефонные вертикальные видео):
+    FFmpeg и OpenCV поворачивают кадр при декодировании, и граф фильтров
+    получает его уже повёрнутым. Ошибки ffprobe и разбора JSON не перехватываются.
+    """
+    cmd = [
+        ffprobe_path,
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height,r_frame_rate,duration,codec_name"
+                         ":stream_tags=rotate:stream_side_data=rotation",
+        "-show_entries", "format=duration",
+        "-of", "json",
+        video_path
+    ]
+    
+    result = run_subprocess(cmd, capture_output=True, text=True, timeout=PROBE_TIMEOUT, limited=False)
+    info = json.loads(result.stdout)
+    
+    stream = info.get("streams", [{}])[0]
+    
+    # FPS
+    fps_str = stream.get("r_frame_rate", "30/1")
+    if "/" in fps_str:
+        num, den = fps_str.split("/")
+        fps = float(num) / float(den)
+    else:
+        fps = float(fps_str)
+        
+    width, height = stream.get("width", 1920), stream.get("height", 1080)
+    if video_rotation(stream) % 180 == 90:
+        width, height = height, width
+        
+    video = {
+        "width": width,
+        "height": height,
+        "fps": fps,
+        # Длительность
+        "duration": float(info.get("format", {}).get("duration", stream.get("duration", 10))),
+        "sample_rate": 44100,
+        "video_codec": stream.get("codec_name", ""),
+        "audio_codec": "",
+    }
+    
+    # Sample rate и кодек аудио
+    cmd_audio = [
+        ffprobe_path,
+        "-v", "error",
+        "-select_streams", "a:0",
+        "-show_entries", "stream=sample_rate,codec_name",
+        "-of", "json",
+        video_path
+    ]
+    result_audio = run_subprocess(
+        cmd_audio, capture_output=True, text=True, timeout=PROBE_TIMEOUT, limited=False
+    )
+    audio_stream = json.loads(result_audio.stdout).get("streams", [{}])
+    if audio_stream:
+        video["sample_rate"] = int(audio_stream[0].get("sample_rate", 44100))
+        video["audio_codec"] = audio_stream[0].get("codec_name", "")
+    return video
+
+
+class CommandBuilder:
+    """Построители команд FFmpeg по параметрам редактора
+    
+    Класс-примесь: параметры построители получают аргументом params
+    (ParamsSnapshot), а наследник задаёт атрибуты
+        video_path, video_width, video_height, video_fps, video_duration, video_sample_rate,
+        video_codec, audio_codec - исходник (см. probe_video),
+        ffmpeg_path, keyframe_index (None - нет индекса).
+    """
+    
+    # Одновременных экспортов на машине: между ними делятся потоки FFmpeg
+    export_jobs = 1
+    
+    def build_filter_chain(self, params, for_canvas_fg=False, force_build=False, preview_size=None, tier="normal"):
+        """Построение цепочки фильтров FFmpeg
+        
+        for_canvas_fg=True: строим только цветовые фильтры для наложения поверх Canvas
+        force_build=True: строим фильтры даже когда Canvas включен (fallback)
+        preview_size=(w, h): вариант для превью - кадр сначала уменьшается до области
+        превью, пиксельные параметры (обрезка, ядра фильтров) пересчитываются под него
+        tier="draft": черновое превью - дорогие фильтры заменяются дешёвыми
+        (шумоподавление hqdn3d вместо nlmeans, размытие в уменьшенном кадре)
+        """
+        filters = []
+        
+        # Если Canvas включен и это НЕ для переднего плана, пропускаем обычные фильтры
+        # (они будут применены к композиции)
+        # force_build позволяет строить фильтры даже когда Canvas включен
+        if params.canvas_enabled and not for_canvas_fg and not force_build:
+            return None
+        
+        # Множитель для радиусов и ядер фильтров (1.0 - полное разрешение)
+        px = 1.0
+        
+        if for_canvas_fg:
+            # Поверх Canvas кадр уже уменьшен в build_canvas_filter тем же множителем
+            px = preview_factor(self.video_width, self.video_height, preview_size)
+        
+        # Геометрические фильтры НЕ применяются поверх Canvas (for_canvas_fg=True)
+        # Они применяются только к исходному видео
+        if not for_canvas_fg:
+            # Обрезка (должна быть первой)
+            crop_w = params.crop_w
+            crop_h = params.crop_h
+            crop_x = params.crop_x
+            crop_y = params.crop_y
+            rotation = params.rotation
+            
+            crop_active = crop_w > 0 and crop_h > 0 and (
+                crop_w != self.video_width or crop_h != self.video_height or crop_x != 0 or crop_y != 0
+            )
+            
+            # Превью: уменьшение исходника до входа в граф так, чтобы результат
+            # (после обрезки и поворота) вписывался в область превью
+            if preview_size and self.video_width > 0 and self.video_height > 0:
+                content_w, content_h = (crop_w, crop_h) if crop_active else (self.video_width, self.video_height)
+                if rotation in (90, 270):
+                    content_w, content_h = content_h, content_w
+                factor = preview_factor(content_w, content_h, preview_size)
+                src_w, src_h = self.video_width, self.video_height
+                if factor < 1:
+                    src_w, src_h = even_size(src_w * factor), even_size(src_h * factor)
+                # Вход всегда приводится к расчётному размеру: превью может читать
+                # прокси-файл другого разрешения
+                filters.append(f"scale={src_w}:{src_h}")
+                if factor < 1:
+                    fx = src_w / self.video_width
+                    fy = src_h / self.video_height
+                    crop_w, crop_x = int(crop_w * fx), int(crop_x * fx)
+                    crop_h, crop_y = int(crop_h * fy), int(crop_y * fy)
+                    px = fx
+            
+            if crop_active:
+                filters.append(f"crop={crop_w}:{crop_h}:{crop_x}:{crop_y}")
+            
+            # Масштабирование (только если Canvas выключен)
+            if not params.canvas_enabled:
+                scale_w = params.scale_width.strip()
+                scale_h = params.scale_height.strip()
+                
+                if scale_w or scale_h:
+                    sw = scale_w if scale_w else "-1"
+                    sh = scale_h if scale_h else "-1"
+                    if preview_size:
+                        sw, sh, px = self._preview_scale_target(sw, sh, preview_size, px)
+                    filters.append(f"scale={sw}:{sh}")
+                
+            # Поворот
+            if rotation == 90:
+                filters.append("transpose=1")
+            elif rotation == 180:
+                filters.append("transpose=1,transpose=1")
+            elif rotation == 270:
+                filters.append("transpose=2")
+                
+            # Отражение
+            if params.hflip:
+                filters.append("hflip")
+            if params.vflip:
+                filters.append("vflip")
+            
+        # Цветокоррекция (eq фильтр)
+        eq_parts = []
+        
+        brightness = params.brightness
+        if brightness != 0:
+            eq_parts.append(f"brightness={brightness}")
+            
+        contrast = params.contrast
+        if contrast != 1:
+            eq_parts.append(f"contrast={contrast}")
+            
+        saturation = params.saturation
+        if saturation != 1:
+            eq_parts.append(f"saturation={saturation}")
+            
+        gamma = params.gamma
+        if gamma != 1:
+            eq_parts.append(f"gamma={gamma}")
+            
+        gamma_r = params.gamma_r
+        if gamma_r != 1:
+            eq_parts.append(f"gamma_r={gamma_r}")
+            
+        gamma_g = params.gamma_g
+        if gamma_g != 1:
+            eq_parts.append(f"gamma_g={gamma_g}")
+            
+        gamma_b = params.gamma_b
+        if gamma_b != 1:
+            eq_parts.append(f"gamma_b={gamma_b}")
+            
+        if eq_parts:
+            filters.append(f"eq={':'.join(eq_parts)}")
+            
+        # Тон (hue)
+        hue = params.hue
+        if hue != 0:
+            filters.append(f"hue=h={hue}")
+            
+        # Резкость
+        sharpen = params.sharpen
+        if sharpen > 0:
+            amount = sharpen
+            m = 3 if tier == "draft" else odd_size(5 * px, 3)
+            filters.append(f"unsharp={m}:{m}:{amount}:{m}:{m}:{amount}")
+            
+        # Размытие
+        blur = params.blur
+        if blur > 0:
+            if px != 1:
+                blur = round(blur * px, 2)
+            filters.append(draft_blur_filter(blur) if tier == "draft" else f"boxblur={blur}:1")
+            
+        # Шумоподавление
+        denoise = params.denoise_strength
+        if denoise > 0:
+            if tier == "draft":
+                # Только пространственная часть: кадр превью обрабатывается отдельно
+                filters.append(f"hqdn3d={denoise}:{round(denoise * 0.75, 2)}:0:0")
+            else:
+                p, pc, r, rc = (odd_size(v * px) for v in (7, 5, 3, 3))
+                filters.append(f"nlmeans={denoise}:{p}:{pc}:{r}:{rc}")
+            
+        # Виньетка (только если Canvas выключен)
+        if not params.canvas_enabled:
+            vignette = params.vignette
+            if vignette > 0:
+                filters.append(f"vignette=PI/{4/vignette if vignette > 0 else 4}")
+            
+        # Цветовые эффекты
+        if params.colorize:
+            filters.append("colorchannelmixer=.3:.4:.3:0:.3:.4:.3:0:.3:.4:.3")
+            
+        if params.negate:
+            filters.append("negate")
+            
+        # Пресет эквалайзера
+        preset = params.eq_preset
+        preset_filters = {
+            "vintage": "curves=vintage",
+            "cool": "colortemperature=t=9000",
+            "warm": "colortemperature=t=4500",
+            "dramatic": "eq=contrast=1.3:saturation=1.2:gamma=0.8",
+            "muted": "eq=saturation=0.6:contrast=0.9",
+            "vibrant": "eq=saturation=1.5:contrast=1.1",
+        }
+        
+        if preset in preset_filters:
+            filters.append(preset_filters[preset])
+            
+        # Скорость
+        speed = params.speed
+        if speed != 1.0:
+            filters.append(f"setpts={1/speed}*PTS")
+            
+        # Кастомный фильтр
+        custom = params.custom_filter.strip()
+        if custom:
+            filters.append(custom)
+            
+        return ",".join(filters) if filters else None
+    
+    def _preview_scale_target(self, sw, sh, preview_size, px):
+        """Размеры из вкладки «Масштабирование», вписанные в область превью
+        
+        Возвращает (ширина, высота, множитель для ядер фильтров после масштабирования).
+        Выражения (iw/2 и т.п.) остаются как есть - они и так следуют за входом.
+        """
+        try:
+            target_w, target_h = int(sw), int(sh)
+        except ValueError:
+            return sw, sh, px
+            
+        known = [(size, limit) for size, limit in ((target_w, preview_size[0]), (target_h, preview_size[1]))
+                 if size > 0]
+        if not known:
+            return sw, sh, px
+            
+        factor = min(1.0, *(limit / size for size, limit in known))
+        if factor >= 1:
+            return sw, sh, 1.0
+            
+        sw = str(even_size(target_w * factor)) if target_w > 0 else sw
+        sh = str(even_size(target_h * factor)) if target_h > 0 else sh
+        return sw, sh, factor
+    
+    def build_canvas_filter(self, params, preview_size=None, tier="normal", mask_dir=None):
+        """Построение complex filter для Canvas Effect
+        
+        preview_size=(w, h): вариант для превью в уменьшенном разрешении
+        tier="draft": черновое превью (быстрый фон, см. build_filter_chain)
+        mask_dir: маска скругления копируется сюда из локального кэша
+        (воркеры фермы видят только общий диск)
+        """
+        if not params.canvas_enabled:
+            return None
+            
+        scale = params.canvas_scale
+        blur = int(params.canvas_blur)
+        corner_radius = int(params.canvas_corner_radius)
+        corner_smooth = params.canvas_corner_smooth  # Множитель области скругления
+        bg_zoom = params.canvas_bg_zoom
+        noise = int(params.canvas_noise)  # Интенсивность шума
+        vignette = params.canvas_vignette
+        
+        # Расчёт размеров
+        w = self.video_width
+        h = self.video_height
+        
+        # Превью: вся композиция строится в уменьшенном разрешении,
+        # размеры и радиусы пересчитываются тем же множителем
+        px = 1.0
+        input_scale = ""
+        if preview_size:
+            factor = preview_factor(w, h, preview_size)
+            if factor < 1:
+                w, h = even_size(w * factor), even_size(h * factor)
+                px = factor
+                blur = max(1, int(round(blur * px)))
+                # Шум после понижения разрешения выглядел бы сильнее, чем в экспорте
+                noise = int(round(noise * px))
+            # Вход приводится к расчётному размеру (превью может читать прокси)
+            input_scale = f"scale={w}:{h},"
+            
+        fg_w = int(w * scale)
+        fg_h = int(h * scale)
+        # Делаем размеры чётными
+        fg_w = fg_w if fg_w % 2 == 0 else fg_w - 1
+        fg_h = fg_h if fg_h % 2 == 0 else fg_h - 1
+        
+        bg_w = int(w * bg_zoom)
+        bg_h = int(h * bg_zoom)
+        bg_w = bg_w if bg_w % 2 == 0 else bg_w - 1
+        bg_h = bg_h if bg_h % 2 == 0 else bg_h - 1
+        
+        # Построение complex filter
+        # 1. Сплит на два потока
+        # 2. Фон: увеличить + размыть + обрезать до оригинального размера
+        # 3. Передний план: уменьшить + закруглить углы
+        # 4. Наложить по центру
+        # 5. Добавить виньетку и шум
+        
+        filter_parts = []
+        
+        # Сплит входа
+        filter_parts.append(f"[0:v]{input_scale}split=2[bg][fg]")
+        
+        # Обработка фона: увеличить, размыть, обрезать до оригинального размера
+        background = canvas_background_filter(
+            w, h, bg_w, bg_h, blur, fast=tier == "draft" or params.canvas_bg_fast
+        )
+        filter_parts.append(f"[bg]{background}[bg_out]")
+        
+        # Обработка переднего плана с закруглёнными углами
+        # corner_smooth увеличивает область скругления (не только радиус, но и "толщину")
+        mask_path = None
+        if corner_radius > 0:
+            # r - радиус скругления
+            # s - область скругления (умножается на радиус для определения зоны)
+            r = corner_radius if px == 1 else max(1, int(round(corner_radius * px)))
+            s = int(corner_radius * corner_smooth * px)  # Расширенная область для проверки
+            
+            # Маска зависит только от размеров и скругления - строится один раз
+            # (кэш на диске) и накладывается alphamerge; единственный кадр маски
+            # повторяется для всех кадров видео
+            try:
+                mask_path = rounded_mask_path(fg_w, fg_h, r, s)
+                if mask_dir is not None:
+                    mask_path = shutil.copy(mask_path, mask_dir)
+            except OSError as e:
+                print(f"Маска скругления не создана, используется geq: {e}")
+                
+        if mask_path:
+            filter_parts.append(
+                f"[fg]scale={fg_w}:{fg_h},format=rgba,format=gbrap[fg_base];"
+                f"movie={escape_filter_path(mask_path)},format=gray[fg_mask];"
+                f"[fg_base][fg_mask]alphamerge[fg_rounded]"
+            )
+        elif corner_radius > 0:
+            # Формула для закругления углов через альфа-канал
+            # s определяет зону где происходит проверка (область скругления)
+            # r определяет сам радиус окружности внутри этой зоны
+            filter_parts.append(
+                f"[fg]scale={fg_w}:{fg_h},format=rgba,"
+                f"geq="
+                f"'r=r(X,Y)':g='g(X,Y)':b='b(X,Y)':"
+                f"a='if(lt(X,{s})*lt(Y,{s}),if(lte(hypot({s}-X,{s}-Y),{r}),255,0),"
+                f"if(gt(X,W-{s})*lt(Y,{s}),if(lte(hypot(X-W+{s},{s}-Y),{r}),255,0),"
+                f"if(lt(X,{s})*gt(Y,H-{s}),if(lte(hypot({s}-X,Y-H+{s}),{r}),255,0),"
+                f"if(gt(X,W-{s})*gt(Y,H-{s}),if(lte(hypot(X-W+{s},Y-H+{s}),{r}),255,0),"
+                f"255))))'"
+                f"[fg_rounded]"
+            )
+        else:
+            filter_parts.append(f"[fg]scale={fg_w}:{fg_h},format=rgba[fg_rounded]")
+        
+        # Наложение по центру
+        filter_parts.append(f"[bg_out][fg_rounded]overlay=(W-w)/2:(H-h)/2:format=auto[composed]")
+        
+        current_label = "[composed]"
+        
+        # Добавление виньетки поверх композиции (если включена)
+        if vignette > 0:
+            filter_parts.append(f"{current_label}vignette=PI/{4/vignette if vignette > 0 else 4}[vignette_out]")
+            current_label = "[vignette_out]"
+        
+        # Добавление шума (если включен). В черновике без временного шума (allf=t):
+        # иначе каждый кадр превью отличался бы и не брался бы из кэша
+        if noise > 0:
+            temporal = "" if tier == "draft" else ":allf=t"
+            filter_parts.append(f"{current_label}noise=c0s={noise}{temporal}[noise_out]")
+            current_label = "[noise_out]"
+            
+        # Дополнительные фильтры поверх Canvas
+        extra_filters = self.build_filter_chain(params, for_canvas_fg=True, preview_size=preview_size, tier=tier)
+        if extra_filters:
+            filter_parts.append(f"{current_label}{extra_filters}[out]")
+            current_label = "[out]"
+        
+        return ";".join(filter_parts), current_label.strip("[]")
+    
+    def build_audio_filter(self, params):
+        """Построение аудио фильтра с правильной синхронизацией"""
+        filters = []
+        
+        pitch = 1.0
+        speed = params.speed
+        
+        # Pitch изменение через asetrate
+        # ВАЖНО: asetrate+aresample изменяет длительность!
+        # Нужно компенсировать через atempo
+        if params.audio_pitch_enabled:
+            pitch = params.audio_pitch
+            if pitch != 1.0:
+                sr = self.video_sample_rate
+                new_sr = int(sr * pitch)
+                # asetrate меняет pitch, но укорачивает/удлиняет аудио
+                filters.append(f"asetrate={new_sr},aresample={sr}")
+        
+        # Рассчитываем итоговый atempo с компенсацией pitch
+        # Формула: итоговый_tempo = speed / pitch (или speed * (1/pitch))
+        # - 1/pitch компенсирует изменение длительности от asetrate
+        # - speed применяет желаемую скорость
+        
+        if pitch != 1.0 or speed != 1.0:
+            # Итоговый коэффициент tempo
+            final_tempo = speed / pitch if pitch != 1.0 else speed
+            
+            # atempo работает в диапазоне 0.5-2.0
+            # Для значений вне диапазона нужна цепочка
+            self._add_atempo_chain(filters, final_tempo)
+                
+        return ",".join(filters) if filters else None
+    
+    def _add_atempo_chain(self, filters, tempo):
+        """Добавление цепочки atempo для любого значения tempo"""
+        if tempo == 1.0:
+            return
+            
+        # atempo работает только в диапазоне [0.5, 2.0]
+        # Для других значений нужна цепочка
+        remaining = tempo
+        
+        while remaining < 0.5 or remaining > 2.0:
+            if remaining < 0.5:
+                filters.append("atempo=0.5")
+                remaining /= 0.5
+            elif remaining > 2.0:
+                filters.append("atempo=2.0")
+                remaining /= 2.0
+        
+        # Добавляем оставшееся значение
+        if remaining != 1.0:
+            filters.append(f"atempo={remaining:.6f}")
+        
+    def build_video_filter_args(self, params, preview_size=None, tier="normal", mask_dir=None):
+        """Аргументы видеофильтров (-vf или -filter_complex с -map) без входа и выхода
+        
+        preview_size=(w, h): граф для превью в разрешении области превью
+        tier: уровень качества превью (PREVIEW_TIERS); "exact" - граф экспорта
+        в полном разрешении, вписывание в область превью добавляется отдельно
+        mask_dir: каталог для файлов графа (см. build_canvas_filter)
+        """
+        if not preview_size:
+            tier = "exact"  # Экспорт - всегда точный граф
+        elif tier == "exact":
+            preview_size = FULL_RESOLUTION
+            
+        # Пиксельные параметры своего фильтра пересчитать нельзя - превью в полном
+        # разрешении (вход только приводится к размеру исходника)
+        if preview_size and params.custom_filter.strip():
+            preview_size = FULL_RESOLUTION
+            
+        # Проверяем, используется ли Canvas Effect и есть ли корректные размеры видео
+        canvas_enabled = params.canvas_enabled
+        canvas_can_be_used = canvas_enabled and self.video_width > 0 and self.video_height > 0
+        
+        if canvas_can_be_used:
+            # Complex filter для Canvas
+            canvas_result = self.build_canvas_filter(params, preview_size=preview_size, tier=tier, mask_dir=mask_dir)
+            if canvas_result:
+                canvas_filter, output_label = canvas_result
+                return ["-filter_complex", canvas_filter, "-map", f"[{output_label}]"]
+            return []
+            
+        # Обычные фильтры (force_build=True если canvas включен, но не может быть использован)
+        filter_chain = self.build_filter_chain(
+            params, force_build=canvas_enabled, preview_size=preview_size, tier=tier
+        )
+        if filter_chain:
+            return ["-vf", filter_chain]
+        return []
+        
+    def build_ffmpeg_command(self, params, input_path, output_path, preview_mode=False, preview_video=False,
+                             preview_size=None, preview_tier="normal", preview_time=0.0):
+        """Построение полной команды FFmpeg
+        
+        preview_size=(w, h) вместе с preview_mode: кадр вписывается в w x h
+        и выводится как rawvideo rgb24 (output_path обычно "pipe:1")
+        preview_tier: уровень качества такого кадра (PREVIEW_TIERS)
+        preview_time: позиция кадра или видео-превью в исходнике (секунды)
+        """
+        cmd = [self.ffmpeg_path, "-y"]
+        
+        if preview_mode:
+            # Для превью берём только 1 кадр
+            cmd.extend(["-ss", str(preview_time)])
+        elif preview_video:
+            # Для видео-превью берём 2 секунды
+            cmd.extend(["-ss", str(preview_time)])
+            
+        if preview_mode and preview_size:
+            video_filter_args = fit_filter_args(
+                self.build_video_filter_args(params, preview_size, tier=preview_tier), *preview_size
+            )
+        else:
+            video_filter_args = self.build_video_filter_args(params)
+            
+        # Экспорт с перекодированием: потоки декодера, графа и кодировщика (thread_tuning)
+        input_threads = output_threads = []
+        if not preview_mode and not preview_video and not self.can_copy_video(params, output_path, video_filter_args):
+            input_threads, output_threads = thread_args("-filter_complex" in video_filter_args, self.export_jobs)
+            
+        cmd.extend([*input_threads, "-i", input_path])
+        cmd.extend(video_filter_args)
+        # Аудио только для видео, не для изображений (preview_mode)
+        if "-filter_complex" in video_filter_args and not preview_mode:
+            cmd.extend(["-map", "0:a?"])
+            
+        if preview_mode:
+            # Только 1 кадр для превью
+            cmd.extend(["-frames:v", "1"])
+            if preview_size:
+                cmd.extend(RAW_OUTPUT_ARGS)
+        elif preview_video:
+            # 2 секунды для видео-превью
+            cmd.extend(["-t", "2"])
+            cmd.extend(["-preset", "ultrafast"])
+            # Аудио фильтр
+            audio_filter = self.build_audio_filter(params)
+            if audio_filter:
+                cmd.extend(["-af", audio_filter])
+        else:
+            if self.can_copy_video(params, output_path, video_filter_args):
+                # Видеофильтров нет - поток копируется без перекодирования
+                cmd.extend(["-c:v", "copy"])
+            else:
+                cmd.extend(self._export_video_args())
+                frame_rate = self._export_frame_rate(params)
+                if frame_rate:
+                    cmd.extend(["-fps_mode", "cfr", "-r", frame_rate])
+                cmd.extend(output_threads)
+            cmd.extend(self._export_audio_args(params, output_path))
+            cmd.extend(self._export_metadata_args(params))
+                
+        cmd.append(output_path)
+        
+        return cmd
+        
+    def _export_video_args(self, bitrate="8M"):
+        """Настройки кодирования видео при экспорте"""
+        return [
+            "-b:v", bitrate,        # Видео битрейт (по умолчанию 8 Мбит/с)
+            "-preset", "faster",    # Баланс скорости и качества
+        ]
+        
+    def _export_frame_rate(self, params):
+        """Постоянная частота кадров экспорта при изменённой скорости (как у исходника)
+        
+        setpts сжимает метки времени - без явной частоты контейнер с переменной
+        частотой получил бы все кадры с частотой fps * скорость. Так же
+        кодируются сегменты экспорта по частям. None - скорость не меняется.
+        """
+        speed = params.speed
+        if speed <= 0 or speed == 1 or not self.video_fps:
+            return None
+        return str(Fraction(self.video_fps).limit_denominator(1001))
+        
+    def can_copy_video(self, params, output_path, video_filter_args=None):
+        """Экспорт без перекодирования видео: граф пуст и контейнер примет кодек исходника"""
+        if video_filter_args is None:
+            video_filter_args = self.build_video_filter_args(params)
+        return not video_filter_args and container_accepts(output_path, self.video_codec)
+        
+    def _export_audio_args(self, params, output_path=None):
+        """Настройки кодирования и фильтр аудио при экспорте
+        
+        output_path: без аудиофильтра поток копируется, если контейнер примет кодек
+        """
+        audio_filter = self.build_audio_filter(params)
+        if not audio_filter and output_path and container_accepts(output_path, self.audio_codec):
+            return ["-c:a", "copy"]
+            
+        args = ["-b:a", "192k"]     # Аудио битрейт 192 кбит/с
+        
+        # Аудио фильтр
+        if audio_filter:
+            args.extend(["-af", audio_filter])
+        return args
+        
+    def _export_metadata_args(self, params):
+        """Опции метаданных экспортируемого файла"""
+        args = []
+        if params.clear_metadata:
+            args.extend(["-map_metadata", "-1"])
+            
+        if params.random_metadata:
+            # Список популярных программ для монтажа (реалистичные encoder)
+            software_list = [
+                "Adobe Premiere Pro 2024 (Windows)",
+                "DaVinci Resolve 18.6",
+                "Vegas Pro 21.0",
+                "CapCut v11.5.0"
+            ]
+            
+            # Выбираем случайную программу
+            chosen_soft = random.choice(software_list)
+            
+            # Генерируем дату в пределах последних 0-7 дней (ISO 8601)
+            creation_date = self._random_date()
+            
+            args.extend([
+                # Полная очистка старых метаданных
+                "-map_metadata", "-1",
+                
+                # Основные метаданные (имитация реальной программы)
+                "-metadata", f"encoder={chosen_soft}",
+                "-metadata", f"software={chosen_soft}",
+                
+                # Дата создания в формате ISO 8601 (YYYY-MM-DDTHH:MM:SSZ)
+                "-metadata", f"creation_time={creation_date}",
+            ])
+        return args
+        
+    def export_cache_key(self, params, output_path):
+        """Ключ закодированного экспорта в кэше: граф видео, граф аудио и кодирование
+        
+        Метаданные в ключ не входят - они меняются перепаковкой. Вместо
+        контейнера - его кодеки по умолчанию (CONTAINER_DEFAULT_CODECS): запись
+        для .mp4 подходит .mov, но не .avi (mpeg4) и не .webm (vp9).
+        """
+        extension = os.path.splitext(output_path)[1].lower()
+        return export_artifact_key(
+            self.video_path,
+            self.build_video_filter_args(params),
+            self._export_video_args(),
+            self._export_audio_args(params, output_path),
+            CONTAINER_DEFAULT_CODECS.get(extension, extension),
+        )
+        
+    def build_remux_command(self, params, artifact_path, output_path, metadata_args=None):
+        """Перепаковка готового экспорта в output_path с новыми метаданными, без перекодирования"""
+        if metadata_args is None:
+            metadata_args = self._export_metadata_args(params)
+        cmd = [
+            self.ffmpeg_path, "-y",
+            "-i", artifact_path,
+            "-i", self.video_path,  # Только источник метаданных
+            "-map", "0", "-c", "copy",
+        ]
+        if "-map_metadata" not in metadata_args:
+            cmd.extend(["-map_metadata", "1"])
+        cmd.extend([*metadata_args, output_path])
+        return cmd
+        
+    def build_renditions_command(self, params, outputs):
+        """Одна команда FFmpeg для нескольких разрешений
+        
+        outputs - [(имя пресета, путь)], например [("720p", "out_720p.mp4")].
+        Исходник декодируется и фильтруется один раз, split раздаёт кадры веткам
+        scale; высота каждого варианта - высота пресета (SCALE_PRESETS), как в
+        имени файла, ширина - по пропорциям кадра (чётная). Каждый вариант
+        кодируется со своим битрейтом (RENDITION_BITRATES).
+        """
+        heights = {name: res.split("x")[1] for res, name in SCALE_PRESETS}
+        
+        video_filter_args = self.build_video_filter_args(params)
+        if video_filter_args and video_filter_args[0] == "-filter_complex":
+            graph = video_filter_args[1] + ";"
+            source = video_filter_args[3]
+        elif video_filter_args:
+            graph = f"[0:v]{video_filter_args[1]}[filtered];"
+            source = "[filtered]"
+        else:
+            graph = ""
+            source = "[0:v]"
+            
+        branches = "".join(f"[r{i}]" for i in range(len(outputs)))
+        graph += f"{source}split={len(outputs)}{branches}"
+        for i, (name, _) in enumerate(outputs):
+            graph += f";[r{i}]scale=-2:{heights[name]}[v{i}]"
+            
+        # Кодировщики вариантов работают одновременно - потоки делятся между ними
+        input_threads = thread_args(True)[0]
+        encoder_threads = thread_args(True, jobs=len(outputs))[1]
+        cmd = [self.ffmpeg_path, "-y", *input_threads, "-i", self.video_path, "-filter_complex", graph]
+        for i, (name, path) in enumerate(outputs):
+            cmd.extend(["-map", f"[v{i}]", "-map", "0:a?"])
+            cmd.extend(self._export_video_args(RENDITION_BITRATES.get(name, "8M")))
+            cmd.extend(encoder_threads)
+            cmd.extend(self._export_audio_args(params, path))
+            cmd.extend(self._export_metadata_args(params))
+            cmd.append(path)
+        return cmd
+        
+    def build_chunked_export(self, params, output_path, farm=False):
+        """Параллельный экспорт сегментами по ключевым кадрам (None - нет индекса)
+        
+        farm - сегменты кодируют воркеры рендер-фермы (render_farm.py).
+        """
+        if self.keyframe_index is None or self.video_duration <= 0:
+            return None
+            
+        workers = os.cpu_count() or 1
+        count = FARM_SEGMENTS if farm else workers * SEGMENTS_PER_WORKER
+        segments = plan_segments(self.keyframe_index.keyframes, self.video_duration, count)
+        speed = params.speed
+        
+        # Ферма: каталог сегментов создаётся заранее рядом с результатом (общий
+        # диск), туда же кладутся файлы графа - локальный кэш воркерам не виден
+        work_dir = mask_dir = None
+        if farm:
+            work_dir = mask_dir = tempfile.mkdtemp(
+                prefix=".chunks_", dir=os.path.dirname(os.path.abspath(output_path))
+            )
+        
+        export_class = FarmExport if farm else ChunkedExport
+        return export_class(
+            self.ffmpeg_path,
+            # Воркеры фермы видят те же пути на общем диске
+            os.path.abspath(self.video_path),
+            os.path.abspath(output_path),
+            segments,
+            [*self.build_video_filter_args(params, mask_dir=mask_dir), *self._export_video_args()],
+            self._export_audio_args(params, output_path),
+            self._export_metadata_args(params),
+            time_scale=1 / speed if speed > 0 else 1.0,
+            frame_rate=self._export_frame_rate(params),
+            workers=workers,
+            work_dir=work_dir,
+        )
+    
+    def _random_date(self):
+        """Генерация случайной даты в пределах последних 0-7 дней с полностью случайным временем"""
+        import datetime
+        now = datetime.datetime.now()
+        
+        # Случайное количество дней назад (0-7)
+        random_days = random.randint(0, 7)
+        
+        # Полностью случайное время
+        random_hours = random.randint(0, 23)
+        random_minutes = random.randint(0, 59)
+        random_seconds = random.randint(0, 59)
+        
+        # Формируем дату
+        random_date = now - datetime.timedelta(days=random_days)
+        random_date = random_date.replace(
+            hour=random_hours,
+            minute=random_minutes,
+            second=random_seconds,
+            microsecond=0
+        )
+        
+        # Возвращаем в формате ISO 8601 с Z (UTC)
+        return random_date.strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -5,12 +5,13 @@ FFmpeg Video Editor с предпросмотром в реальном врем
 """
 
 import customtkinter as ctk
-from tkinter import filedialog, messagebox
+from tkinter import TclError, filedialog, messagebox
 import subprocess
 import os
 import sys
 import platform
 import threading
+import time
 import tempfile
 from PIL import Image, ImageTk
 import cv2
@@ -21,21 +22,44 @@ import random
 import string
 import uuid
 
-# Определение платформы
-IS_WINDOWS = platform.system() == "Windows"
+from command_builder import (DEFAULT_PARAMS, RENDITION_BITRATES, SCALE_PRESETS, CommandBuilder, ParamsSnapshot,
+                             probe_video)
+from ffmpeg_process import IS_WINDOWS, process_manager, run_subprocess, run_with_progress, shutdown_processes
+from media_cache import (ProxyJob, ThumbnailJob, ThumbnailSprite, THUMB_SIZE, detach_export_output,
+                         find_export_artifact, load_keyframe_index, store_export_artifact)
+from preview_engine import PlaybackStream, PreviewEngine, PreviewEngineError, RenderedFrameCache, image_from_raw
+from preview_scheduler import PreviewScheduler
+from render_farm import FARM_PORT
 
-def run_subprocess(cmd, **kwargs):
-    """Запуск subprocess с правильной обработкой creationflags для разных платформ"""
-    if IS_WINDOWS and 'creationflags' not in kwargs:
-        kwargs['creationflags'] = subprocess.CREATE_NO_WINDOW
-    return subprocess.run(cmd, **kwargs)
+
+# Бюджет кэша готовых кадров превью (МБ)
+RENDERED_CACHE_MB = 256
+
+# Высота ленты миниатюр над слайдером таймлайна
+THUMB_STRIP_HEIGHT = 36
+
+# Уровни качества превью: черновик (дешёвые замены дорогих фильтров), обычное
+# (граф в разрешении превью), точное (граф экспорта на кадре исходника).
+# Экспорт всегда строится точным графом
+PREVIEW_TIERS = {"draft": "Черновик", "normal": "Обычное", "exact": "Точное"}
+
+# Двухступенчатое превью: грубый кадр (уменьшенный в COARSE_PREVIEW_DIVISOR раз)
+# показывается, только если точный рендер дольше COARSE_PREVIEW_AFTER секунд.
+# Точный запускается после паузы в изменениях: REFINE_DELAY_FACTOR длительностей
+# точного рендера, в пределах REFINE_DELAY_MIN..REFINE_DELAY_MAX мс
+COARSE_PREVIEW_DIVISOR = 4
+COARSE_PREVIEW_AFTER = 0.06
+REFINE_DELAY_FACTOR = 1.5
+REFINE_DELAY_MIN = 40
+REFINE_DELAY_MAX = 600
+REFINE_DELAY_DEFAULT = 150
 
 # Настройка темы
 ctk.set_appearance_mode("dark")
 ctk.set_default_color_theme("blue")
 
 
-class FFmpegPreviewEditor(ctk.CTk):
+class FFmpegPreviewEditor(CommandBuilder, ctk.CTk):
     def __init__(self):
         super().__init__()
         
@@ -51,85 +75,54 @@ class FFmpegPreviewEditor(ctk.CTk):
         self.video_width = 0
         self.video_height = 0
         self.video_sample_rate = 44100
+        self.video_codec = ""   # Кодеки исходника (для копирования потоков при экспорте)
+        self.audio_codec = ""
         self.preview_frame = None
         self.preview_time = 0.0
         self.is_playing = False
-        self.play_thread = None
+        self.playback = None  # Поток воспроизведения (preview_engine.PlaybackStream)
         self.ffmpeg_path = "ffmpeg"
         self.ffprobe_path = "ffprobe"
-        
-        # Параметры FFmpeg
+        self.preview_engine = None  # Постоянный движок превью текущего видео
+        self.proxy_path = None      # Прокси-файл для превью (экспорт читает оригинал)
+        self.proxy_job = None
+        self.keyframe_index = None  # Индекс ключевых кадров (media_cache.KeyframeIndex)
+        self.thumbnail_job = None
+        self.thumbnails = None      # Миниатюры таймлайна (media_cache.ThumbnailSprite)
+        self.thumb_popup = None     # Всплывающая миниатюра при наведении на таймлайн
+        self.rendered_frames = RenderedFrameCache(RENDERED_CACHE_MB * 1024 ** 2)
+        self.preview_scheduler = PreviewScheduler()  # Не больше одного рендера превью сразу
+        self.shown_generation = 0  # Поколение запроса, кадр которого сейчас на экране
+        self.exact_render_time = None  # Сглаженная длительность точного рендера превью (с)
+        self.preview_tier = "normal"   # Уровень качества превью (PREVIEW_TIERS)
+        
+        # Параметры FFmpeg (значения по умолчанию - command_builder.DEFAULT_PARAMS)
+        var_types = {bool: ctk.BooleanVar, int: ctk.IntVar, float: ctk.DoubleVar, str: ctk.StringVar}
         self.params = {
-            # Цветокоррекция
-            "brightness": ctk.DoubleVar(value=0),
-            "contrast": ctk.DoubleVar(value=1),
-            "saturation": ctk.DoubleVar(value=1),
-            "gamma": ctk.DoubleVar(value=1),
-            "gamma_r": ctk.DoubleVar(value=1),
-            "gamma_g": ctk.DoubleVar(value=1),
-            "gamma_b": ctk.DoubleVar(value=1),
-            
-            # Резкость и размытие
-            "sharpen": ctk.DoubleVar(value=0),
-            "blur": ctk.DoubleVar(value=0),
-            
-            # Шумоподавление
-            "denoise_strength": ctk.DoubleVar(value=0),
-            
-            # Виньетка
-            "vignette": ctk.DoubleVar(value=0),
-            
-            # Поворот и отражение
-            "rotation": ctk.IntVar(value=0),
-            "hflip": ctk.BooleanVar(value=False),
-            "vflip": ctk.BooleanVar(value=False),
-            
-            # Масштабирование
-            "scale_width": ctk.StringVar(value=""),
-            "scale_height": ctk.StringVar(value=""),
-            
-            # Обрезка
-            "crop_x": ctk.IntVar(value=0),
-            "crop_y": ctk.IntVar(value=0),
-            "crop_w": ctk.IntVar(value=0),
-            "crop_h": ctk.IntVar(value=0),
-            
-            # Скорость
-            "speed": ctk.DoubleVar(value=1.0),
-            
-            # Цветовые эффекты
-            "hue": ctk.DoubleVar(value=0),
-            "colorize": ctk.BooleanVar(value=False),
-            "negate": ctk.BooleanVar(value=False),
-            
-            # Дополнительные фильтры
-            "eq_preset": ctk.StringVar(value="none"),
-            "custom_filter": ctk.StringVar(value=""),
-            
-            # ========== УНИКАЛИЗАЦИЯ ==========
-            # Canvas Effect
-            "canvas_enabled": ctk.BooleanVar(value=False),
-            "canvas_scale": ctk.DoubleVar(value=0.85),  # 0.7 - 1.0
-            "canvas_blur": ctk.DoubleVar(value=25),      # 0 - 50
-            "canvas_corner_radius": ctk.DoubleVar(value=20),  # 0 - 50
-            "canvas_corner_smooth": ctk.DoubleVar(value=1.0),  # 0.5 - 3.0 (множитель области скругления)
-            "canvas_bg_zoom": ctk.DoubleVar(value=1.15),  # 1.0 - 1.3
-            "canvas_noise": ctk.DoubleVar(value=0),  # 0 - 30 (интенсивность шума)
-            "canvas_vignette": ctk.DoubleVar(value=0.3),  # 0 - 1.0
-            
-            # Audio Pitch
-            "audio_pitch": ctk.DoubleVar(value=1.0),  # 0.95 - 1.05
-            "audio_pitch_enabled": ctk.BooleanVar(value=False),
-            
-            # Metadata
-            "clear_metadata": ctk.BooleanVar(value=True),
-            "random_metadata": ctk.BooleanVar(value=True),
+            name: var_types[type(value)](value=value) for name, value in DEFAULT_PARAMS.items()
         }
+        # Последний снимок параметров (command_builder.ParamsSnapshot, см. snapshot_params)
+        self.last_params = ParamsSnapshot()
         
         # Создание интерфейса
         self._create_ui()
         self._bind_params()
         
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+        
+    def _on_close(self):
+        """Закрытие окна: остановка фоновых процессов FFmpeg"""
+        self._stop_playback()
+        if self.proxy_job is not None:
+            self.proxy_job.cancel()
+        if self.thumbnail_job is not None:
+            self.thumbnail_job.cancel()
+        self.preview_scheduler.close()
+        self._close_preview_engine()
+        # Всё, что ещё работает (экспорт, индекс, калибровка), останавливается
+        shutdown_processes()
+        self.destroy()
+        
     def _create_ui(self):
         """Создание основного интерфейса"""
         # Основной контейнер
@@ -160,6 +153,15 @@ class FFmpegPreviewEditor(ctk.CTk):
             font=ctk.CTkFont(size=20, weight="bold")
         ).pack(side="left")
         
+        # Качество превью (на экспорт не влияет)
+        self.tier_selector = ctk.CTkSegmentedButton(
+            header,
+            values=list(PREVIEW_TIERS.values()),
+            command=self._on_preview_tier_change
+        )
+        self.tier_selector.set(PREVIEW_TIERS[self.preview_tier])
+        self.tier_selector.pack(side="left", padx=20)
+        
         # Кнопка загрузки видео
         self.load_btn = ctk.CTkButton(
             header,
@@ -193,6 +195,16 @@ class FFmpegPreviewEditor(ctk.CTk):
         )
         self.preview_label.pack(expand=True)
         
+        # Уровень качества показанного кадра поверх превью
+        self.tier_label = ctk.CTkLabel(
+            self.preview_container,
+            text="",
+            font=ctk.CTkFont(size=11),
+            fg_color="#0f0f1e",
+            text_color="#aaa",
+            corner_radius=6
+        )
+        
         # Таймлайн
         self.timeline_frame = ctk.CTkFrame(self.preview_panel, fg_color="transparent")
         self.timeline_frame.pack(fill="x", padx=15, pady=(0, 10))
@@ -204,16 +216,27 @@ class FFmpegPreviewEditor(ctk.CTk):
         )
         self.time_label.pack(side="left")
         
+        # Дорожка таймлайна: лента миниатюр (после загрузки видео) над слайдером
+        self.timeline_track = ctk.CTkFrame(self.timeline_frame, fg_color="transparent")
+        self.timeline_track.pack(side="left", fill="x", expand=True, padx=10)
+        
+        self.thumb_strip_label = ctk.CTkLabel(self.timeline_track, text="", height=THUMB_STRIP_HEIGHT)
+        
         self.timeline_slider = ctk.CTkSlider(
-            self.timeline_frame,
+            self.timeline_track,
             from_=0,
             to=100,
             command=self._on_timeline_change,
             width=400
         )
-        self.timeline_slider.pack(side="left", fill="x", expand=True, padx=10)
+        self.timeline_slider.pack(fill="x")
         self.timeline_slider.set(0)
         
+        self.timeline_track.bind("<Configure>", lambda e: self._update_thumb_strip())
+        for widget in (self.timeline_slider, self.thumb_strip_label):
+            widget.bind("<Motion>", self._on_timeline_hover, add="+")
+            widget.bind("<Leave>", lambda e: self._hide_thumb_popup(), add="+")
+        
         # Кнопки воспроизведения
         play_frame = ctk.CTkFrame(self.timeline_frame, fg_color="transparent")
         play_frame.pack(side="right")
@@ -524,14 +547,7 @@ class FFmpegPreviewEditor(ctk.CTk):
         presets_frame = ctk.CTkFrame(scroll, fg_color="transparent")
         presets_frame.pack(fill="x")
         
-        scale_presets = [
-            ("1920x1080", "1080p"),
-            ("1280x720", "720p"),
-            ("640x480", "480p"),
-            ("3840x2160", "4K"),
-        ]
-        
-        for res, name in scale_presets:
+        for res, name in SCALE_PRESETS:
             def set_scale(r=res):
                 w, h = r.split("x")
                 self.params["scale_width"].set(w)
@@ -663,6 +679,11 @@ class FFmpegPreviewEditor(ctk.CTk):
         # Слайдеры Canvas
         self._create_slider_row(scroll, "Масштаб видео:", self.params["canvas_scale"], 0.7, 0.95)
         self._create_slider_row(scroll, "Размытие фона:", self.params["canvas_blur"], 5, 50)
+        ctk.CTkCheckBox(
+            scroll,
+            text="⚡ Быстрый фон (размытие в уменьшенном кадре)",
+            variable=self.params["canvas_bg_fast"]
+        ).pack(anchor="w", pady=5)
         self._create_slider_row(scroll, "Радиус углов:", self.params["canvas_corner_radius"], 0, 50)
         self._create_slider_row(scroll, "Область скругл.:", self.params["canvas_corner_smooth"], 0.5, 3.0)
         self._create_slider_row(scroll, "Zoom фона:", self.params["canvas_bg_zoom"], 1.0, 1.3)
@@ -1042,23 +1063,111 @@ class FFmpegPreviewEditor(ctk.CTk):
         )
         self.export_btn.pack()
         
+        self.chunked_export = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(
+            right_frame,
+            text=f"⚡ По частям ({os.cpu_count() or 1} ядер)",
+            variable=self.chunked_export,
+            font=ctk.CTkFont(size=12)
+        ).pack(pady=(6, 0))
+        
+        self.farm_export = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(
+            right_frame,
+            text=f"🖧 На ферме (порт {FARM_PORT})",
+            variable=self.farm_export,
+            font=ctk.CTkFont(size=12)
+        ).pack(pady=(6, 0))
+        
+        self.renditions_btn = ctk.CTkButton(
+            right_frame,
+            text="🎞 " + " / ".join(RENDITION_BITRATES),
+            width=150,
+            height=28,
+            command=self.export_renditions,
+            fg_color="#444",
+            hover_color="#555"
+        )
+        self.renditions_btn.pack(pady=(6, 0))
+        
+        # Прогресс экспорта (показывается только во время экспорта)
+        self.export_progress = ctk.CTkProgressBar(right_frame, width=150)
+        self.export_status = ctk.CTkLabel(
+            right_frame,
+            text="",
+            font=ctk.CTkFont(size=11, family="Consolas"),
+            text_color="#aaa",
+            wraplength=220
+        )
+        
     def _bind_params(self):
         """Привязка обновления превью к изменению параметров"""
         for name, var in self.params.items():
             if isinstance(var, (ctk.DoubleVar, ctk.IntVar, ctk.BooleanVar)):
-                var.trace_add("write", lambda *args: self._schedule_refresh())
+                var.trace_add("write", lambda *args: self._on_param_change())
                 
-        self._refresh_scheduled = False
+        self._refresh_after = None
+        
+    def snapshot_params(self):
+        """Снимок параметров для построителей команд (только из потока интерфейса)
+        
+        Поле, которое сейчас редактируется (пустое, "-"), не читается -
+        берётся значение из предыдущего снимка.
+        """
+        values = {}
+        for name, var in self.params.items():
+            try:
+                values[name] = var.get()
+            except (TclError, ValueError):
+                values[name] = getattr(self.last_params, name)
+        self.last_params = ParamsSnapshot(**values)
+        return self.last_params
+        
+    def _on_param_change(self):
+        """Запись в переменную параметра: обновление, только если значение изменилось
+        
+        Пресеты и сброс записывают и неизменённые параметры - такие записи
+        не перезапускают рендер.
+        """
+        previous = self.last_params
+        if self.snapshot_params() != previous:
+            self._schedule_refresh()
         
     def _schedule_refresh(self):
-        """Отложенное обновление превью"""
-        if not self._refresh_scheduled:
-            self._refresh_scheduled = True
-            self.after(150, self._do_scheduled_refresh)
+        """Обновление превью после изменения параметра или позиции
+        
+        Если точный рендер быстрый, он запускается сразу (устаревшие вытесняет
+        планировщик). Иначе сразу показывается грубый кадр, а точный - когда
+        изменения прекратятся на время, зависящее от измеренной длительности
+        точного рендера.
+        """
+        if self._refresh_after is not None:
+            self.after_cancel(self._refresh_after)
+            self._refresh_after = None
+            
+        render_time = self.exact_render_time
+        if render_time is not None and render_time < COARSE_PREVIEW_AFTER and not self.is_playing:
+            self.refresh_preview()
+            return
+            
+        if render_time is None:
+            delay = REFINE_DELAY_DEFAULT
+        else:
+            delay = min(REFINE_DELAY_MAX, max(REFINE_DELAY_MIN, int(render_time * REFINE_DELAY_FACTOR * 1000)))
+        self._refresh_after = self.after(delay, self._do_scheduled_refresh)
+        
+        if self.video_path and not self.is_playing:
+            params, preview_size = self.snapshot_params(), self._preview_size()
+            position, tier = self.preview_time, self.preview_tier
+            self.preview_scheduler.submit(
+                lambda generation: self._generate_preview(
+                    generation, params, preview_size, position, tier, coarse=True
+                )
+            )
             
     def _do_scheduled_refresh(self):
-        """Выполнение отложенного обновления"""
-        self._refresh_scheduled = False
+        """Выполнение отложенного обновления (точный кадр)"""
+        self._refresh_after = None
         self.refresh_preview()
         
     def load_video(self):
@@ -1070,61 +1179,186 @@ class FFmpegPreviewEditor(ctk.CTk):
         
         path = filedialog.askopenfilename(filetypes=filetypes)
         if path:
+            if self.is_playing:
+                self._stop_playback()
+                self.play_btn.configure(text="▶")
             self.video_path = path
+            self.rendered_frames.clear()
+            self.exact_render_time = None
             self._load_video_info()
+            self._open_preview_engine()
+            self._start_proxy_job()
+            self._start_index_job()
+            self._start_thumbnail_job()
             self.refresh_preview()
             
-    def _load_video_info(self):
-        """Получение информации о видео через ffprobe"""
+    def _start_index_job(self):
+        """Фоновая загрузка (или построение) индекса ключевых кадров"""
+        self.keyframe_index = None
+        video_path = self.video_path
+        
+        def build_index():
+            try:
+                index = load_keyframe_index(self.ffprobe_path, video_path)
+            except Exception as e:
+                print(f"Индекс ключевых кадров не построен: {e}")
+                return
+            self.after(0, lambda: self._on_index_ready(video_path, index))
+            
+        threading.Thread(target=build_index, daemon=True).start()
+        
+    def _on_index_ready(self, video_path, index):
+        """Индекс готов: перемотка привязывается к кадрам, движок знает границы GOP"""
+        if video_path != self.video_path:
+            return
+        self.keyframe_index = index
+        if self.preview_engine is not None:
+            self.preview_engine.set_keyframe_index(index)
+            
+    def _start_thumbnail_job(self):
+        """Фоновое создание (или взятие из кэша) миниатюр таймлайна"""
+        if self.thumbnail_job is not None:
+            self.thumbnail_job.cancel()
+            self.thumbnail_job = None
+        self.thumbnails = None
+        self.thumb_strip_label.pack_forget()
+        self._hide_thumb_popup()
+        
+        if self.video_duration <= 0:
+            return
+        video_path = self.video_path
+        self.thumbnail_job = ThumbnailJob(
+            self.ffmpeg_path,
+            video_path,
+            self.video_duration,
+            lambda sprite_path: self.after(0, lambda: self._on_thumbnails_ready(video_path, sprite_path))
+        )
+        
+    def _on_thumbnails_ready(self, video_path, sprite_path):
+        """Миниатюры готовы: лента над слайдером и превью при наведении"""
+        if video_path != self.video_path:
+            return
         try:
-            cmd = [
-                self.ffprobe_path,
-                "-v", "error",
-                "-select_streams", "v:0",
-                "-show_entries", "stream=width,height,r_frame_rate,duration",
-                "-show_entries", "format=duration",
-                "-of", "json",
-                self.video_path
-            ]
+            self.thumbnails = ThumbnailSprite(sprite_path)
+        except OSError as e:
+            print(f"Миниатюры не загружены: {e}")
+            return
+        self.thumb_strip_label.pack(fill="x", before=self.timeline_slider)
+        self._update_thumb_strip()
+        
+    def _update_thumb_strip(self):
+        """Перерисовка ленты миниатюр под текущую ширину слайдера"""
+        if self.thumbnails is None:
+            return
+        width = self.timeline_slider.winfo_width()
+        if width <= 1:
+            return
+        # winfo_width в реальных пикселях, размер CTkImage - до масштабирования
+        scaling = self.timeline_slider._get_widget_scaling()
+        strip = self.thumbnails.strip(width, int(THUMB_STRIP_HEIGHT * scaling))
+        photo = ctk.CTkImage(
+            light_image=strip,
+            dark_image=strip,
+            size=(max(1, int(width / scaling)), THUMB_STRIP_HEIGHT)
+        )
+        self.thumb_strip_label.configure(image=photo)
+        self.thumb_strip_label.image = photo
+        
+    def _on_timeline_hover(self, event):
+        """Миниатюра кадра под курсором (из спрайта, без FFmpeg)"""
+        if self.thumbnails is None or self.video_duration <= 0:
+            return
+        width = self.timeline_slider.winfo_width()
+        if width <= 1:
+            return
+        x = event.x_root - self.timeline_slider.winfo_rootx()
+        fraction = min(max(x / width, 0.0), 1.0)
+        
+        if self.thumb_popup is None:
+            self.thumb_popup = ctk.CTkToplevel(self)
+            self.thumb_popup.overrideredirect(True)
+            self.thumb_popup.attributes("-topmost", True)
+            self.thumb_popup_label = ctk.CTkLabel(
+                self.thumb_popup,
+                text="",
+                compound="top",
+                font=ctk.CTkFont(size=11, family="Consolas")
+            )
+            self.thumb_popup_label.pack(padx=2, pady=2)
             
-            result = run_subprocess(cmd, capture_output=True, text=True)
-            info = json.loads(result.stdout)
+        thumb = self.thumbnails.thumb_at(fraction)
+        photo = ctk.CTkImage(light_image=thumb, dark_image=thumb, size=THUMB_SIZE)
+        self.thumb_popup_label.configure(image=photo, text=self.format_time(fraction * self.video_duration))
+        self.thumb_popup_label.image = photo
+        
+        popup_w = self.thumb_popup.winfo_reqwidth()
+        popup_h = self.thumb_popup.winfo_reqheight()
+        self.thumb_popup.geometry(
+            f"+{event.x_root - popup_w // 2}+{self.timeline_track.winfo_rooty() - popup_h - 6}"
+        )
+        self.thumb_popup.deiconify()
+        
+    def _hide_thumb_popup(self):
+        """Скрытие всплывающей миниатюры"""
+        if self.thumb_popup is not None:
+            self.thumb_popup.withdraw()
+            
+    def _start_proxy_job(self):
+        """Фоновое создание (или взятие из кэша) прокси-файла для превью"""
+        if self.proxy_job is not None:
+            self.proxy_job.cancel()
+        self.proxy_path = None
+        
+        video_path = self.video_path
+        self.proxy_job = ProxyJob(
+            self.ffmpeg_path,
+            video_path,
+            lambda proxy_path: self.after(0, lambda: self._on_proxy_ready(video_path, proxy_path))
+        )
+        
+    def _on_proxy_ready(self, video_path, proxy_path):
+        """Прокси готов: дальше превью, перемотка и воспроизведение читают его"""
+        if video_path != self.video_path:
+            return
+        self.proxy_path = proxy_path
+        if self.preview_engine is not None:
+            try:
+                self.preview_engine.set_proxy(proxy_path)
+            except PreviewEngineError as e:
+                print(f"Движок превью: {e}")
+                
+    def _open_preview_engine(self):
+        """Запуск постоянного движка превью для текущего видео"""
+        self._close_preview_engine()
+        try:
+            self.preview_engine = PreviewEngine(self.video_path, self.ffmpeg_path)
+        except Exception as e:
+            # Без движка превью работает через разовый запуск FFmpeg
+            print(f"Движок превью недоступен: {e}")
+            self.preview_engine = None
             
-            stream = info.get("streams", [{}])[0]
-            self.video_width = stream.get("width", 1920)
-            self.video_height = stream.get("height", 1080)
+    def _close_preview_engine(self):
+        """Остановка движка превью"""
+        if self.preview_engine is not None:
+            self.preview_engine.close()
+            self.preview_engine = None
             
-            # FPS
-            fps_str = stream.get("r_frame_rate", "30/1")
-            if "/" in fps_str:
-                num, den = fps_str.split("/")
-                self.video_fps = float(num) / float(den)
-            else:
-                self.video_fps = float(fps_str)
-                
-            # Длительность
-            self.video_duration = float(info.get("format", {}).get("duration", 
-                                        stream.get("duration", 10)))
+    def _load_video_info(self):
+        """Получение информации о видео через ffprobe"""
+        try:
+            video = probe_video(self.ffprobe_path, self.video_path)
+            self.video_width = video["width"]
+            self.video_height = video["height"]
+            self.video_fps = video["fps"]
+            self.video_duration = video["duration"]
+            self.video_sample_rate = video["sample_rate"]
+            self.video_codec = video["video_codec"]
+            self.audio_codec = video["audio_codec"]
             
             # Обновить обрезку по умолчанию
             self.params["crop_w"].set(self.video_width)
             self.params["crop_h"].set(self.video_height)
             
-            # Получить sample rate аудио
-            cmd_audio = [
-                self.ffprobe_path,
-                "-v", "error",
-                "-select_streams", "a:0",
-                "-show_entries", "stream=sample_rate",
-                "-of", "json",
-                self.video_path
-            ]
-            result_audio = run_subprocess(cmd_audio, capture_output=True, text=True)
-            audio_info = json.loads(result_audio.stdout)
-            audio_stream = audio_info.get("streams", [{}])
-            if audio_stream:
-                self.video_sample_rate = int(audio_stream[0].get("sample_rate", 44100))
-            
         except Exception as e:
             print(f"Ошибка получения информации о видео: {e}")
             self.video_duration = 10
@@ -1132,444 +1366,38 @@ class FFmpegPreviewEditor(ctk.CTk):
             self.video_width = 1920
             self.video_height = 1080
             self.video_sample_rate = 44100
+            self.video_codec = ""
+            self.audio_codec = ""
             
-    def build_filter_chain(self, for_canvas_fg=False, force_build=False):
-        """Построение цепочки фильтров FFmpeg
-        
-        for_canvas_fg=True: строим только цветовые фильтры для наложения поверх Canvas
-        force_build=True: строим фильтры даже когда Canvas включен (fallback)
-        """
-        filters = []
-        
-        # Если Canvas включен и это НЕ для переднего плана, пропускаем обычные фильтры
-        # (они будут применены к композиции)
-        # force_build позволяет строить фильтры даже когда Canvas включен
-        if self.params["canvas_enabled"].get() and not for_canvas_fg and not force_build:
-            return None
-        
-        # Геометрические фильтры НЕ применяются поверх Canvas (for_canvas_fg=True)
-        # Они применяются только к исходному видео
-        if not for_canvas_fg:
-            # Обрезка (должна быть первой)
-            crop_w = self.params["crop_w"].get()
-            crop_h = self.params["crop_h"].get()
-            crop_x = self.params["crop_x"].get()
-            crop_y = self.params["crop_y"].get()
-            
-            if crop_w > 0 and crop_h > 0:
-                if crop_w != self.video_width or crop_h != self.video_height or crop_x != 0 or crop_y != 0:
-                    filters.append(f"crop={crop_w}:{crop_h}:{crop_x}:{crop_y}")
-            
-            # Масштабирование (только если Canvas выключен)
-            if not self.params["canvas_enabled"].get():
-                scale_w = self.params["scale_width"].get().strip()
-                scale_h = self.params["scale_height"].get().strip()
-                
-                if scale_w or scale_h:
-                    sw = scale_w if scale_w else "-1"
-                    sh = scale_h if scale_h else "-1"
-                    filters.append(f"scale={sw}:{sh}")
-                
-            # Поворот
-            rotation = self.params["rotation"].get()
-            if rotation == 90:
-                filters.append("transpose=1")
-            elif rotation == 180:
-                filters.append("transpose=1,transpose=1")
-            elif rotation == 270:
-                filters.append("transpose=2")
-                
-            # Отражение
-            if self.params["hflip"].get():
-                filters.append("hflip")
-            if self.params["vflip"].get():
-                filters.append("vflip")
-            
-        # Цветокоррекция (eq фильтр)
-        eq_parts = []
-        
-        brightness = self.params["brightness"].get()
-        if brightness != 0:
-            eq_parts.append(f"brightness={brightness}")
-            
-        contrast = self.params["contrast"].get()
-        if contrast != 1:
-            eq_parts.append(f"contrast={contrast}")
-            
-        saturation = self.params["saturation"].get()
-        if saturation != 1:
-            eq_parts.append(f"saturation={saturation}")
-            
-        gamma = self.params["gamma"].get()
-        if gamma != 1:
-            eq_parts.append(f"gamma={gamma}")
-            
-        gamma_r = self.params["gamma_r"].get()
-        if gamma_r != 1:
-            eq_parts.append(f"gamma_r={gamma_r}")
-            
-        gamma_g = self.params["gamma_g"].get()
-        if gamma_g != 1:
-            eq_parts.append(f"gamma_g={gamma_g}")
-            
-        gamma_b = self.params["gamma_b"].get()
-        if gamma_b != 1:
-            eq_parts.append(f"gamma_b={gamma_b}")
-            
-        if eq_parts:
-            filters.append(f"eq={':'.join(eq_parts)}")
-            
-        # Тон (hue)
-        hue = self.params["hue"].get()
-        if hue != 0:
-            filters.append(f"hue=h={hue}")
-            
-        # Резкость
-        sharpen = self.params["sharpen"].get()
-        if sharpen > 0:
-            amount = sharpen
-            filters.append(f"unsharp=5:5:{amount}:5:5:{amount}")
-            
-        # Размытие
-        blur = self.params["blur"].get()
-        if blur > 0:
-            filters.append(f"boxblur={blur}:1")
-            
-        # Шумоподавление
-        denoise = self.params["denoise_strength"].get()
-        if denoise > 0:
-            filters.append(f"nlmeans={denoise}:7:5:3:3")
-            
-        # Виньетка (только если Canvas выключен)
-        if not self.params["canvas_enabled"].get():
-            vignette = self.params["vignette"].get()
-            if vignette > 0:
-                filters.append(f"vignette=PI/{4/vignette if vignette > 0 else 4}")
-            
-        # Цветовые эффекты
-        if self.params["colorize"].get():
-            filters.append("colorchannelmixer=.3:.4:.3:0:.3:.4:.3:0:.3:.4:.3")
-            
-        if self.params["negate"].get():
-            filters.append("negate")
-            
-        # Пресет эквалайзера
-        preset = self.params["eq_preset"].get()
-        preset_filters = {
-            "vintage": "curves=vintage",
-            "cool": "colortemperature=t=9000",
-            "warm": "colortemperature=t=4500",
-            "dramatic": "eq=contrast=1.3:saturation=1.2:gamma=0.8",
-            "muted": "eq=saturation=0.6:contrast=0.9",
-            "vibrant": "eq=saturation=1.5:contrast=1.1",
-        }
-        
-        if preset in preset_filters:
-            filters.append(preset_filters[preset])
-            
-        # Скорость
-        speed = self.params["speed"].get()
-        if speed != 1.0:
-            filters.append(f"setpts={1/speed}*PTS")
-            
-        # Кастомный фильтр
-        custom = self.params["custom_filter"].get().strip()
-        if custom:
-            filters.append(custom)
-            
-        return ",".join(filters) if filters else None
-    
-    def build_canvas_filter(self):
-        """Построение complex filter для Canvas Effect"""
-        if not self.params["canvas_enabled"].get():
-            return None
-            
-        scale = self.params["canvas_scale"].get()
-        blur = int(self.params["canvas_blur"].get())
-        corner_radius = int(self.params["canvas_corner_radius"].get())
-        corner_smooth = self.params["canvas_corner_smooth"].get()  # Множитель области скругления
-        bg_zoom = self.params["canvas_bg_zoom"].get()
-        noise = int(self.params["canvas_noise"].get())  # Интенсивность шума
-        vignette = self.params["canvas_vignette"].get()
-        
-        # Расчёт размеров
-        w = self.video_width
-        h = self.video_height
-        
-        fg_w = int(w * scale)
-        fg_h = int(h * scale)
-        # Делаем размеры чётными
-        fg_w = fg_w if fg_w % 2 == 0 else fg_w - 1
-        fg_h = fg_h if fg_h % 2 == 0 else fg_h - 1
-        
-        bg_w = int(w * bg_zoom)
-        bg_h = int(h * bg_zoom)
-        bg_w = bg_w if bg_w % 2 == 0 else bg_w - 1
-        bg_h = bg_h if bg_h % 2 == 0 else bg_h - 1
-        
-        # Построение complex filter
-        # 1. Сплит на два потока
-        # 2. Фон: увеличить + размыть + обрезать до оригинального размера
-        # 3. Передний план: уменьшить + закруглить углы
-        # 4. Наложить по центру
-        # 5. Добавить виньетку и шум
-        
-        filter_parts = []
-        
-        # Сплит входа
-        filter_parts.append(f"[0:v]split=2[bg][fg]")
-        
-        # Обработка фона: увеличить, размыть, обрезать до оригинального размера
-        filter_parts.append(f"[bg]scale={bg_w}:{bg_h},boxblur={blur}:{blur},crop={w}:{h}[bg_out]")
-        
-        # Обработка переднего плана с закруглёнными углами
-        # corner_smooth увеличивает область скругления (не только радиус, но и "толщину")
-        if corner_radius > 0:
-            # r - радиус скругления
-            # s - область скругления (умножается на радиус для определения зоны)
-            r = corner_radius
-            s = int(corner_radius * corner_smooth)  # Расширенная область для проверки
-            
-            # Формула для закругления углов через альфа-канал
-            # s определяет зону где происходит проверка (область скругления)
-            # r определяет сам радиус окружности внутри этой зоны
-            filter_parts.append(
-                f"[fg]scale={fg_w}:{fg_h},format=rgba,"
-                f"geq="
-                f"'r=r(X,Y)':g='g(X,Y)':b='b(X,Y)':"
-                f"a='if(lt(X,{s})*lt(Y,{s}),if(lte(hypot({s}-X,{s}-Y),{r}),255,0),"
-                f"if(gt(X,W-{s})*lt(Y,{s}),if(lte(hypot(X-W+{s},{s}-Y),{r}),255,0),"
-                f"if(lt(X,{s})*gt(Y,H-{s}),if(lte(hypot({s}-X,Y-H+{s}),{r}),255,0),"
-                f"if(gt(X,W-{s})*gt(Y,H-{s}),if(lte(hypot(X-W+{s},Y-H+{s}),{r}),255,0),"
-                f"255))))'"
-                f"[fg_rounded]"
-            )
-        else:
-            filter_parts.append(f"[fg]scale={fg_w}:{fg_h},format=rgba[fg_rounded]")
-        
-        # Наложение по центру
-        filter_parts.append(f"[bg_out][fg_rounded]overlay=(W-w)/2:(H-h)/2:format=auto[composed]")
-        
-        current_label = "[composed]"
-        
-        # Добавление виньетки поверх композиции (если включена)
-        if vignette > 0:
-            filter_parts.append(f"{current_label}vignette=PI/{4/vignette if vignette > 0 else 4}[vignette_out]")
-            current_label = "[vignette_out]"
-        
-        # Добавление шума (если включен)
-        if noise > 0:
-            filter_parts.append(f"{current_label}noise=c0s={noise}:allf=t[noise_out]")
-            current_label = "[noise_out]"
-            
-        # Дополнительные фильтры поверх Canvas
-        extra_filters = self.build_filter_chain(for_canvas_fg=True)
-        if extra_filters:
-            filter_parts.append(f"{current_label}{extra_filters}[out]")
-            current_label = "[out]"
-        
-        return ";".join(filter_parts), current_label.strip("[]")
-    
-    def build_audio_filter(self):
-        """Построение аудио фильтра с правильной синхронизацией"""
-        filters = []
-        
-        pitch = 1.0
-        speed = self.params["speed"].get()
-        
-        # Pitch изменение через asetrate
-        # ВАЖНО: asetrate+aresample изменяет длительность!
-        # Нужно компенсировать через atempo
-        if self.params["audio_pitch_enabled"].get():
-            pitch = self.params["audio_pitch"].get()
-            if pitch != 1.0:
-                sr = self.video_sample_rate
-                new_sr = int(sr * pitch)
-                # asetrate меняет pitch, но укорачивает/удлиняет аудио
-                filters.append(f"asetrate={new_sr},aresample={sr}")
-        
-        # Рассчитываем итоговый atempo с компенсацией pitch
-        # Формула: итоговый_tempo = speed / pitch (или speed * (1/pitch))
-        # - 1/pitch компенсирует изменение длительности от asetrate
-        # - speed применяет желаемую скорость
-        
-        if pitch != 1.0 or speed != 1.0:
-            # Итоговый коэффициент tempo
-            final_tempo = speed / pitch if pitch != 1.0 else speed
-            
-            # atempo работает в диапазоне 0.5-2.0
-            # Для значений вне диапазона нужна цепочка
-            self._add_atempo_chain(filters, final_tempo)
-                
-        return ",".join(filters) if filters else None
-    
-    def _add_atempo_chain(self, filters, tempo):
-        """Добавление цепочки atempo для любого значения tempo"""
-        if tempo == 1.0:
-            return
-            
-        # atempo работает только в диапазоне [0.5, 2.0]
-        # Для других значений нужна цепочка
-        remaining = tempo
-        
-        while remaining < 0.5 or remaining > 2.0:
-            if remaining < 0.5:
-                filters.append("atempo=0.5")
-                remaining /= 0.5
-            elif remaining > 2.0:
-                filters.append("atempo=2.0")
-                remaining /= 2.0
-        
-        # Добавляем оставшееся значение
-        if remaining != 1.0:
-            filters.append(f"atempo={remaining:.6f}")
-        
-    def build_ffmpeg_command(self, input_path, output_path, preview_mode=False, preview_video=False):
-        """Построение полной команды FFmpeg"""
-        cmd = [self.ffmpeg_path, "-y"]
-        
-        if preview_mode:
-            # Для превью берём только 1 кадр
-            cmd.extend(["-ss", str(self.preview_time)])
-        elif preview_video:
-            # Для видео-превью берём 2 секунды
-            cmd.extend(["-ss", str(self.preview_time)])
-            
-        cmd.extend(["-i", input_path])
-        
-        # Проверяем, используется ли Canvas Effect и есть ли корректные размеры видео
-        canvas_enabled = self.params["canvas_enabled"].get()
-        canvas_can_be_used = canvas_enabled and self.video_width > 0 and self.video_height > 0
-        
-        if canvas_can_be_used:
-            # Complex filter для Canvas
-            canvas_result = self.build_canvas_filter()
-            if canvas_result:
-                canvas_filter, output_label = canvas_result
-                cmd.extend(["-filter_complex", canvas_filter])
-                cmd.extend(["-map", f"[{output_label}]"])
-                # Аудио только для видео, не для изображений (preview_mode)
-                if not preview_mode:
-                    cmd.extend(["-map", "0:a?"])
-        else:
-            # Обычные фильтры (force_build=True если canvas включен, но не может быть использован)
-            filter_chain = self.build_filter_chain(force_build=canvas_enabled)
-            if filter_chain:
-                cmd.extend(["-vf", filter_chain])
-            
-        if preview_mode:
-            # Только 1 кадр для превью
-            cmd.extend(["-frames:v", "1"])
-        elif preview_video:
-            # 2 секунды для видео-превью
-            cmd.extend(["-t", "2"])
-            cmd.extend(["-preset", "ultrafast"])
-            # Аудио фильтр
-            audio_filter = self.build_audio_filter()
-            if audio_filter:
-                cmd.extend(["-af", audio_filter])
-        else:
-            # Настройки качества видео
-            cmd.extend(["-b:v", "8M"])           # Видео битрейт 8 Мбит/с
-            cmd.extend(["-preset", "faster"])    # Баланс скорости и качества
-            
-            # Настройки качества аудио
-            cmd.extend(["-b:a", "192k"])         # Аудио битрейт 192 кбит/с
-            
-            # Аудио фильтр
-            audio_filter = self.build_audio_filter()
-            if audio_filter:
-                cmd.extend(["-af", audio_filter])
-                
-            # Метаданные
-            if self.params["clear_metadata"].get():
-                cmd.extend(["-map_metadata", "-1"])
-                
-            if self.params["random_metadata"].get():
-                # Список популярных программ для монтажа (реалистичные encoder)
-                software_list = [
-                    "Adobe Premiere Pro 2024 (Windows)",
-                    "DaVinci Resolve 18.6",
-                    "Vegas Pro 21.0",
-                    "CapCut v11.5.0"
-                ]
-                
-                # Выбираем случайную программу
-                chosen_soft = random.choice(software_list)
-                
-                # Генерируем дату в пределах последних 0-7 дней (ISO 8601)
-                creation_date = self._random_date()
-                
-                cmd.extend([
-                    # Полная очистка старых метаданных
-                    "-map_metadata", "-1",
-                    
-                    # Основные метаданные (имитация реальной программы)
-                    "-metadata", f"encoder={chosen_soft}",
-                    "-metadata", f"software={chosen_soft}",
-                    
-                    # Дата создания в формате ISO 8601 (YYYY-MM-DDTHH:MM:SSZ)
-                    "-metadata", f"creation_time={creation_date}",
-                ])
-                
-        cmd.append(output_path)
-        
-        return cmd
-    
-    def _random_date(self):
-        """Генерация случайной даты в пределах последних 0-7 дней с полностью случайным временем"""
-        import datetime
-        now = datetime.datetime.now()
-        
-        # Случайное количество дней назад (0-7)
-        random_days = random.randint(0, 7)
-        
-        # Полностью случайное время
-        random_hours = random.randint(0, 23)
-        random_minutes = random.randint(0, 59)
-        random_seconds = random.randint(0, 59)
-        
-        # Формируем дату
-        random_date = now - datetime.timedelta(days=random_days)
-        random_date = random_date.replace(
-            hour=random_hours,
-            minute=random_minutes,
-            second=random_seconds,
-            microsecond=0
-        )
-        
-        # Возвращаем в формате ISO 8601 с Z (UTC)
-        return random_date.strftime("%Y-%m-%dT%H:%M:%SZ")
-        
-    def get_display_command(self):
-        """Получение команды для отображения"""
+    def get_display_command(self, params):
+        """Получение команды для отображения (params - ParamsSnapshot)"""
         if not self.video_path:
             return "ffmpeg -i input.mp4 output.mp4"
             
         parts = ["ffmpeg", "-i", '"input.mp4"']
         
-        canvas_enabled = self.params["canvas_enabled"].get()
+        canvas_enabled = params.canvas_enabled
         
         if canvas_enabled:
             # Упрощённое отображение для Canvas
-            scale = self.params["canvas_scale"].get()
-            blur = int(self.params["canvas_blur"].get())
-            radius = int(self.params["canvas_corner_radius"].get())
+            scale = params.canvas_scale
+            blur = int(params.canvas_blur)
+            radius = int(params.canvas_corner_radius)
             parts.append(f'-filter_complex "Canvas: scale={scale:.2f}, blur={blur}, radius={radius}"')
         else:
-            filter_chain = self.build_filter_chain()
+            filter_chain = self.build_filter_chain(params)
             if filter_chain:
                 parts.extend(["-vf", f'"{filter_chain}"'])
         
         # Audio filter
-        audio_filter = self.build_audio_filter()
+        audio_filter = self.build_audio_filter(params)
         if audio_filter:
             parts.extend(["-af", f'"{audio_filter}"'])
             
         # Metadata
-        if self.params["clear_metadata"].get():
+        if params.clear_metadata:
             parts.append("-map_metadata -1")
-        if self.params["random_metadata"].get():
+        if params.random_metadata:
             parts.append("-metadata title=RANDOM")
             
         parts.append('"output.mp4"')
@@ -1581,53 +1409,151 @@ class FFmpegPreviewEditor(ctk.CTk):
         if not self.video_path:
             return
             
+        # Снимок параметров: поток превью не обращается к переменным Tk
+        params = self.snapshot_params()
+        
         # Обновить команду
-        self.cmd_label.configure(text=self.get_display_command())
+        self.cmd_label.configure(text=self.get_display_command(params))
+        
+        if self.is_playing:
+            # Новый граф или позиция - перезапуск потока воспроизведения
+            self._start_playback()
+            return
         
-        # Генерация превью в отдельном потоке
-        threading.Thread(target=self._generate_preview, daemon=True).start()
+        # Генерация превью в фоне: устаревшие запросы вытесняются новыми
+        preview_size = self._preview_size()
+        position, tier = self.preview_time, self.preview_tier
+        self.preview_scheduler.submit(
+            lambda generation: self._generate_preview(generation, params, preview_size, position, tier)
+        )
         
-    def _generate_preview(self):
-        """Генерация кадра превью"""
-        try:
-            with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-                tmp_path = tmp.name
-                
-            cmd = self.build_ffmpeg_command(self.video_path, tmp_path, preview_mode=True)
+    def _preview_size(self):
+        """Размер области превью (кадр вписывается в него на стороне FFmpeg)"""
+        container_width = self.preview_container.winfo_width() - 20
+        container_height = self.preview_container.winfo_height() - 20
+        
+        if container_width < 100:
+            container_width = 750
+        if container_height < 100:
+            container_height = 450
+            
+        return container_width, container_height
+        
+    def _generate_preview(self, generation, params, preview_size, position, tier, coarse=False):
+        """Генерация кадра превью (generation - поколение запроса в планировщике)
+        
+        params (ParamsSnapshot), preview_size, позиция кадра position и уровень
+        качества tier сняты в потоке интерфейса: при перетаскивании слайдера
+        self.preview_time меняется, пока кадр рендерится, и кадр попал бы в кэш
+        под чужой позицией.
+        
+        coarse=True: грубый кадр - ключевой кадр вместо точного, уменьшенное
+        разрешение, черновой граф. Если кадр выбранного качества уже есть в
+        кэше, показывается он.
+        """
+        scheduler = self.preview_scheduler
+        if not scheduler.is_current(generation):
+            return
+            
+        filter_args = self.build_video_filter_args(params, preview_size, tier=tier)
+        
+        # Уже показанное состояние - без запуска FFmpeg (аудиограф на кадр не влияет)
+        cache_key = RenderedFrameCache.make_key(filter_args, position, preview_size, tier)
+        img = self.rendered_frames.get(cache_key)
+        if img is not None:
+            self._display_preview(img, generation, tier, preview_size)
+            return
+            
+        engine = self.preview_engine
+        if coarse:
+            if engine is None:
+                # Без движка каждый рендер - запуск FFmpeg, грубый кадр не быстрее
+                return
+            coarse_size = tuple(max(2, v // COARSE_PREVIEW_DIVISOR) for v in preview_size)
+            abort = threading.Event()
+            scheduler.set_cancel(generation, abort.set)
+            try:
+                img = engine.render(
+                    position, self.build_video_filter_args(params, coarse_size, tier="draft"),
+                    coarse_size, coarse=True, abort=abort
+                )
+            except PreviewEngineError as e:
+                if scheduler.is_current(generation):
+                    print(f"Движок превью: {e}")
+                return
+            self._display_preview(img, generation, "draft", preview_size)
+            return
             
-            result = run_subprocess(
-                cmd, 
-                capture_output=True, 
-                text=True
+        started = time.monotonic()
+        if engine is not None:
+            # Долгий рендер устаревшего запроса прерывается (отмена - только этого вызова)
+            abort = threading.Event()
+            scheduler.set_cancel(generation, abort.set)
+            try:
+                # Копия: кадр движка ссылается на переиспользуемый буфер
+                # Точное качество декодирует оригинал в полном разрешении
+                img = engine.render(
+                    position, filter_args, preview_size, source_resolution=tier == "exact",
+                    abort=abort
+                ).copy()
+                self._record_render_time(time.monotonic() - started)
+                self.rendered_frames.put(cache_key, img)
+                self._display_preview(img, generation, tier, preview_size)
+                return
+            except PreviewEngineError as e:
+                if not scheduler.is_current(generation):
+                    return
+                # Откат на разовый запуск FFmpeg (он же покажет ошибку фильтра)
+                print(f"Движок превью: {e}")
+                
+        try:
+            # Кадр приходит в stdout как rawvideo rgb24 размера preview_size
+            source = self.video_path if tier == "exact" else self.proxy_path or self.video_path
+            cmd = self.build_ffmpeg_command(
+                params, source, "pipe:1", preview_mode=True, preview_size=preview_size, preview_tier=tier,
+                preview_time=position
             )
             
-            if os.path.exists(tmp_path) and os.path.getsize(tmp_path) > 0:
-                self._display_preview(tmp_path)
+            # Превью не ждёт очереди экспорта
+            call = process_manager().start(cmd, capture_output=True, limited=False)
+            # Устаревший запрос убивает процесс
+            scheduler.set_cancel(generation, call.cancel)
+            result = call.result()
+            stdout, stderr = result.stdout, result.stderr
+            if call.returncode != 0 and not scheduler.is_current(generation):
+                return
+            
+            width, height = preview_size
+            if len(stdout) >= width * height * 3:
+                img = image_from_raw(stdout, width, height)
+                self._record_render_time(time.monotonic() - started)
+                self.rendered_frames.put(cache_key, img)
+                self._display_preview(img, generation, tier, preview_size)
             else:
-                print(f"FFmpeg error: {result.stderr}")
-                
-            # Удалить временный файл
-            try:
-                os.unlink(tmp_path)
-            except:
-                pass
+                print(f"FFmpeg error: {stderr.decode('utf-8', 'replace')}")
                 
         except Exception as e:
             print(f"Ошибка генерации превью: {e}")
             
-    def _display_preview(self, image_path):
-        """Отображение превью в интерфейсе"""
-        try:
-            img = Image.open(image_path)
+    def _record_render_time(self, elapsed):
+        """Учёт длительности точного рендера (экспоненциальное сглаживание)"""
+        if self.exact_render_time is None:
+            self.exact_render_time = elapsed
+        else:
+            self.exact_render_time += (elapsed - self.exact_render_time) * 0.3
             
-            # Масштабирование под размер контейнера
-            container_width = self.preview_container.winfo_width() - 20
-            container_height = self.preview_container.winfo_height() - 20
+    def _display_preview(self, img, generation, tier, preview_size):
+        """Отображение превью (PIL.Image уровня качества tier) в интерфейсе
+
+        Готовый кадр устаревшего запроса показывается (при перетаскивании
+        слайдера это промежуточные состояния), но никогда поверх более нового.
+        """
+        if generation < self.shown_generation:
+            return
             
-            if container_width < 100:
-                container_width = 750
-            if container_height < 100:
-                container_height = 450
+        try:
+            # Масштабирование под размер контейнера
+            container_width, container_height = preview_size
                 
             # Сохраняем пропорции
             img_ratio = img.width / img.height
@@ -1640,27 +1566,50 @@ class FFmpegPreviewEditor(ctk.CTk):
                 new_height = container_height
                 new_width = int(container_height * img_ratio)
                 
-            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+            # Кадр из FFmpeg уже вписан в контейнер - повторное масштабирование не нужно
+            if img.size != (new_width, new_height):
+                img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
             
             # Конвертация для Tkinter
             photo = ctk.CTkImage(light_image=img, dark_image=img, size=(new_width, new_height))
             
             # Обновление в главном потоке
-            self.after(0, lambda: self._update_preview_label(photo))
+            self.after(0, lambda: self._update_preview_label(photo, generation, tier))
             
         except Exception as e:
             print(f"Ошибка отображения: {e}")
             
-    def _update_preview_label(self, photo):
+    def _update_preview_label(self, photo, generation, tier):
         """Обновление лейбла превью"""
+        # Пока кадр ждал главного потока, мог быть показан более новый
+        # (во время воспроизведения кадры идут из потока воспроизведения)
+        if generation < self.shown_generation or self.is_playing:
+            return
+        self.shown_generation = generation
+        
         self.preview_label.configure(image=photo, text="")
         self.preview_label.image = photo  # Сохраняем ссылку
+        self._show_tier(tier)
         
         # Обновить время
         current = self.format_time(self.preview_time)
         total = self.format_time(self.video_duration)
         self.time_label.configure(text=f"{current} / {total}")
         
+    def _show_tier(self, tier):
+        """Уровень качества показанного кадра в углу превью"""
+        self.tier_label.configure(text=f" {PREVIEW_TIERS[tier]} ")
+        self.tier_label.place(relx=1.0, x=-10, y=10, anchor="ne")
+        
+    def _on_preview_tier_change(self, value):
+        """Смена уровня качества превью"""
+        self.preview_tier = next(tier for tier, name in PREVIEW_TIERS.items() if name == value)
+        self.refresh_preview()
+        
+    def _playback_tier(self):
+        """Уровень качества воспроизведения: точный граф в реальном времени не успевает"""
+        return "draft" if self.preview_tier == "draft" else "normal"
+        
     def format_time(self, seconds):
         """Форматирование времени"""
         mins = int(seconds // 60)
@@ -1671,7 +1620,11 @@ class FFmpegPreviewEditor(ctk.CTk):
         """Обработка изменения таймлайна"""
         if self.video_duration > 0:
             self.preview_time = (float(value) / 100) * self.video_duration
-            self.refresh_preview()
+            if self.keyframe_index is not None:
+                # Привязка к реальному кадру: позиции слайдера внутри одного кадра
+                # не приводят к повторному декодированию
+                self.preview_time = self.keyframe_index.frame_time(self.preview_time)
+            self._schedule_refresh()
             
     def toggle_play(self):
         """Включение/выключение воспроизведения превью"""
@@ -1679,32 +1632,91 @@ class FFmpegPreviewEditor(ctk.CTk):
             return
             
         if self.is_playing:
-            self.is_playing = False
+            self._stop_playback()
             self.play_btn.configure(text="▶")
+            # Точный кадр в месте остановки
+            self.refresh_preview()
         else:
+            if self.preview_time >= self.video_duration:
+                self.preview_time = 0.0
             self.is_playing = True
             self.play_btn.configure(text="⏸")
-            self.play_thread = threading.Thread(target=self._play_loop, daemon=True)
-            self.play_thread.start()
+            self._start_playback()
             
-    def _play_loop(self):
-        """Цикл воспроизведения"""
-        import time
-        
-        while self.is_playing and self.preview_time < self.video_duration:
-            self.preview_time += 0.5  # Шаг 0.5 секунды
+    def _start_playback(self):
+        """Запуск (или перезапуск) потока воспроизведения с текущей позиции"""
+        if self.playback is not None:
+            self.playback.stop()
+            self.playback = None
             
-            # Обновить слайдер
-            progress = (self.preview_time / self.video_duration) * 100
-            self.after(0, lambda p=progress: self.timeline_slider.set(p))
+        params = self.snapshot_params()
+        preview_size = self._preview_size()
+        start = self.preview_time
+        speed = params.speed or 1.0
+        
+        def on_frame(img, index):
+            # CTkImage создаётся в фоне, как и для обычного превью
+            photo = ctk.CTkImage(light_image=img, dark_image=img, size=img.size)
+            position = start + index / self.video_fps
+            self.after(0, lambda: self._show_playback_frame(stream, photo, position))
             
-            # Обновить превью
-            self.refresh_preview()
+        def on_end(error):
+            self.after(0, lambda: self._on_playback_end(stream, error))
             
-            time.sleep(0.5)
+        try:
+            # Прокси (все кадры ключевые, низкое разрешение) декодируется быстрее
+            stream = PlaybackStream(
+                self.ffmpeg_path,
+                self.proxy_path or self.video_path,
+                start,
+                self.build_video_filter_args(params, preview_size, tier=self._playback_tier()),
+                preview_size,
+                self.video_fps * speed,
+                on_frame,
+                on_end
+            )
+        except OSError as e:
+            print(f"Ошибка воспроизведения: {e}")
+            self.is_playing = False
+            self.play_btn.configure(text="▶")
+            return
             
-        self.after(0, lambda: self.play_btn.configure(text="▶"))
+        self.playback = stream
+        
+    def _stop_playback(self):
+        """Остановка воспроизведения (процесс FFmpeg завершается)"""
         self.is_playing = False
+        if self.playback is not None:
+            self.playback.stop()
+            self.playback = None
+            
+    def _show_playback_frame(self, stream, photo, position):
+        """Кадр воспроизведения в главном потоке"""
+        if stream is not self.playback:
+            return
+            
+        self.preview_time = min(position, self.video_duration)
+        self.preview_label.configure(image=photo, text="")
+        self.preview_label.image = photo
+        self._show_tier(self._playback_tier())
+        if self.video_duration > 0:
+            self.timeline_slider.set((self.preview_time / self.video_duration) * 100)
+        current = self.format_time(self.preview_time)
+        total = self.format_time(self.video_duration)
+        self.time_label.configure(text=f"{current} / {total}")
+        
+        stream.frame_shown()
+        
+    def _on_playback_end(self, stream, error):
+        """Поток воспроизведения закончился (конец файла или ошибка)"""
+        if stream is not self.playback:
+            return
+            
+        if error:
+            print(f"Ошибка воспроизведения: {error}")
+        self._stop_playback()
+        self.play_btn.configure(text="▶")
+        self.refresh_preview()
         
     def preview_video_clip(self):
         """Создание и воспроизведение 2-секундного превью видео"""
@@ -1712,12 +1724,17 @@ class FFmpegPreviewEditor(ctk.CTk):
             messagebox.showwarning("Предупреждение", "Сначала загрузите видео!")
             return
             
+        params = self.snapshot_params()
+        position = self.preview_time
+        
         def do_preview():
             try:
                 with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as tmp:
                     tmp_path = tmp.name
                     
-                cmd = self.build_ffmpeg_command(self.video_path, tmp_path, preview_video=True)
+                cmd = self.build_ffmpeg_command(
+                    params, self.video_path, tmp_path, preview_video=True, preview_time=position
+                )
                 
                 self.after(0, lambda: self.refresh_btn.configure(text="⏳"))
                 
@@ -1752,55 +1769,12 @@ class FFmpegPreviewEditor(ctk.CTk):
         
     def reset_params(self):
         """Сброс всех параметров"""
-        defaults = {
-            "brightness": 0,
-            "contrast": 1,
-            "saturation": 1,
-            "gamma": 1,
-            "gamma_r": 1,
-            "gamma_g": 1,
-            "gamma_b": 1,
-            "sharpen": 0,
-            "blur": 0,
-            "denoise_strength": 0,
-            "vignette": 0,
-            "rotation": 0,
-            "hflip": False,
-            "vflip": False,
-            "speed": 1.0,
-            "hue": 0,
-            "colorize": False,
-            "negate": False,
-            "eq_preset": "none",
-            # Canvas
-            "canvas_enabled": False,
-            "canvas_scale": 0.85,
-            "canvas_blur": 25,
-            "canvas_corner_radius": 20,
-            "canvas_corner_smooth": 1.0,
-            "canvas_bg_zoom": 1.15,
-            "canvas_noise": 0,
-            "canvas_vignette": 0.3,
-            # Audio
-            "audio_pitch": 1.0,
-            "audio_pitch_enabled": False,
-            # Metadata
-            "clear_metadata": True,
-            "random_metadata": True,
-        }
-        
-        for name, value in defaults.items():
-            if name in self.params:
-                self.params[name].set(value)
-                
-        self.params["scale_width"].set("")
-        self.params["scale_height"].set("")
-        self.params["custom_filter"].set("")
+        for name, value in DEFAULT_PARAMS.items():
+            self.params[name].set(value)
+            
         self.custom_entry.delete("1.0", "end")
         
         if self.video_path:
-            self.params["crop_x"].set(0)
-            self.params["crop_y"].set(0)
             self.params["crop_w"].set(self.video_width)
             self.params["crop_h"].set(self.video_height)
             
@@ -1808,7 +1782,7 @@ class FFmpegPreviewEditor(ctk.CTk):
         
     def copy_command(self):
         """Копирование команды в буфер обмена"""
-        cmd = self.get_display_command()
+        cmd = self.get_display_command(self.snapshot_params())
         self.clipboard_clear()
         self.clipboard_append(cmd)
         
@@ -1819,31 +1793,33 @@ class FFmpegPreviewEditor(ctk.CTk):
     
     def get_uniquify_params(self):
         """Получение параметров уникализации как словарь"""
+        params = self.snapshot_params()
         return {
             # Canvas Effect
-            "canvas_enabled": self.params["canvas_enabled"].get(),
-            "canvas_scale": round(self.params["canvas_scale"].get(), 3),
-            "canvas_blur": int(self.params["canvas_blur"].get()),
-            "canvas_corner_radius": int(self.params["canvas_corner_radius"].get()),
-            "canvas_corner_smooth": round(self.params["canvas_corner_smooth"].get(), 2),
-            "canvas_bg_zoom": round(self.params["canvas_bg_zoom"].get(), 3),
-            "canvas_noise": int(self.params["canvas_noise"].get()),
-            "canvas_vignette": round(self.params["canvas_vignette"].get(), 2),
+            "canvas_enabled": params.canvas_enabled,
+            "canvas_scale": round(params.canvas_scale, 3),
+            "canvas_blur": int(params.canvas_blur),
+            "canvas_bg_fast": params.canvas_bg_fast,
+            "canvas_corner_radius": int(params.canvas_corner_radius),
+            "canvas_corner_smooth": round(params.canvas_corner_smooth, 2),
+            "canvas_bg_zoom": round(params.canvas_bg_zoom, 3),
+            "canvas_noise": int(params.canvas_noise),
+            "canvas_vignette": round(params.canvas_vignette, 2),
             
             # Audio
-            "audio_pitch_enabled": self.params["audio_pitch_enabled"].get(),
-            "audio_pitch": round(self.params["audio_pitch"].get(), 4),
+            "audio_pitch_enabled": params.audio_pitch_enabled,
+            "audio_pitch": round(params.audio_pitch, 4),
             
             # Metadata
-            "clear_metadata": self.params["clear_metadata"].get(),
-            "random_metadata": self.params["random_metadata"].get(),
+            "clear_metadata": params.clear_metadata,
+            "random_metadata": params.random_metadata,
             
             # Color correction (if changed from defaults)
-            "brightness": round(self.params["brightness"].get(), 3),
-            "contrast": round(self.params["contrast"].get(), 3),
-            "saturation": round(self.params["saturation"].get(), 3),
-            "gamma": round(self.params["gamma"].get(), 3),
-            "hue": round(self.params["hue"].get(), 1),
+            "brightness": round(params.brightness, 3),
+            "contrast": round(params.contrast, 3),
+            "saturation": round(params.saturation, 3),
+            "gamma": round(params.gamma, 3),
+            "hue": round(params.hue, 1),
         }
     
     def copy_params_json(self):
@@ -1913,25 +1889,69 @@ class FFmpegPreviewEditor(ctk.CTk):
             return
             
         # Запуск экспорта в отдельном потоке
-        self.export_btn.configure(text="⏳ Экспорт...", state="disabled")
+        params = self.snapshot_params()
+        on_progress = self._begin_export(params)
+        
+        chunked = None
+        farm = self.farm_export.get()
+        video_filter_args = self.build_video_filter_args(params)
+        if self.can_copy_video(params, output_path, video_filter_args):
+            # Копирование быстрее любого параллельного кодирования
+            self.export_note = "Видео копируется без перекодирования"
+            self.export_status.configure(text=self.export_note)
+        elif not video_filter_args:
+            self.export_note = (
+                f"{os.path.splitext(output_path)[1] or '(без расширения)'} не принимает "
+                f"{self.video_codec or '(неизвестный кодек)'} без перекодирования - видео перекодируется"
+            )
+            self.export_status.configure(text=self.export_note)
+            
+        # Кодирование идёт прямо в результат, готовый файл затем попадает в кэш
+        # экспортов. Результат фермы лежит на сетевом диске - его не кэшируем
+        key = cached_path = None
+        extension = os.path.splitext(output_path)[1].lower()
+        if not self.can_copy_video(params, output_path, video_filter_args) and not farm:
+            try:
+                key = self.export_cache_key(params, output_path)
+                cached_path = find_export_artifact(key, extension)
+            except OSError as e:
+                print(f"Кэш экспортов недоступен: {e}")
+                key = None
+                
+        if cached_path is not None:
+            self.export_status.configure(text="Готовое кодирование из кэша - перепаковка")
+        elif (self.chunked_export.get() or farm) and not self.can_copy_video(params, output_path, video_filter_args):
+            chunked = self.build_chunked_export(params, output_path, farm)
+            if chunked is None:
+                print("Экспорт по частям недоступен (нет индекса ключевых кадров) - обычный экспорт")
+            elif farm:
+                host, port = chunked.listen
+                self.export_status.configure(text=f"Ожидание воркеров на {host}:{port}\nтокен: {chunked.token}")
+                
+        encode_cmd = self.build_ffmpeg_command(params, self.video_path, output_path, preview_mode=False)
+        metadata_args = self._export_metadata_args(params)
         
         def do_export():
             try:
-                cmd = self.build_ffmpeg_command(self.video_path, output_path, preview_mode=False)
+                detach_export_output(output_path)
+                returncode = None
+                if cached_path is not None:
+                    returncode, stderr_tail = run_with_progress(
+                        self.build_remux_command(params, cached_path, output_path, metadata_args), on_progress
+                    )
+                    if returncode != 0:
+                        print(f"Готовое кодирование не перепаковывается в {extension} - полный экспорт")
+                        
+                if returncode != 0:
+                    if chunked is not None:
+                        returncode, stderr_tail = chunked.run(on_progress)
+                    else:
+                        returncode, stderr_tail = run_with_progress(encode_cmd, on_progress)
+                        
+                    if returncode == 0 and key is not None:
+                        store_export_artifact(output_path, key, extension)
                 
-                result = run_subprocess(
-                    cmd,
-                    capture_output=True,
-                    text=True
-                )
-                
-                if result.returncode == 0:
-                    success_msg = f"Видео сохранено:\n{output_path}"
-                    self.after(0, lambda msg=success_msg: messagebox.showinfo("Готовo", msg))
-                else:
-                    error_msg = result.stderr[:500] if result.stderr else "Неизвестная ошибка"
-                    error_full = f"Ошибка FFmpeg:\n{error_msg}"
-                    self.after(0, lambda msg=error_full: messagebox.showerror("Ошибка", msg))
+                self._report_export_result(returncode, stderr_tail, f"Видео сохранено:\n{output_path}")
                     
             except Exception as e:
                 # Явно копируем ошибку, чтобы избежать проблем с замыканием
@@ -1939,9 +1959,113 @@ class FFmpegPreviewEditor(ctk.CTk):
                 error_full = f"Ошибка:\n{error_str}"
                 self.after(0, lambda msg=error_full: messagebox.showerror("Ошибка", msg))
             finally:
-                self.after(0, lambda: self.export_btn.configure(text="💾 Экспорт видео", state="normal"))
+                self.after(0, self._finish_export)
                 
         threading.Thread(target=do_export, daemon=True).start()
+        
+    def export_renditions(self):
+        """Экспорт в несколько разрешений (RENDITION_BITRATES) одним проходом FFmpeg"""
+        if not self.video_path:
+            messagebox.showwarning("Предупреждение", "Сначала загрузите видео!")
+            return
+            
+        # Общее имя: к нему добавляется суффикс разрешения (video_720p.mp4)
+        base_path = filedialog.asksaveasfilename(
+            defaultextension=".mp4",
+            filetypes=[
+                ("MP4", "*.mp4"),
+                ("MKV", "*.mkv"),
+            ]
+        )
+        if not base_path:
+            return
+            
+        root, extension = os.path.splitext(base_path)
+        outputs = [(name, f"{root}_{name}{extension}") for name in RENDITION_BITRATES]
+        params = self.snapshot_params()
+        cmd = self.build_renditions_command(params, outputs)
+        on_progress = self._begin_export(params)
+        
+        def do_export():
+            try:
+                returncode, stderr_tail = run_with_progress(cmd, on_progress)
+                saved = "\n".join(path for _, path in outputs)
+                self._report_export_result(returncode, stderr_tail, f"Видео сохранены:\n{saved}")
+            except Exception as e:
+                error_full = f"Ошибка:\n{e}"
+                self.after(0, lambda msg=error_full: messagebox.showerror("Ошибка", msg))
+            finally:
+                self.after(0, self._finish_export)
+                
+        threading.Thread(target=do_export, daemon=True).start()
+        
+    def _begin_export(self, params):
+        """Блокировка кнопок экспорта и показ прогресса; возвращает on_progress для потока экспорта"""
+        self.export_btn.configure(text="⏳ Экспорт...", state="disabled")
+        self.renditions_btn.configure(state="disabled")
+        self.export_progress.set(0)
+        self.export_progress.pack(pady=(6, 0))
+        self.export_status.configure(text="")
+        self.export_status.pack()
+        # Пояснение к экспорту (копирование, вынужденное перекодирование) остаётся над прогрессом
+        self.export_note = ""
+        
+        # Длительность результата для процента и оставшегося времени
+        speed = params.speed
+        expected_duration = self.video_duration / speed if speed > 0 else self.video_duration
+        started = time.monotonic()
+        
+        def on_progress(report):
+            self.after(0, lambda: self._show_export_progress(report, expected_duration, started))
+        return on_progress
+        
+    def _report_export_result(self, returncode, stderr_tail, success_msg):
+        """Сообщение об итоге экспорта (из потока экспорта)"""
+        if returncode == 0:
+            self.after(0, lambda msg=success_msg: messagebox.showinfo("Готовo", msg))
+        else:
+            # Причина ошибки - в конце вывода
+            error_msg = stderr_tail[-500:] if stderr_tail else "Неизвестная ошибка"
+            error_full = f"Ошибка FFmpeg:\n{error_msg}"
+            self.after(0, lambda msg=error_full: messagebox.showerror("Ошибка", msg))
+        
+    def _show_export_progress(self, report, expected_duration, started):
+        """Прогресс экспорта: доля, скорость, оставшееся время и размер файла"""
+        out_time = report["out_time"]
+        parts = []
+        
+        if report["done"]:
+            self.export_progress.set(1)
+        elif out_time is not None and expected_duration > 0:
+            fraction = min(out_time / expected_duration, 1.0)
+            self.export_progress.set(fraction)
+            parts.append(f"{fraction * 100:.0f}%")
+            
+            # Скорость FFmpeg - средняя с начала кодирования
+            speed = report["speed"]
+            if not speed:
+                elapsed = time.monotonic() - started
+                speed = out_time / elapsed if elapsed > 0 else None
+            if speed:
+                parts.append(f"{speed:.2f}x")
+                parts.append(f"осталось {self.format_time(max(expected_duration - out_time, 0) / speed)}")
+                
+        if report["total_size"]:
+            parts.append(f"{report['total_size'] / 1024 ** 2:.1f} МБ")
+        if report["fps"]:
+            parts.append(f"{report['fps']:.0f} fps")
+            
+        text = " · ".join(parts)
+        if self.export_note:
+            text = f"{self.export_note}\n{text}"
+        self.export_status.configure(text=text)
+        
+    def _finish_export(self):
+        """Возврат кнопки экспорта после завершения"""
+        self.export_btn.configure(text="💾 Экспорт видео", state="normal")
+        self.renditions_btn.configure(state="normal")
+        self.export_progress.pack_forget()
+        self.export_status.pack_forget()
 
 
 if __name__ == "__main__":
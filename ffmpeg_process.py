@@ -0,0 +1,347 @@
+"""
+Запуск процессов FFmpeg/FFprobe с учётом особенностей платформы
+
+Разовые вызовы идут через менеджер процессов (ProcessManager): его цикл
+asyncio работает в отдельном потоке, вывод читается построчно по мере
+появления, одновременно запущено не больше MAX_PROCESSES процессов, у каждого
+вызова может быть тайм-аут и отмена, а при закрытии окна все дочерние
+процессы останавливаются (shutdown_processes). Долгоживущие процессы с
+каналами кадров (движок превью) запускаются через popen_subprocess - менеджер
+только останавливает их при закрытии, в лимит они не входят.
+"""
+
+import asyncio
+import collections
+import os
+import platform
+import subprocess
+import threading
+import weakref
+
+# Определение платформы
+IS_WINDOWS = platform.system() == "Windows"
+
+
+def _platform_kwargs(kwargs):
+    """Добавление creationflags, чтобы на Windows не появлялось окно консоли"""
+    if IS_WINDOWS and 'creationflags' not in kwargs:
+        kwargs['creationflags'] = subprocess.CREATE_NO_WINDOW
+    return kwargs
+
+
+# Одновременно запущенных процессов (вызовы с limited=False - вне очереди)
+MAX_PROCESSES = max(4, os.cpu_count() or 1)
+
+# Тайм-аут коротких запросов FFprobe (информация о файле)
+PROBE_TIMEOUT = 30
+
+# Сколько ждать завершения после terminate при закрытии, прежде чем kill
+TERMINATE_GRACE = 2.0
+
+# Предел длины строки вывода при построчном чтении
+STREAM_LIMIT = 1024 ** 2
+
+
+class ProcessCall:
+    """Вызов FFmpeg/FFprobe в менеджере процессов (см. ProcessManager.start)
+
+    result() ждёт завершения из любого потока, кроме потока цикла; cancel()
+    (он же kill()) останавливает процесс или снимает вызов с очереди; poll() -
+    код возврата, None пока процесс не завершён. poll/kill совместимы с Popen.
+    """
+
+    def __init__(self, manager, cmd, on_stdout_line, on_stderr_line, capture_output, text,
+                 timeout, limited):
+        self.cmd = cmd
+        self.on_stdout_line = on_stdout_line
+        self.on_stderr_line = on_stderr_line
+        self.capture_output = capture_output
+        self.text = text
+        self.timeout = timeout
+        self.limited = limited
+        self.returncode = None
+        self.timed_out = False
+
+        self._manager = manager
+        self._cancelled = False
+        self._process = None
+        self._future = None
+
+    def poll(self):
+        return self.returncode
+
+    def cancel(self):
+        self._cancelled = True
+        self._manager._loop.call_soon_threadsafe(self._kill)
+
+    kill = cancel
+
+    def _kill(self):
+        if self._process is not None and self._process.returncode is None:
+            try:
+                self._process.kill()
+            except ProcessLookupError:
+                pass
+
+    def result(self, timeout=None):
+        """subprocess.CompletedProcess; по тайм-ауту вызова - subprocess.TimeoutExpired"""
+        completed = self._future.result(timeout)
+        if self.timed_out:
+            raise subprocess.TimeoutExpired(self.cmd, self.timeout, completed.stdout, completed.stderr)
+        return completed
+
+    def add_done_callback(self, callback):
+        """callback(call) после завершения (из потока цикла)"""
+        self._future.add_done_callback(lambda _: callback(self))
+
+
+async def _pump(stream, on_line, chunks):
+    """Чтение потока процесса до конца: построчно в on_line и/или целиком в chunks"""
+    while True:
+        if on_line is None:
+            data = await stream.read(65536)
+        else:
+            data = await stream.readline()
+        if not data:
+            break
+        if chunks is not None:
+            chunks.append(data)
+        if on_line is not None:
+            on_line(data)
+
+
+class ProcessManager:
+    """Запуск FFmpeg/FFprobe в цикле asyncio отдельного потока"""
+
+    def __init__(self, max_processes=MAX_PROCESSES):
+        self.max_processes = max_processes
+        self._loop = asyncio.new_event_loop()
+        self._semaphore = None
+        self._calls = set()                 # Запущенные вызовы (только из потока цикла)
+        self._popen = weakref.WeakSet()     # Долгоживущие процессы popen_subprocess
+        self._closed = False
+
+        threading.Thread(target=self._loop.run_forever, name="ffmpeg-processes", daemon=True).start()
+
+    def start(self, cmd, on_stdout_line=None, on_stderr_line=None, capture_output=False, text=False,
+              timeout=None, limited=True):
+        """Запуск вызова без ожидания; возвращает ProcessCall
+
+        on_stdout_line/on_stderr_line(bytes) - строки вывода по мере появления
+        (из потока цикла, должны быть быстрыми). capture_output - сохранить
+        вывод целиком для result(), text - декодировать его. timeout - секунд
+        до принудительной остановки. limited=False - без очереди (превью).
+        """
+        if self._closed:
+            raise OSError("Менеджер процессов остановлен")
+        call = ProcessCall(self, cmd, on_stdout_line, on_stderr_line, capture_output, text, timeout, limited)
+        call._future = asyncio.run_coroutine_threadsafe(self._run(call), self._loop)
+        return call
+
+    def track(self, process):
+        """Учёт долгоживущего процесса для остановки при закрытии"""
+        self._popen.add(process)
+
+    async def _run(self, call):
+        if not call.limited:
+            return await self._execute(call)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_processes)
+        async with self._semaphore:
+            return await self._execute(call)
+
+    async def _execute(self, call):
+        if call._cancelled or self._closed:
+            # Отменён, пока ждал очереди
+            call.returncode = -1
+            return subprocess.CompletedProcess(call.cmd, call.returncode, None, None)
+
+        process = await asyncio.create_subprocess_exec(
+            *call.cmd,
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            limit=STREAM_LIMIT, **_platform_kwargs({})
+        )
+        call._process = process
+        self._calls.add(call)
+        if call._cancelled:
+            call._kill()
+
+        stdout = [] if call.capture_output else None
+        stderr = [] if call.capture_output else None
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(
+                    _pump(process.stdout, call.on_stdout_line, stdout),
+                    _pump(process.stderr, call.on_stderr_line, stderr),
+                    process.wait(),
+                ),
+                call.timeout,
+            )
+        except asyncio.TimeoutError:
+            call.timed_out = True
+        finally:
+            if process.returncode is None:
+                call._kill()
+                await process.wait()
+            self._calls.discard(call)
+        call.returncode = process.returncode
+
+        if call.capture_output:
+            stdout, stderr = b"".join(stdout), b"".join(stderr)
+            if call.text:
+                stdout, stderr = stdout.decode("utf-8", "replace"), stderr.decode("utf-8", "replace")
+        return subprocess.CompletedProcess(call.cmd, call.returncode, stdout, stderr)
+
+    def shutdown(self, grace=TERMINATE_GRACE):
+        """Остановка всех дочерних процессов: terminate, через grace секунд - kill"""
+        if self._closed:
+            return
+        self._closed = True
+
+        future = asyncio.run_coroutine_threadsafe(self._terminate_calls(grace), self._loop)
+        try:
+            future.result(grace + 1)
+        except Exception as e:
+            print(f"Остановка процессов: {e}")
+
+        for process in list(self._popen):
+            if process.poll() is None:
+                process.terminate()
+        for process in list(self._popen):
+            try:
+                process.wait(grace)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _terminate_calls(self, grace):
+        calls = [call for call in self._calls if call._process.returncode is None]
+        for call in calls:
+            call._cancelled = True
+            try:
+                call._process.terminate()
+            except ProcessLookupError:
+                pass
+        if calls:
+            await asyncio.wait([asyncio.ensure_future(call._process.wait()) for call in calls], timeout=grace)
+        for call in calls:
+            call._kill()
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def process_manager():
+    """Общий менеджер процессов приложения (создаётся при первом вызове)"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ProcessManager()
+        return _manager
+
+
+def shutdown_processes():
+    """Остановка всех процессов FFmpeg/FFprobe (при закрытии окна)"""
+    with _manager_lock:
+        manager = _manager
+    if manager is not None:
+        manager.shutdown()
+
+
+def run_subprocess(cmd, capture_output=False, text=False, timeout=None, limited=True):
+    """Разовый вызов через менеджер процессов с ожиданием результата
+
+    Возвращает subprocess.CompletedProcess, по тайм-ауту - subprocess.TimeoutExpired.
+    """
+    call = process_manager().start(
+        cmd, capture_output=capture_output, text=text, timeout=timeout, limited=limited
+    )
+    return call.result()
+
+
+def popen_subprocess(cmd, **kwargs):
+    """Запуск долгоживущего процесса (Popen) с теми же creationflags
+
+    Процесс учитывается менеджером и останавливается при закрытии окна.
+    """
+    process = subprocess.Popen(cmd, **_platform_kwargs(kwargs))
+    process_manager().track(process)
+    return process
+
+
+def escape_filter_path(path):
+    """Путь к файлу как значение опции фильтра внутри графа FFmpeg
+
+    Обратные слэши Windows заменяются прямыми, ':' и "'" экранируются для
+    разбора опций, а всё значение берётся в кавычки для разбора графа
+    (так ',', ';' и '[' в пути не ломают граф).
+    """
+    value = path.replace("\\", "/").replace(":", "\\:").replace("'", "\\'")
+    return "'" + value.replace("'", "'\\''") + "'"
+
+
+# Сколько последних строк stderr хранить для сообщения об ошибке
+STDERR_TAIL_LINES = 200
+
+# Машиночитаемый прогресс в stdout вместо строки статистики в stderr
+PROGRESS_ARGS = ["-progress", "pipe:1", "-nostats"]
+
+
+def _number(value, convert=float):
+    """Значение поля -progress (None для N/A и пустых)"""
+    try:
+        return convert(value.rstrip("x"))
+    except (AttributeError, ValueError):
+        return None
+
+
+def _progress_report(block):
+    """Блок полей -progress (ключ=значение до строки progress=...) как словарь
+
+    out_time - секунды результата, speed - во сколько раз быстрее реального
+    времени, total_size - байт записано; None, пока FFmpeg их не знает.
+    """
+    out_time = _number(block.get("out_time_us"), int)
+    return {
+        "out_time": out_time / 1e6 if out_time is not None and out_time >= 0 else None,
+        "fps": _number(block.get("fps")),
+        "speed": _number(block.get("speed")),
+        "total_size": _number(block.get("total_size"), int),
+        "done": block.get("progress") == "end",
+    }
+
+
+def run_with_progress(cmd, on_progress, stderr_lines=STDERR_TAIL_LINES, on_start=None, timeout=None):
+    """Запуск FFmpeg с разбором прогресса вместо буферизации всего вывода
+
+    cmd - полная команда FFmpeg, результат которой пишется не в stdout
+    (-progress добавляется здесь). on_progress(report) вызывается из потока
+    менеджера процессов на каждый блок прогресса (см. _progress_report). Из
+    stderr хранятся только последние stderr_lines строк. on_start(call)
+    получает ProcessCall (например, чтобы его можно было остановить).
+
+    Возвращает (код возврата, последние строки stderr одной строкой).
+    """
+    stderr_tail = collections.deque(maxlen=stderr_lines)
+    block = {}
+
+    def on_stdout_line(raw):
+        key, sep, value = raw.decode("utf-8", "replace").strip().partition("=")
+        if not sep:
+            return
+        block[key] = value
+        if key == "progress":
+            on_progress(_progress_report(block))
+            block.clear()
+
+    def on_stderr_line(raw):
+        stderr_tail.append(raw.decode("utf-8", "replace").rstrip())
+
+    call = process_manager().start(
+        [cmd[0], *PROGRESS_ARGS, *cmd[1:]], on_stdout_line, on_stderr_line, timeout=timeout
+    )
+    if on_start is not None:
+        on_start(call)
+    call.result()
+    return call.returncode, "\n".join(stderr_tail)
@@ -0,0 +1,565 @@
+"""
+Дисковый кэш производных данных видео (прокси-файлы, индексы ключевых кадров,
+миниатюры таймлайна, маски скругления углов Canvas, закодированные экспорты)
+
+Записи привязаны к файлу по ключу путь + размер + время изменения,
+поэтому изменённый или заменённый исходник автоматически получает новые записи.
+"""
+
+import bisect
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from ffmpeg_process import process_manager, run_subprocess
+
+# Корень кэша: %LOCALAPPDATA% на Windows, ~/.cache в остальных системах
+CACHE_ROOT = os.path.join(
+    os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "ffmpeg_editor"
+)
+
+# Прокси: всё в ключевых кадрах (MJPEG), вписано в квадрат PROXY_MAX_SIZE
+PROXY_MAX_SIZE = 960
+PROXY_CACHE_LIMIT = 5 * 1024 ** 3  # Общий объём прокси-файлов на диске
+INDEX_CACHE_LIMIT = 64 * 1024 ** 2  # Общий объём индексов ключевых кадров
+MASK_CACHE_LIMIT = 64 * 1024 ** 2   # Общий объём масок скругления углов
+
+# Построение индекса читает все пакеты файла - на очень длинных видео долго
+KEYFRAME_INDEX_TIMEOUT = 600
+
+# Миниатюры таймлайна: THUMB_COLUMNS x THUMB_ROWS кадров THUMB_SIZE в одном спрайте
+THUMB_COLUMNS = 10
+THUMB_ROWS = 10
+THUMB_SIZE = (160, 90)
+THUMB_CACHE_LIMIT = 256 * 1024 ** 2
+
+# Закодированные экспорты: повторный экспорт с другими метаданными или в другой
+# контейнер только перепаковывает готовые потоки
+EXPORT_CACHE_LIMIT = 8 * 1024 ** 3
+
+# Недописанная запись (.part) не менялась дольше этого (с) - процесс, который её
+# создавал, завершился аварийно; запись удаляется при очистке кэша
+STALE_PART_SECONDS = 3600
+
+
+def cache_dir(kind):
+    """Каталог кэша для данных вида kind (создаётся при необходимости)"""
+    path = os.path.join(CACHE_ROOT, kind)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def file_key(path):
+    """Ключ файла: путь + размер + время изменения"""
+    stat = os.stat(path)
+    raw = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+
+
+def touch(path):
+    """Отметка использования записи (для вытеснения по давности)"""
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def prune_cache(kind, max_bytes, keep=()):
+    """Удаление давно не использованных записей, пока объём больше max_bytes
+
+    Недописанные записи (.part) пропускаются, а брошенные (старше
+    STALE_PART_SECONDS) удаляются всегда.
+    """
+    directory = cache_dir(kind)
+    entries = []
+    now = time.time()
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if name.endswith(".part") or ".part." in name:
+            # Запись ещё создаётся - если её не бросили
+            if now - stat.st_mtime > STALE_PART_SECONDS:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path in keep:
+            continue
+        try:
+            os.unlink(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def export_artifact_key(video_path, *settings):
+    """Ключ закодированного экспорта: исходник + граф видео, граф аудио и настройки кодирования"""
+    raw = json.dumps([file_key(video_path), *settings], ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+
+
+def export_artifact_path(key, extension, partial=False):
+    """Путь закодированного экспорта в контейнере extension (".mp4")
+
+    partial=True - временный файл на время кодирования (расширение сохраняется,
+    по нему FFmpeg выбирает контейнер).
+    """
+    name = f"{key}.part{extension}" if partial else f"{key}{extension}"
+    return os.path.join(cache_dir("exports"), name)
+
+
+def find_export_artifact(key, extension):
+    """Закодированный экспорт из кэша (None - нет), лучше всего в контейнере extension
+
+    Записи одного ключа отличаются только контейнером с теми же кодеками
+    (ключ включает кодеки контейнера, см. CommandBuilder.export_cache_key).
+    """
+    directory = cache_dir("exports")
+    names = [
+        name for name in os.listdir(directory)
+        if os.path.splitext(name)[0] == key
+    ]
+    if not names:
+        return None
+    name = key + extension if key + extension in names else names[0]
+    path = os.path.join(directory, name)
+    touch(path)
+    return path
+
+
+def store_export_artifact(output_path, key, extension):
+    """Сохранение готового экспорта output_path в кэш; возвращает путь записи или None
+
+    Экспорт пишется сразу в результат, кэш получает жёсткую ссылку на него (копию,
+    если кэш на другом диске). Ошибки экспорту не мешают; файл больше
+    EXPORT_CACHE_LIMIT не сохраняется - его сразу вытеснило бы.
+    """
+    artifact_path = export_artifact_path(key, extension)
+    partial_path = export_artifact_path(key, extension, partial=True)
+    try:
+        if os.path.getsize(output_path) > EXPORT_CACHE_LIMIT:
+            return None
+        if os.path.exists(partial_path):
+            os.unlink(partial_path)
+        try:
+            os.link(output_path, partial_path)
+        except OSError:
+            shutil.copyfile(output_path, partial_path)
+        os.replace(partial_path, artifact_path)
+    except OSError as e:
+        print(f"Экспорт не сохранён в кэш: {e}")
+        try:
+            os.unlink(partial_path)
+        except OSError:
+            pass
+        return None
+    prune_cache("exports", EXPORT_CACHE_LIMIT, keep=(artifact_path,))
+    return artifact_path
+
+
+def detach_export_output(output_path):
+    """Удаление прежнего результата, связанного жёсткой ссылкой (с записью кэша)
+
+    FFmpeg перезаписывает существующий файл на месте - иначе вместе с ним
+    испортилась бы запись кэша экспортов.
+    """
+    try:
+        if os.stat(output_path).st_nlink > 1:
+            os.unlink(output_path)
+    except OSError:
+        pass
+
+
+def proxy_path_for(video_path):
+    """Путь прокси-файла для видео (файл может ещё не существовать)"""
+    return os.path.join(cache_dir("proxy"), f"{file_key(video_path)}.mkv")
+
+
+class ProxyJob:
+    """Фоновое создание прокси-файла для превью
+
+    Прокси - уменьшенная копия исходника, где каждый кадр ключевой, поэтому
+    переход к любому моменту декодирует ровно один кадр. Экспорт по-прежнему
+    читает оригинал. on_done(proxy_path) вызывается из фонового потока только
+    при успехе; готовый прокси из кэша отдаётся сразу.
+    """
+
+    def __init__(self, ffmpeg_path, video_path, on_done):
+        self.ffmpeg_path = ffmpeg_path
+        self.video_path = video_path
+        self.on_done = on_done
+        self._process = None
+        self._cancelled = False
+
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        try:
+            proxy_path = proxy_path_for(self.video_path)
+        except OSError as e:
+            print(f"Прокси не создан: {e}")
+            return
+
+        if os.path.exists(proxy_path):
+            touch(proxy_path)
+            self.on_done(proxy_path)
+            return
+
+        # Запись во временный файл: недописанный прокси не должен попасть в кэш
+        partial_path = proxy_path + ".part"
+        size = PROXY_MAX_SIZE
+        cmd = [
+            self.ffmpeg_path, "-y", "-nostdin", "-v", "error",
+            "-i", self.video_path,
+            "-map", "0:v:0", "-an", "-sn", "-dn",
+            "-vf", (
+                f"scale=w='min({size},iw)':h='min({size},ih)'"
+                f":force_original_aspect_ratio=decrease:force_divisible_by=2"
+            ),
+            "-c:v", "mjpeg", "-q:v", "3", "-pix_fmt", "yuvj420p",
+            "-f", "matroska", partial_path,
+        ]
+
+        try:
+            self._process = process_manager().start(cmd, capture_output=True)
+            if self._cancelled:
+                self._process.kill()
+            stderr = self._process.result().stderr
+
+            if self._cancelled or self._process.returncode != 0:
+                if not self._cancelled:
+                    print(f"Ошибка создания прокси: {stderr.decode('utf-8', 'replace')[-500:]}")
+                self._remove(partial_path)
+                return
+
+            os.replace(partial_path, proxy_path)
+            prune_cache("proxy", PROXY_CACHE_LIMIT, keep=(proxy_path,))
+        except OSError as e:
+            print(f"Ошибка создания прокси: {e}")
+            self._remove(partial_path)
+            return
+
+        self.on_done(proxy_path)
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def cancel(self):
+        """Остановка создания (например, при загрузке другого видео)"""
+        self._cancelled = True
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+
+
+class ThumbnailJob:
+    """Фоновое создание спрайта миниатюр таймлайна одним проходом FFmpeg
+
+    Декодируются только ключевые кадры (-skip_frame nokey), fps выбирает
+    равномерно THUMB_COLUMNS * THUMB_ROWS кадров по всей длительности, tile
+    собирает их в одно изображение. on_done(sprite_path) вызывается из
+    фонового потока только при успехе; готовый спрайт из кэша отдаётся сразу.
+    """
+
+    def __init__(self, ffmpeg_path, video_path, duration, on_done):
+        self.ffmpeg_path = ffmpeg_path
+        self.video_path = video_path
+        self.duration = duration
+        self.on_done = on_done
+        self._process = None
+        self._cancelled = False
+
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        width, height = THUMB_SIZE
+        count = THUMB_COLUMNS * THUMB_ROWS
+        try:
+            sprite_path = os.path.join(
+                cache_dir("thumbs"),
+                f"{file_key(self.video_path)}_{count}x{width}x{height}.jpg"
+            )
+        except OSError as e:
+            print(f"Миниатюры не созданы: {e}")
+            return
+
+        if os.path.exists(sprite_path):
+            touch(sprite_path)
+            self.on_done(sprite_path)
+            return
+
+        partial_path = sprite_path + ".part"
+        cmd = [
+            self.ffmpeg_path, "-y", "-nostdin", "-v", "error",
+            "-skip_frame", "nokey",
+            "-i", self.video_path,
+            "-map", "0:v:0", "-an", "-sn", "-dn",
+            "-vf", (
+                # После последнего ключевого кадра fps кадров уже не получит:
+                # tpad повторяет его до конца, лишнее отбрасывает -frames:v 1
+                f"tpad=stop_mode=clone:stop_duration={self.duration:.3f},"
+                f"fps={count / self.duration:.6f},"
+                f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,"
+                f"tile={THUMB_COLUMNS}x{THUMB_ROWS}"
+            ),
+            "-frames:v", "1",
+            "-c:v", "mjpeg", "-q:v", "4", "-f", "image2", partial_path,
+        ]
+
+        try:
+            self._process = process_manager().start(cmd, capture_output=True)
+            if self._cancelled:
+                self._process.kill()
+            stderr = self._process.result().stderr
+
+            if self._cancelled or self._process.returncode != 0 or not os.path.exists(partial_path):
+                if not self._cancelled:
+                    print(f"Ошибка создания миниатюр: {stderr.decode('utf-8', 'replace')[-500:]}")
+                self._remove(partial_path)
+                return
+
+            os.replace(partial_path, sprite_path)
+            prune_cache("thumbs", THUMB_CACHE_LIMIT, keep=(sprite_path,))
+        except OSError as e:
+            print(f"Ошибка создания миниатюр: {e}")
+            self._remove(partial_path)
+            return
+
+        self.on_done(sprite_path)
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def cancel(self):
+        """Остановка создания (например, при загрузке другого видео)"""
+        self._cancelled = True
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+
+
+class ThumbnailSprite:
+    """Доступ к миниатюрам спрайта ThumbnailJob (PIL, без FFmpeg)
+
+    Миниатюра i показывает момент i / count от длительности.
+    """
+
+    def __init__(self, sprite_path):
+        with Image.open(sprite_path) as image:
+            self.image = image.convert("RGB")
+        self.count = THUMB_COLUMNS * THUMB_ROWS
+
+    def thumb(self, index):
+        """Миниатюра с номером index (THUMB_SIZE)"""
+        index = min(max(int(index), 0), self.count - 1)
+        width, height = THUMB_SIZE
+        x = (index % THUMB_COLUMNS) * width
+        y = (index // THUMB_COLUMNS) * height
+        return self.image.crop((x, y, x + width, y + height))
+
+    def thumb_at(self, fraction):
+        """Миниатюра для доли fraction (0..1) длительности"""
+        return self.thumb(fraction * self.count)
+
+    def strip(self, width, height):
+        """Лента миниатюр шириной width: кадры равномерно по всей длительности"""
+        thumb_w = max(1, int(height * THUMB_SIZE[0] / THUMB_SIZE[1]))
+        slots = max(1, -(-width // thumb_w))
+        strip = Image.new("RGB", (width, height))
+        for slot in range(slots):
+            # Кадр из середины участка таймлайна, который покрывает слот
+            fraction = (slot + 0.5) * thumb_w / width
+            thumb = self.thumb_at(min(fraction, 1.0)).resize((thumb_w, height), Image.Resampling.BILINEAR)
+            strip.paste(thumb, (slot * thumb_w, 0))
+        return strip
+
+
+class KeyframeIndex:
+    """Индекс ключевых кадров и меток времени пакетов видеопотока
+
+    Времена в секундах от начала потока (как у -ss и OpenCV). Поиск
+    границ GOP и ближайшего кадра - двоичный, O(log n).
+    """
+
+    # Допуск сравнения времён: ffprobe округляет до микросекунд, OpenCV
+    # считает время кадра в double
+    TOLERANCE = 1e-4
+
+    def __init__(self, keyframes, packets):
+        self.keyframes = sorted(keyframes)
+        self.packets = sorted(packets)
+
+    def keyframe_before(self, time_pos):
+        """Ключевой кадр, с которого начинается декодирование кадра в time_pos"""
+        i = bisect.bisect_right(self.keyframes, time_pos + self.TOLERANCE) - 1
+        return self.keyframes[max(i, 0)] if self.keyframes else 0.0
+
+    def keyframe_after(self, time_pos):
+        """Первый ключевой кадр строго после time_pos (None - до конца файла)"""
+        i = bisect.bisect_right(self.keyframes, time_pos + self.TOLERANCE)
+        return self.keyframes[i] if i < len(self.keyframes) else None
+
+    def gop_bounds(self, time_pos):
+        """Границы GOP, содержащего time_pos: (начало, следующий ключевой кадр или None)"""
+        return self.keyframe_before(time_pos), self.keyframe_after(time_pos)
+
+    def same_gop(self, time_a, time_b):
+        """Лежат ли два момента в одном GOP"""
+        return self.keyframe_before(time_a) == self.keyframe_before(time_b)
+
+    def frame_time(self, time_pos):
+        """Время кадра, который показывается в момент time_pos"""
+        i = bisect.bisect_right(self.packets, time_pos + self.TOLERANCE) - 1
+        return self.packets[max(i, 0)] if self.packets else time_pos
+
+    def to_dict(self):
+        return {"keyframes": self.keyframes, "packets": self.packets}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["keyframes"], data["packets"])
+
+    @classmethod
+    def from_ffprobe_csv(cls, text):
+        """Разбор вывода ffprobe -of csv (секции stream и packet)"""
+        start_time = 0.0
+        keyframes = []
+        packets = []
+        for line in text.splitlines():
+            fields = line.strip().split(",")
+            if fields[0] == "stream" and len(fields) > 1:
+                try:
+                    start_time = float(fields[1])
+                except ValueError:
+                    pass
+            elif fields[0] == "packet" and len(fields) >= 4:
+                # packet,pts_time,dts_time,flags (pts может быть N/A)
+                raw_time = fields[1] if fields[1] not in ("", "N/A") else fields[2]
+                try:
+                    packet_time = float(raw_time)
+                except ValueError:
+                    continue
+                packets.append(packet_time)
+                if "K" in fields[3]:
+                    keyframes.append(packet_time)
+
+        packets = [round(t - start_time, 6) for t in packets]
+        keyframes = [round(t - start_time, 6) for t in keyframes]
+        return cls(keyframes, packets)
+
+
+def load_keyframe_index(ffprobe_path, video_path):
+    """Индекс ключевых кадров из кэша или одним проходом ffprobe по пакетам
+
+    Декодирования нет - читаются только заголовки пакетов. Изменение размера
+    или времени изменения файла даёт новый ключ, старый индекс не используется.
+    """
+    index_path = os.path.join(cache_dir("index"), f"{file_key(video_path)}.json")
+
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                index = KeyframeIndex.from_dict(json.load(f))
+            touch(index_path)
+            return index
+        except (OSError, ValueError, KeyError):
+            pass
+
+    cmd = [
+        ffprobe_path,
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=start_time:packet=pts_time,dts_time,flags",
+        "-of", "csv",
+        video_path
+    ]
+    result = run_subprocess(cmd, capture_output=True, text=True, timeout=KEYFRAME_INDEX_TIMEOUT)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-500:])
+
+    index = KeyframeIndex.from_ffprobe_csv(result.stdout)
+    if not index.keyframes:
+        raise RuntimeError("в потоке не найдено ключевых кадров")
+
+    partial_path = index_path + ".part"
+    with open(partial_path, "w", encoding="utf-8") as f:
+        json.dump(index.to_dict(), f, separators=(",", ":"))
+    os.replace(partial_path, index_path)
+    prune_cache("index", INDEX_CACHE_LIMIT, keep=(index_path,))
+
+    return index
+
+
+def rounded_corner_mask(width, height, radius, zone):
+    """Альфа-маска скруглённых углов (uint8, 255 - видимо, 0 - прозрачно)
+
+    Повторяет прежнее geq-выражение Canvas пиксель в пиксель: в квадратах
+    zone x zone по углам видимы только точки не дальше radius от точки
+    (zone, zone), отсчитанной от соответствующего угла.
+    """
+    x = np.arange(width, dtype=np.float64)[np.newaxis, :]
+    y = np.arange(height, dtype=np.float64)[:, np.newaxis]
+    left, right = x < zone, x > width - zone
+    top, bottom = y < zone, y > height - zone
+    dx_left, dx_right = zone - x, x - width + zone
+    dy_top, dy_bottom = zone - y, y - height + zone
+
+    # Порядок условий как во вложенных if() выражения
+    visible = np.select(
+        [left & top, right & top, left & bottom, right & bottom],
+        [
+            np.hypot(dx_left, dy_top) <= radius,
+            np.hypot(dx_right, dy_top) <= radius,
+            np.hypot(dx_left, dy_bottom) <= radius,
+            np.hypot(dx_right, dy_bottom) <= radius,
+        ],
+        default=True,
+    )
+    return np.where(visible, 255, 0).astype(np.uint8)
+
+
+def rounded_mask_path(width, height, radius, zone):
+    """PNG-маска скругления углов из кэша (создаётся при первом запросе)
+
+    Маска зависит только от размеров переднего плана и параметров
+    скругления, поэтому строится один раз вместо вычисления geq для
+    каждого пикселя каждого кадра. OSError - записать маску не удалось.
+    """
+    path = os.path.join(cache_dir("mask"), f"corners_{width}x{height}_r{radius}_s{zone}.png")
+    if os.path.exists(path):
+        touch(path)
+        return path
+
+    ok, data = cv2.imencode(".png", rounded_corner_mask(width, height, radius, zone))
+    if not ok:
+        raise OSError("не удалось закодировать маску")
+
+    partial_path = path + ".part"
+    with open(partial_path, "wb") as f:
+        f.write(data.tobytes())
+    os.replace(partial_path, path)
+    prune_cache("mask", MASK_CACHE_LIMIT, keep=(path,))
+    return path
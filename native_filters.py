@@ -0,0 +1,412 @@
+"""
+Простые фильтры превью без FFmpeg (NumPy/OpenCV)
+
+Цепочка -vf превью разбирается на операции. Если все фильтры в ней из
+поддерживаемого набора (scale, crop, transpose, hflip, vflip, eq, hue,
+negate, colorchannelmixer, vignette, setpts), кадр обрабатывается прямо в
+памяти, без обмена с процессом фильтров. Формулы повторяют фильтры FFmpeg:
+eq и hue работают в YUV BT.601 ограниченного диапазона, как после
+автоматического преобразования формата. Цветность здесь не прореживается,
+а FFmpeg считает в yuv420p, поэтому на резких цветных границах пиксели
+расходятся на десятки уровней (до 50-75 из 255); в остальном кадре
+отличие - ошибки округления, средняя по кадру 0.2-1.3 уровня. Для превью
+этого достаточно, экспорт всегда идёт через FFmpeg. Граф с любым другим
+фильтром, выражением или -filter_complex остаётся за FFmpeg
+(compile_filter_args вернёт None).
+"""
+
+import math
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# BT.601, ограниченный диапазон (как swscale по умолчанию), RGB 0..255.
+# Матрицы 3x4 для cv2.transform: последний столбец - смещение
+_YUV_OFFSET = np.array([16, 128, 128], dtype=np.float64)
+_RGB_TO_YUV = np.array([
+    [0.256788, 0.504129, 0.097906],
+    [-0.148223, -0.290993, 0.439216],
+    [0.439216, -0.367788, -0.071427],
+])
+_YUV_TO_RGB = np.array([
+    [1.164383, 0.0, 1.596027],
+    [1.164383, -0.391762, -0.812968],
+    [1.164383, 2.017232, 0.0],
+])
+_RGB_TO_YUV_TRANSFORM = np.hstack([_RGB_TO_YUV, _YUV_OFFSET[:, np.newaxis]])
+_YUV_TO_RGB_TRANSFORM = np.hstack([_YUV_TO_RGB, -(_YUV_TO_RGB @ _YUV_OFFSET)[:, np.newaxis]])
+
+# Таблицы negate: в RGB 255 - x, в YUV отражение внутри ограниченного
+# диапазона (Y 16..235, UV 16..240) как у vf_lut
+_LEVELS = np.arange(256)
+_NEGATE_RGB = (255 - _LEVELS).astype(np.uint8)
+_NEGATE_YUV = np.dstack([
+    (high - np.clip(_LEVELS, 16, high) + 16).astype(np.uint8) for high in (235, 240, 240)
+]).reshape(256, 1, 3)
+
+
+class _Frame:
+    """Кадр в процессе обработки: uint8 HxWx3 в пространстве "rgb" или "yuv" """
+
+    def __init__(self, data, space):
+        self.data = data
+        self.space = space
+
+    def to(self, space):
+        if space == self.space:
+            return self.data
+        # cv2.transform округляет и насыщает результат в uint8
+        matrix = _RGB_TO_YUV_TRANSFORM if space == "yuv" else _YUV_TO_RGB_TRANSFORM
+        self.data = cv2.transform(self.data, matrix)
+        self.space = space
+        return self.data
+
+
+def _parse_options(text, names):
+    """'a=1:b=2' или позиционные значения в порядке names -> {имя: строка}
+
+    None - опции, которые разобрать нельзя (неизвестное имя, кавычки и т.п.).
+    """
+    options = {}
+    if not text:
+        return options
+    for position, part in enumerate(text.split(":")):
+        if "=" in part:
+            key, value = part.split("=", 1)
+        elif position < len(names):
+            key, value = names[position], part
+        else:
+            return None
+        if key not in names:
+            return None
+        options[key] = value
+    return options
+
+
+def _number(value):
+    """Число или PI/число, PI*число (иначе ValueError)"""
+    value = value.strip()
+    if value.startswith("PI"):
+        rest = value[2:]
+        if not rest:
+            return math.pi
+        if rest[0] == "/":
+            return math.pi / float(rest[1:])
+        if rest[0] == "*":
+            return math.pi * float(rest[1:])
+        raise ValueError(value)
+    return float(value)
+
+
+def _rescale(a, b, c):
+    """a * b / c с округлением к ближайшему (как av_rescale)"""
+    return (a * b + c // 2) // c
+
+
+def _resize(data, width, height):
+    """Масштабирование (INTER_AREA вниз, бикубическое вверх; lanczos в OpenCV
+    в разы медленнее при незаметной на превью разнице)"""
+    if data.shape[1] == width and data.shape[0] == height:
+        return data
+    if width <= data.shape[1] and height <= data.shape[0]:
+        interpolation = cv2.INTER_AREA
+    else:
+        interpolation = cv2.INTER_CUBIC
+    return cv2.resize(data, (width, height), interpolation=interpolation)
+
+
+def _scale_op(args):
+    options = _parse_options(args, ("w", "h"))
+    if options is None:
+        return None
+    try:
+        target_w = int(options.get("w", "-1"))
+        target_h = int(options.get("h", "-1"))
+    except ValueError:
+        return None
+    # 0 и -n (кроме -1/-2) в превью не встречаются; оба отрицательных - ошибка FFmpeg
+    if 0 in (target_w, target_h) or min(target_w, target_h) < -2 or max(target_w, target_h) < 0:
+        return None
+
+    def apply(frame):
+        height, width = frame.data.shape[:2]
+        w, h = target_w, target_h
+        if w < 0:
+            step = -w
+            w = _rescale(h, width, height * step) * step
+        elif h < 0:
+            step = -h
+            h = _rescale(w, height, width * step) * step
+        frame.data = _resize(frame.data, max(1, w), max(1, h))
+    return apply
+
+
+def _crop_op(args):
+    options = _parse_options(args, ("w", "h", "x", "y"))
+    if options is None:
+        return None
+    try:
+        w, h = int(options["w"]), int(options["h"])
+        x, y = int(options.get("x", "0")), int(options.get("y", "0"))
+    except (KeyError, ValueError):
+        return None
+
+    def apply(frame):
+        height, width = frame.data.shape[:2]
+        if w <= 0 or h <= 0 or x < 0 or y < 0 or x + w > width or y + h > height:
+            raise ValueError("область обрезки за пределами кадра")
+        frame.data = frame.data[y:y + h, x:x + w]
+    return apply
+
+
+def _transpose_op(args):
+    modes = {"0": 0, "cclock_flip": 0, "1": 1, "clock": 1, "2": 2, "cclock": 2, "3": 3, "clock_flip": 3}
+    options = _parse_options(args, ("dir",))
+    if options is None or options.get("dir", "0") not in modes:
+        return None
+    mode = modes[options.get("dir", "0")]
+
+    def apply(frame):
+        data = frame.data
+        if mode == 0:
+            data = cv2.transpose(data)
+        elif mode == 1:
+            data = cv2.rotate(data, cv2.ROTATE_90_CLOCKWISE)
+        elif mode == 2:
+            data = cv2.rotate(data, cv2.ROTATE_90_COUNTERCLOCKWISE)
+        else:
+            data = cv2.rotate(cv2.transpose(data), cv2.ROTATE_180)
+        frame.data = data
+    return apply
+
+
+def _flip_op(code):
+    def compile_flip(args):
+        if args:
+            return None
+
+        def apply(frame):
+            frame.data = cv2.flip(frame.data, code)
+        return apply
+    return compile_flip
+
+
+def _eq_lut(contrast, brightness, gamma, weight):
+    """Таблица одной плоскости как в vf_eq (None - плоскость не меняется)"""
+    if contrast == 1.0 and brightness == 0.0 and gamma == 1.0:
+        return None
+
+    values = np.arange(256, dtype=np.int64)
+    if gamma == 1.0 and abs(contrast) < 7.9:
+        # Целочисленная ветка vf_eq (process_c)
+        c = int(contrast * 256 * 16)
+        b = (int(100.0 * brightness + 100.0) * 511) // 200 - 128 - int(c / 32)
+        return np.clip(((values * c) >> 12) + b, 0, 255).astype(np.uint8)
+
+    v = values / 255.0
+    v = contrast * (v - 0.5) + 0.5 + brightness
+    positive = np.maximum(v, 0.0)
+    v = np.where(v <= 0.0, 0.0, positive * (1.0 - weight) + np.power(positive, 1.0 / gamma) * weight)
+    return np.where(v >= 1.0, 255, np.floor(256.0 * v)).astype(np.uint8)
+
+
+def _eq_op(args):
+    names = ("contrast", "brightness", "saturation", "gamma", "gamma_r", "gamma_g", "gamma_b",
+             "gamma_weight")
+    options = _parse_options(args, names)
+    if options is None:
+        return None
+    try:
+        values = {name: _number(value) for name, value in options.items()}
+    except ValueError:
+        return None
+
+    # Пределы значений опций vf_eq
+    contrast = min(max(values.get("contrast", 1.0), -1000.0), 1000.0)
+    brightness = min(max(values.get("brightness", 0.0), -1.0), 1.0)
+    saturation = min(max(values.get("saturation", 1.0), 0.0), 3.0)
+    gamma, gamma_r, gamma_g, gamma_b = (
+        min(max(values.get(name, 1.0), 0.1), 10.0) for name in ("gamma", "gamma_r", "gamma_g", "gamma_b")
+    )
+    weight = min(max(values.get("gamma_weight", 1.0), 0.0), 1.0)
+
+    luts = (
+        _eq_lut(contrast, brightness, gamma * gamma_g, weight),
+        _eq_lut(saturation, 0.0, math.sqrt(gamma_b / gamma_g), weight),
+        _eq_lut(saturation, 0.0, math.sqrt(gamma_r / gamma_g), weight),
+    )
+    identity = np.arange(256, dtype=np.uint8)
+    # Одна таблица на три плоскости для cv2.LUT
+    table = np.dstack([identity if lut is None else lut for lut in luts]).reshape(256, 1, 3)
+
+    def apply(frame):
+        frame.data = cv2.LUT(frame.to("yuv"), table)
+    return apply
+
+
+def _hue_op(args):
+    options = _parse_options(args, ("h", "s"))
+    if options is None:
+        return None
+    try:
+        degrees = _number(options.get("h", "0"))
+        saturation = _number(options.get("s", "1"))
+    except ValueError:
+        return None
+
+    # Поворот цветности как в vf_hue: целочисленная арифметика с шагом 1/65536
+    angle = degrees * math.pi / 180
+    hue_sin = int(round(math.sin(angle) * (1 << 16) * saturation))
+    hue_cos = int(round(math.cos(angle) * (1 << 16) * saturation))
+    bias = (1 << 15) + (128 << 16)
+    one = 1 << 16
+    transform = np.array([
+        [one, 0, 0, 0],
+        [0, hue_cos, -hue_sin, bias - 128 * (hue_cos - hue_sin)],
+        [0, hue_sin, hue_cos, bias - 128 * (hue_sin + hue_cos)],
+    ], dtype=np.float64) / one
+
+    def apply(frame):
+        frame.data = cv2.transform(frame.to("yuv"), transform)
+    return apply
+
+
+def _negate_op(args):
+    if args:
+        return None
+
+    def apply(frame):
+        frame.data = cv2.LUT(frame.data, _NEGATE_RGB if frame.space == "rgb" else _NEGATE_YUV)
+    return apply
+
+
+def _colorchannelmixer_op(args):
+    names = ("rr", "rg", "rb", "ra", "gr", "gg", "gb", "ga", "br", "bg", "bb", "ba")
+    options = _parse_options(args, names)
+    if options is None:
+        return None
+    try:
+        values = {name: _number(value) for name, value in options.items()}
+    except ValueError:
+        return None
+
+    defaults = {"rr": 1.0, "gg": 1.0, "bb": 1.0}
+    # Без альфа-канала коэффициенты *a не участвуют
+    matrix = np.array([[values.get(out + src, defaults.get(out + src, 0.0)) for src in "rgb"] for out in "rgb"])
+
+    def apply(frame):
+        frame.data = cv2.transform(frame.to("rgb"), matrix)
+    return apply
+
+
+def _vignette_op(args):
+    options = _parse_options(args, ("angle",))
+    if options is None:
+        return None
+    try:
+        angle = _number(options.get("angle", "PI/5"))
+    except ValueError:
+        return None
+    angle = min(max(angle, 0.0), math.pi / 2)
+    factors = {}
+
+    def factor_map(width, height):
+        key = (width, height)
+        if key not in factors:
+            # get_natural_factor из vf_vignette: cos^4 от нормированного расстояния
+            xx = np.trunc(np.arange(width) - width / 2)
+            yy = np.trunc(np.arange(height) - height / 2)
+            dnorm = np.hypot(xx[np.newaxis, :], yy[:, np.newaxis]) / math.hypot(width / 2, height / 2)
+            c = np.cos(angle * dnorm)
+            fmap = np.where(dnorm > 1, 0.0, (c * c) * (c * c)).astype(np.float32)
+            factors.clear()
+            factors[key] = cv2.merge([fmap, fmap, fmap])
+        return factors[key]
+
+    def apply(frame):
+        data = frame.data
+        fmap = factor_map(data.shape[1], data.shape[0])
+        if frame.space == "rgb":
+            frame.data = cv2.multiply(data, fmap, dtype=cv2.CV_8U)
+        else:
+            # Цветность затемняется к нейтральному 127, яркость - к нулю
+            pixels = cv2.subtract(data.astype(np.float32), (0, 127, 127, 0))
+            pixels = cv2.add(cv2.multiply(pixels, fmap), (0, 127, 127, 0))
+            frame.data = cv2.convertScaleAbs(pixels)
+    return apply
+
+
+def _setpts_op(args):
+    # Метки времени не влияют на отдельный кадр превью
+    return lambda frame: None
+
+
+_COMPILERS = {
+    "scale": _scale_op,
+    "crop": _crop_op,
+    "transpose": _transpose_op,
+    "hflip": _flip_op(1),
+    "vflip": _flip_op(0),
+    "eq": _eq_op,
+    "hue": _hue_op,
+    "negate": _negate_op,
+    "colorchannelmixer": _colorchannelmixer_op,
+    "vignette": _vignette_op,
+    "setpts": _setpts_op,
+}
+
+
+class NativeChain:
+    """Скомпилированная цепочка: render(кадр BGR, размер) -> PIL.Image"""
+
+    def __init__(self, ops, background):
+        self.ops = ops
+        self.background = background
+
+    def render(self, frame, size):
+        """Обработка кадра и вписывание в size с полями (как fit_filter_args)"""
+        state = _Frame(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), "rgb")
+        for op in self.ops:
+            op(state)
+        data = state.to("rgb")
+
+        box_w, box_h = size
+        height, width = data.shape[:2]
+        fit_w = min(box_w, _rescale(box_h, width, height))
+        fit_h = min(box_h, _rescale(box_w, height, width))
+        data = _resize(data, max(1, fit_w), max(1, fit_h))
+
+        x = (box_w - data.shape[1]) // 2
+        y = (box_h - data.shape[0]) // 2
+        canvas = cv2.copyMakeBorder(
+            data, y, box_h - data.shape[0] - y, x, box_w - data.shape[1] - x,
+            cv2.BORDER_CONSTANT, value=self.background
+        )
+        return Image.fromarray(canvas, "RGB")
+
+
+def compile_filter_args(filter_args, background="0x1a1a2e"):
+    """NativeChain для аргументов графа или None, если нужен FFmpeg"""
+    if not filter_args:
+        chain = ""
+    elif len(filter_args) == 2 and filter_args[0] == "-vf":
+        chain = filter_args[1]
+    else:
+        return None
+
+    # Кавычки, экранирование, метки и несколько цепочек не разбираются
+    if any(ch in chain for ch in "'\"\\[];"):
+        return None
+
+    ops = []
+    for item in filter(None, (part.strip() for part in chain.split(","))):
+        name, _, args = item.partition("=")
+        compiler = _COMPILERS.get(name)
+        op = compiler(args) if compiler else None
+        if op is None:
+            return None
+        ops.append(op)
+
+    color = int(background.replace("0x", ""), 16)
+    return NativeChain(ops, ((color >> 16) & 255, (color >> 8) & 255, color & 255))
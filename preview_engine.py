@@ -0,0 +1,760 @@
+"""
+Постоянный движок предпросмотра (один на загруженное видео)
+
+Исходник открывается один раз через OpenCV и остаётся открытым, поэтому
+перемещение по таймлайну не требует повторного запуска FFmpeg, открытия
+контейнера и пробы потоков. Фильтры применяет долгоживущий процесс FFmpeg:
+декодированный кадр пишется ему в stdin как rawvideo, готовый кадр читается
+из stdout. Процесс перезапускается только при смене графа фильтров.
+
+Кадры передаются как rawvideo rgb24 уже в размере области превью: граф
+дополняется вписыванием в этот размер, поэтому размер каждого кадра известен
+заранее и он читается напрямую в переиспользуемый буфер без PNG и временных
+файлов.
+
+Воспроизведение (PlaybackStream) - отдельный процесс FFmpeg, который сам
+декодирует источник и непрерывно отдаёт кадры в том же формате.
+"""
+
+import collections
+import hashlib
+import math
+import queue
+import subprocess
+import threading
+import time
+
+import cv2
+from PIL import Image
+
+from ffmpeg_process import popen_subprocess
+from native_filters import compile_filter_args
+
+
+# Цвет полей при вписывании кадра (совпадает с фоном контейнера превью)
+PREVIEW_BACKGROUND = "0x1a1a2e"
+
+# Аргументы вывода сырых кадров в stdout
+RAW_OUTPUT_ARGS = ["-f", "rawvideo", "-pix_fmt", "rgb24"]
+
+# Переход OpenCV (бэкенд FFmpeg) ищет ключевой кадр не позже чем за столько кадров
+# до цели и декодирует от него: переход ровно на ключевой кадр стоит целого
+# предыдущего GOP, а на столько кадров после него - только этих кадров
+OPENCV_SEEK_BACKOFF = 16
+
+
+class PreviewEngineError(Exception):
+    """Ошибка движка превью (вызывающий код переходит на разовый запуск FFmpeg)"""
+
+
+def fit_filter_args(filter_args, width, height):
+    """Дополнение графа вписыванием результата в width x height с полями
+
+    Размер выходного кадра становится фиксированным, что позволяет читать
+    rawvideo без заголовков.
+    """
+    fit = (
+        f"scale={width}:{height}:force_original_aspect_ratio=decrease:flags=lanczos,"
+        f"format=rgb24,"
+        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:color={PREVIEW_BACKGROUND}"
+    )
+    args = list(filter_args)
+
+    if "-filter_complex" in args:
+        graph_index = args.index("-filter_complex") + 1
+        map_index = args.index("-map") + 1
+        args[graph_index] = f"{args[graph_index]};{args[map_index]}{fit}[preview]"
+        args[map_index] = "[preview]"
+        return args
+
+    if "-vf" in args:
+        chain_index = args.index("-vf") + 1
+        args[chain_index] = f"{args[chain_index]},{fit}"
+        return args
+
+    return ["-vf", fit]
+
+
+def image_from_raw(data, width, height):
+    """Обёртка над буфером rgb24 без копирования"""
+    return Image.frombuffer("RGB", (width, height), data, "raw", "RGB", 0, 1)
+
+
+class _FrameBuffers:
+    """Кольцо переиспользуемых буферов кадра
+
+    Несколько буферов нужны, чтобы чтение следующего кадра не перезаписывало
+    кадр, который ещё отображается в интерфейсе.
+    """
+
+    def __init__(self, frame_size, count=3):
+        self._buffers = [bytearray(frame_size) for _ in range(count)]
+        self._index = 0
+
+    def next(self):
+        buffer = self._buffers[self._index]
+        self._index = (self._index + 1) % len(self._buffers)
+        return buffer
+
+
+class GopFrameCache:
+    """Кэш декодированных кадров превью, сгруппированных по GOP
+
+    Кадры одного GOP хранятся и вытесняются вместе (LRU по GOP), пока общий
+    объём не уложится в max_bytes. Если бюджет меньше одного GOP, из текущего
+    GOP вытесняются самые ранние добавленные кадры.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._gops = collections.OrderedDict()  # начало GOP -> {время кадра: ndarray}
+        self._bytes = 0
+
+    def get(self, gop_start, frame_time):
+        frames = self._gops.get(gop_start)
+        if frames is None:
+            return None
+        frame = frames.get(frame_time)
+        if frame is not None:
+            self._gops.move_to_end(gop_start)
+        return frame
+
+    def nearest(self, gop_start, frame_time):
+        """Ближайший к frame_time кадр GOP, если какие-то его кадры есть в кэше"""
+        frames = self._gops.get(gop_start)
+        if not frames:
+            return None
+        return frames[min(frames, key=lambda t: abs(t - frame_time))]
+
+    def put(self, gop_start, frame_time, frame):
+        if frame.nbytes > self.max_bytes:
+            return
+
+        frames = self._gops.setdefault(gop_start, {})
+        previous = frames.pop(frame_time, None)
+        if previous is not None:
+            self._bytes -= previous.nbytes
+        frames[frame_time] = frame
+        self._bytes += frame.nbytes
+        self._gops.move_to_end(gop_start)
+
+        while self._bytes > self.max_bytes:
+            if len(self._gops) > 1:
+                _, evicted = self._gops.popitem(last=False)
+                self._bytes -= sum(f.nbytes for f in evicted.values())
+            else:
+                oldest_time = next(iter(frames))
+                self._bytes -= frames.pop(oldest_time).nbytes
+
+    def clear(self):
+        self._gops.clear()
+        self._bytes = 0
+
+
+class RenderedFrameCache:
+    """Кэш готовых кадров превью по (хэш графа, время, размер)
+
+    Возврат к уже показанному состоянию (чекбокс туда-обратно, слайдер
+    назад) отображается сразу, без запуска FFmpeg. Вытеснение - LRU по объёму.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._frames = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(filter_args, time_pos, size, variant=""):
+        """Ключ кадра: канонический хэш аргументов графа + время + размер
+
+        variant различает кадры одного графа, полученные по-разному (например,
+        декодированные в разном разрешении).
+        """
+        digest = hashlib.sha1("\0".join(filter_args).encode("utf-8")).hexdigest()
+        return digest, round(time_pos, 6), tuple(size), variant
+
+    def get(self, key):
+        with self._lock:
+            image = self._frames.get(key)
+            if image is not None:
+                self._frames.move_to_end(key)
+            return image
+
+    def put(self, key, image):
+        """Сохранение кадра (image не должен ссылаться на переиспользуемый буфер)"""
+        size = image.width * image.height * len(image.getbands())
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._frames.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.width * previous.height * len(previous.getbands())
+            self._frames[key] = image
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                _, evicted = self._frames.popitem(last=False)
+                self._bytes -= evicted.width * evicted.height * len(evicted.getbands())
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._bytes = 0
+
+
+class _FilterProcess:
+    """Процесс FFmpeg с фиксированным графом: кадр на вход - кадр на выход"""
+
+    def __init__(self, ffmpeg_path, filter_args, width, height, fps, out_size):
+        self.out_width, self.out_height = out_size
+        cmd = [
+            ffmpeg_path, "-hide_banner", "-v", "error",
+            # Вход - сырые кадры из stdin, проба не нужна
+            "-f", "rawvideo", "-pix_fmt", "bgr24",
+            "-s", f"{width}x{height}", "-framerate", f"{fps:.6f}",
+            "-probesize", "32", "-analyzeduration", "0",
+            "-i", "pipe:0",
+            *fit_filter_args(filter_args, self.out_width, self.out_height),
+            # Без дублирования/выбрасывания кадров (setpts меняет метки времени)
+            "-fps_mode", "passthrough",
+            *RAW_OUTPUT_ARGS,
+            "-flush_packets", "1",
+            "pipe:1",
+        ]
+        self.process = popen_subprocess(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0
+        )
+        self.frames = queue.Queue()
+        self.stderr_tail = collections.deque(maxlen=20)
+        self._buffers = _FrameBuffers(self.out_width * self.out_height * 3)
+
+        threading.Thread(target=self._read_frames, daemon=True).start()
+        threading.Thread(target=self._read_stderr, daemon=True).start()
+
+    def _read_into(self, buffer):
+        """Заполнение буфера из stdout целиком (False при EOF)"""
+        view = memoryview(buffer)
+        filled = 0
+        while filled < len(buffer):
+            count = self.process.stdout.readinto(view[filled:])
+            if not count:
+                return False
+            filled += count
+        return True
+
+    def _read_frames(self):
+        """Поток чтения готовых кадров"""
+        try:
+            while True:
+                buffer = self._buffers.next()
+                if not self._read_into(buffer):
+                    break
+                self.frames.put(image_from_raw(buffer, self.out_width, self.out_height))
+        except Exception as e:
+            self.stderr_tail.append(str(e))
+        finally:
+            # None - признак завершения процесса
+            self.frames.put(None)
+
+    def _read_stderr(self):
+        """Поток чтения stderr (хранится только хвост для сообщений об ошибках)"""
+        for line in iter(self.process.stderr.readline, b""):
+            self.stderr_tail.append(line.decode("utf-8", "replace").rstrip())
+
+    def render(self, frame, timeout, aborted=None):
+        """Отправка кадра в граф и получение результата
+
+        aborted() периодически проверяется во время ожидания: True - процесс
+        убивается и выбрасывается PreviewEngineError.
+        """
+        # Выбросить лишние кадры, если граф выдал больше одного кадра на вход
+        while True:
+            try:
+                self.frames.get_nowait()
+            except queue.Empty:
+                break
+
+        try:
+            self.process.stdin.write(frame.tobytes())
+        except (BrokenPipeError, OSError, ValueError):
+            raise PreviewEngineError(self.error_text() or "процесс фильтров завершился")
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                image = self.frames.get(timeout=0.05)
+                break
+            except queue.Empty:
+                if aborted is not None and aborted():
+                    self.process.kill()
+                    raise PreviewEngineError("рендер прерван")
+                if time.monotonic() >= deadline:
+                    raise PreviewEngineError("граф фильтров не вернул кадр (фильтр буферизует кадры?)")
+
+        if image is None:
+            raise PreviewEngineError(self.error_text() or "процесс фильтров завершился")
+        return image
+
+    def error_text(self):
+        """Последние строки stderr процесса"""
+        return "\n".join(self.stderr_tail)
+
+    def close(self):
+        """Завершение процесса"""
+        try:
+            self.process.stdin.close()
+        except Exception:
+            pass
+        try:
+            self.process.wait(timeout=1)
+        except Exception:
+            self.process.kill()
+
+
+class PreviewEngine:
+    """Движок превью для одного видеофайла
+
+    render(time_pos, filter_args, size) возвращает PIL.Image размера size с кадром
+    в момент time_pos, обработанным графом filter_args (["-vf", ...] или
+    ["-filter_complex", ..., "-map", ...]). Вызовы из разных потоков сериализуются.
+    Графы только из простых фильтров (см. native_filters) обрабатываются в
+    процессе, без FFmpeg.
+
+    render(..., source_resolution=True) - кадр исходника декодируется в полном
+    разрешении и без прокси (для точного превью графом экспорта).
+
+    render(..., coarse=True) - быстрый приблизительный кадр: без декодирования
+    GOP (ключевой кадр или уже декодированный кадр) и с отдельным процессом
+    фильтров, чтобы чередование с точным рендером не перезапускало процессы.
+    """
+
+    # Сколько ждать кадр от процесса фильтров (nlmeans на 4K может работать секунды)
+    FRAME_TIMEOUT = 30.0
+
+    # Бюджет кэша декодированных кадров по умолчанию (МБ)
+    GOP_CACHE_MB = 512
+
+    # Область декодирования для кадров в полном разрешении исходника
+    SOURCE_BOX = (math.inf, math.inf)
+
+    # Отмена (abort в render) не прерывает процесс фильтров, рендер в котором моложе
+    # этого времени: перезапуск процесса дороже, чем дождаться короткого рендера
+    ABORT_AFTER = 0.25
+
+    def __init__(self, video_path, ffmpeg_path="ffmpeg", gop_cache_mb=GOP_CACHE_MB):
+        self.video_path = video_path
+        self.ffmpeg_path = ffmpeg_path
+
+        self._lock = threading.Lock()
+        # Процессы фильтров по слотам: "exact" и "coarse" -> (ключ, _FilterProcess)
+        self._filter_processes = {}
+
+        # Разобранная цепочка для обработки в процессе (None - граф только для FFmpeg)
+        self.native_enabled = True
+        self._native_key = None
+        self._native_chain = None
+
+        # Последний декодированный кадр: изменение параметров без движения
+        # по таймлайну вообще не требует декодирования
+        self._last_time = None
+        self._last_frame = None
+
+        # Кадры хранятся в разрешении превью: вписанными в область _fit_box
+        self._gop_cache = GopFrameCache(gop_cache_mb * 1024 ** 2)
+        self._fit_box = None
+        self._frame_size = None
+
+        self._capture = cv2.VideoCapture(video_path)
+        if not self._capture.isOpened():
+            raise PreviewEngineError(f"OpenCV не смог открыть {video_path}")
+
+        # Прокси-файл (см. media_cache.ProxyJob) подключается, когда будет готов
+        self._proxy_capture = None
+        self.proxy_path = None
+
+        # Индекс ключевых кадров оригинала (media_cache.KeyframeIndex) и время
+        # последнего декодированного из оригинала кадра
+        self._index = None
+        self._position = None
+
+        self.fps = self._capture.get(cv2.CAP_PROP_FPS) or 30
+
+    def set_proxy(self, proxy_path):
+        """Переключение декодирования на прокси-файл
+
+        Граф превью начинается с приведения входа к расчётному размеру,
+        поэтому разрешение прокси на результат не влияет.
+        """
+        capture = cv2.VideoCapture(proxy_path)
+        if not capture.isOpened():
+            capture.release()
+            raise PreviewEngineError(f"OpenCV не смог открыть прокси {proxy_path}")
+
+        with self._lock:
+            if self._capture is None:
+                capture.release()
+                return
+            if self._proxy_capture is not None:
+                self._proxy_capture.release()
+            self._proxy_capture = capture
+            self.proxy_path = proxy_path
+
+    def set_keyframe_index(self, index):
+        """Подключение индекса ключевых кадров оригинала"""
+        with self._lock:
+            self._index = index
+
+    def _fit(self, frame):
+        """Уменьшение декодированного кадра до разрешения превью"""
+        if self._frame_size is None:
+            # Размер определяется по первому кадру (с учётом автоповорота OpenCV)
+            height, width = frame.shape[:2]
+            factor = min(1.0, self._fit_box[0] / width, self._fit_box[1] / height)
+            self._frame_size = (max(2, int(width * factor)), max(2, int(height * factor)))
+
+        width, height = self._frame_size
+        if frame.shape[1] == width and frame.shape[0] == height:
+            return frame
+
+        # INTER_AREA быстр только при целом коэффициенте: сначала целое
+        # уменьшение им, затем билинейная подгонка (кадры GOP уменьшаются все)
+        step = frame.shape[1] // width
+        if step >= 2:
+            frame = cv2.resize(
+                frame, (frame.shape[1] // step, frame.shape[0] // step), interpolation=cv2.INTER_AREA
+            )
+        return cv2.resize(frame, (width, height), interpolation=cv2.INTER_LINEAR)
+
+    def _decode(self, time_pos, size):
+        """Кадр в момент time_pos в разрешении превью (BGR ndarray)
+
+        size=SOURCE_BOX: кадр оригинала в полном разрешении (прокси не используется).
+        """
+        if self._fit_box != tuple(size):
+            # Область превью изменилась - кадры в кэше другого размера
+            self._fit_box = tuple(size)
+            self._frame_size = None
+            self._gop_cache.clear()
+            self._last_frame = None
+
+        if self._last_frame is not None and self._last_time == time_pos:
+            return self._last_frame
+
+        if self._index is None:
+            capture = self._preview_capture()
+            frame = self._fit(self._seek_and_read(capture, time_pos))
+            self._position = None
+        else:
+            frame = self._decode_indexed(self._index, time_pos)
+
+        self._last_time = time_pos
+        self._last_frame = frame
+        return frame
+
+    def _preview_capture(self):
+        """Источник кадров: прокси, если он подключён и не нужен полный размер"""
+        if self._proxy_capture is not None and self._fit_box != self.SOURCE_BOX:
+            return self._proxy_capture
+        return self._capture
+
+    def _seek_and_read(self, capture, time_pos):
+        """Переход к time_pos и декодирование кадра"""
+        capture.set(cv2.CAP_PROP_POS_MSEC, time_pos * 1000)
+        ok, frame = capture.read()
+        if not ok or frame is None:
+            raise PreviewEngineError(f"не удалось декодировать кадр на {time_pos:.2f} с")
+        return frame
+
+    def _decode_indexed(self, index, time_pos):
+        """Декодирование с индексом ключевых кадров через кэш GOP"""
+        frame_time = index.frame_time(time_pos)
+        gop_start = index.keyframe_before(frame_time)
+
+        frame = self._gop_cache.get(gop_start, frame_time)
+        if frame is not None:
+            return frame
+
+        if self._preview_capture() is not self._capture:
+            # В прокси все кадры ключевые - переход всегда стоит один кадр
+            frame = self._fit(self._seek_and_read(self._proxy_capture, frame_time))
+            self._gop_cache.put(gop_start, frame_time, frame)
+            return frame
+
+        return self._decode_gop(index, gop_start, frame_time)
+
+    def _decode_gop(self, index, gop_start, frame_time):
+        """Последовательное декодирование GOP оригинала до frame_time
+
+        Кадры от ключевого до нужного декодируются при любом переходе, поэтому
+        все они сохраняются в кэше: шаги назад внутри GOP обслуживаются из
+        памяти, а шаг вперёд продолжает декодирование с текущей позиции.
+        """
+        capture = self._capture
+        position = self._position
+
+        if (position is None or position >= frame_time
+                or index.keyframe_before(position) != gop_start):
+            capture.set(cv2.CAP_PROP_POS_MSEC, self._seek_target(gop_start, frame_time) * 1000)
+
+        while True:
+            if not capture.grab():
+                break
+            self._position = index.frame_time(capture.get(cv2.CAP_PROP_POS_MSEC) / 1000)
+            ok, raw = capture.retrieve()
+            if not ok or raw is None:
+                break
+
+            decoded = self._fit(raw)
+            self._gop_cache.put(index.keyframe_before(self._position), self._position, decoded)
+            if self._position >= frame_time:
+                return decoded
+
+        # Конец файла или расхождение с индексом - обычный переход
+        self._position = None
+        return self._fit(self._seek_and_read(capture, frame_time))
+
+    def _seek_target(self, gop_start, frame_time):
+        """Ближайшее к frame_time время перехода, не требующее декодирования предыдущего GOP"""
+        return min(frame_time, gop_start + OPENCV_SEEK_BACKOFF / self.fps)
+
+    def _decode_coarse(self, time_pos, size):
+        """Приблизительный кадр для time_pos без декодирования GOP до него
+
+        Точный кадр берётся, если он уже в кэше (или прокси отдаёт его за одно
+        декодирование), иначе - уже декодированный кадр его GOP или первый кадр
+        GOP, доступный переходу OpenCV (см. OPENCV_SEEK_BACKOFF). Без индекса
+        ключевых кадров выполняется обычное декодирование.
+        """
+        index = self._index
+        if (index is None or self._fit_box is None or self._fit_box != tuple(size)
+                or self._preview_capture() is not self._capture):
+            return self._decode(time_pos, size)
+
+        frame_time = index.frame_time(time_pos)
+        gop_start = index.keyframe_before(frame_time)
+        frame = self._gop_cache.get(gop_start, frame_time)
+        if frame is None:
+            frame = self._gop_cache.nearest(gop_start, frame_time)
+        if frame is not None:
+            return frame
+
+        capture = self._capture
+        frame = self._fit(self._seek_and_read(capture, self._seek_target(gop_start, frame_time)))
+        # Следующий точный рендер в этом GOP продолжит декодирование отсюда
+        self._position = index.frame_time(capture.get(cv2.CAP_PROP_POS_MSEC) / 1000)
+        self._gop_cache.put(gop_start, self._position, frame)
+        return frame
+
+    def _get_filter_process(self, slot, filter_args, width, height, size):
+        """Процесс фильтров слота (перезапуск только при смене графа или размеров)"""
+        key = (tuple(filter_args), width, height, tuple(size))
+
+        current = self._filter_processes.pop(slot, None)
+        if current is not None:
+            current_key, process = current
+            if current_key == key and process.process.poll() is None:
+                self._filter_processes[slot] = current
+                return process
+            process.close()
+
+        process = _FilterProcess(self.ffmpeg_path, list(filter_args), width, height, self.fps, size)
+        self._filter_processes[slot] = (key, process)
+        return process
+
+    def _get_native_chain(self, filter_args):
+        """Цепочка NumPy/OpenCV для графа (разбор повторяется только при смене графа)"""
+        if not self.native_enabled:
+            return None
+        key = tuple(filter_args)
+        if key != self._native_key:
+            self._native_key = key
+            self._native_chain = compile_filter_args(filter_args, PREVIEW_BACKGROUND)
+        return self._native_chain
+
+    def render(self, time_pos, filter_args, size, coarse=False, source_resolution=False, abort=None):
+        """Кадр в момент time_pos после графа filter_args, вписанный в size
+
+        coarse=True: приблизительный кадр (см. _decode_coarse), уменьшенный до
+        size перед фильтрами. Декодирование и кэш кадров остаются в разрешении
+        точного превью, поэтому грубый рендер их не сбрасывает.
+        source_resolution=True: граф получает кадр оригинала в полном разрешении.
+        abort - threading.Event отмены этого вызова (устанавливается из любого
+        потока, в том числе до начала рендера): рендер прекращается с
+        PreviewEngineError перед декодированием и перед фильтрами, а процесс
+        фильтров, работающий дольше ABORT_AFTER, убивается - следующий запрос
+        запустит его заново.
+        """
+        def check_abort():
+            if abort is not None and abort.is_set():
+                raise PreviewEngineError("рендер отменён")
+
+        with self._lock:
+            if self._capture is None:
+                raise PreviewEngineError("движок закрыт")
+            check_abort()
+
+            if coarse:
+                frame = self._decode_coarse(time_pos, self._fit_box or size)
+                height, width = frame.shape[:2]
+                factor = min(size[0] / width, size[1] / height)
+                if factor < 1:
+                    frame = cv2.resize(
+                        frame, (max(2, int(width * factor)), max(2, int(height * factor))),
+                        interpolation=cv2.INTER_AREA
+                    )
+            else:
+                frame = self._decode(time_pos, self.SOURCE_BOX if source_resolution else size)
+            check_abort()
+
+            chain = self._get_native_chain(filter_args)
+            if chain is not None:
+                try:
+                    return chain.render(frame, size)
+                except (ValueError, cv2.error):
+                    # Например, обрезка за пределами кадра - ошибку покажет FFmpeg
+                    pass
+
+            # Запуск процесса фильтров для устаревшего графа не нужен
+            check_abort()
+            height, width = frame.shape[:2]
+            slot = "coarse" if coarse else "exact"
+            process = self._get_filter_process(slot, filter_args, width, height, size)
+            started = time.monotonic()
+            try:
+                return process.render(
+                    frame, self.FRAME_TIMEOUT,
+                    aborted=lambda: (abort is not None and abort.is_set()
+                                     and time.monotonic() - started >= self.ABORT_AFTER)
+                )
+            except PreviewEngineError:
+                # Процесс в неизвестном состоянии - следующий запрос создаст новый
+                process.close()
+                self._filter_processes.pop(slot, None)
+                raise
+
+    def close(self):
+        """Освобождение исходника и процесса фильтров"""
+        with self._lock:
+            for _, process in self._filter_processes.values():
+                process.close()
+            self._filter_processes.clear()
+            if self._capture is not None:
+                self._capture.release()
+                self._capture = None
+            if self._proxy_capture is not None:
+                self._proxy_capture.release()
+                self._proxy_capture = None
+            self._last_frame = None
+            self._gop_cache.clear()
+
+
+class PlaybackStream:
+    """Воспроизведение превью одним непрерывным процессом FFmpeg
+
+    Процесс декодирует source с позиции start, пропускает кадры через граф
+    filter_args и отдаёт rawvideo rgb24 размера size. Поток чтения выдаёт
+    кадры в темпе rate кадров/с по часам: раньше срока кадр не отдаётся, а
+    пока интерфейс не показал предыдущий кадр (не вызвал frame_shown),
+    новые пропускаются. Сам FFmpeg сдерживается заполнением pipe.
+
+    on_frame(image, index) вызывается из потока чтения (index - номер кадра
+    от start), on_end(error) - по окончании потока (error - текст ошибки
+    FFmpeg или None); после stop() колбэки не вызываются.
+    """
+
+    def __init__(self, ffmpeg_path, source, start, filter_args, size, rate, on_frame, on_end):
+        self.width, self.height = size
+        self.rate = rate
+        self.on_frame = on_frame
+        self.on_end = on_end
+
+        cmd = [
+            ffmpeg_path, "-hide_banner", "-nostdin", "-v", "error",
+            "-ss", f"{start:.3f}", "-i", source,
+            "-an", "-sn", "-dn",
+            *fit_filter_args(filter_args, self.width, self.height),
+            # Каждый кадр источника - один кадр потока (темп задаёт rate)
+            "-fps_mode", "passthrough",
+            *RAW_OUTPUT_ARGS,
+            "pipe:1",
+        ]
+        self.process = popen_subprocess(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0
+        )
+        self.stderr_tail = collections.deque(maxlen=20)
+        self._stopped = threading.Event()
+        self._ui_ready = threading.Event()
+        self._ui_ready.set()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        threading.Thread(target=self._read_stderr, daemon=True).start()
+
+    def _read_stderr(self):
+        for line in iter(self.process.stderr.readline, b""):
+            self.stderr_tail.append(line.decode("utf-8", "replace").rstrip())
+
+    def _read_into(self, buffer):
+        view = memoryview(buffer)
+        filled = 0
+        while filled < len(buffer):
+            count = self.process.stdout.readinto(view[filled:])
+            if not count:
+                return False
+            filled += count
+        return True
+
+    def _run(self):
+        """Поток чтения: темп воспроизведения и пропуск кадров"""
+        buffer = bytearray(self.width * self.height * 3)
+        clock_start = None
+        index = 0
+        try:
+            while not self._stopped.is_set():
+                if not self._read_into(buffer):
+                    break
+
+                now = time.monotonic()
+                if clock_start is None:
+                    clock_start = now
+                due = clock_start + index / self.rate
+                if now < due and self._stopped.wait(due - now):
+                    break
+
+                if self._ui_ready.is_set():
+                    self._ui_ready.clear()
+                    # Копия: буфер сразу заполняется следующим кадром
+                    self.on_frame(image_from_raw(buffer, self.width, self.height).copy(), index)
+                index += 1
+        except (OSError, ValueError) as e:
+            self.stderr_tail.append(str(e))
+
+        if self._stopped.is_set():
+            return
+        self.process.wait()
+        error = None
+        if self.process.returncode != 0:
+            error = "\n".join(self.stderr_tail) or f"FFmpeg завершился с кодом {self.process.returncode}"
+        self.on_end(error)
+
+    def frame_shown(self):
+        """Интерфейс показал кадр - можно отдавать следующий"""
+        self._ui_ready.set()
+
+    def stop(self):
+        """Остановка без вызова колбэков (можно вызывать из любого потока)"""
+        self._stopped.set()
+        if self.process.poll() is None:
+            self.process.kill()
+        if threading.current_thread() is not self._thread:
+            self._thread.join(timeout=1)
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            pass
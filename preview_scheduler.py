@@ -0,0 +1,93 @@
+"""
+Планировщик обновлений превью по принципу "последний запрос побеждает"
+
+Одновременно выполняется не больше одного рендера и ждёт не больше одного:
+новый запрос заменяет ожидающий, а выполняющийся становится устаревшим.
+Каждый запрос получает номер поколения; показывать результат можно только
+если поколение всё ещё последнее. Выполняющийся рендер может зарегистрировать
+функцию отмены (например, kill процесса FFmpeg) - она вызывается, как только
+рендер устаревает.
+"""
+
+import threading
+
+
+class PreviewScheduler:
+    """Один рабочий поток + одно место для ожидающего запроса"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._pending = None     # (поколение, job) ожидающего запроса
+        self._generation = 0     # Поколение последнего запроса
+        self._cancel = None      # (поколение, функция отмены) выполняющегося рендера
+        self._closed = False
+
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, job):
+        """Постановка запроса job(generation) с вытеснением предыдущих"""
+        with self._condition:
+            if self._closed:
+                return
+            self._generation += 1
+            self._pending = (self._generation, job)
+            cancel = self._cancel
+            self._cancel = None
+            self._condition.notify()
+
+        if cancel is not None:
+            self._call_cancel(cancel[1])
+
+    def is_current(self, generation):
+        """Является ли поколение последним запрошенным"""
+        return generation == self._generation
+
+    def set_cancel(self, generation, cancel):
+        """Регистрация отмены выполняющегося рендера
+
+        Если рендер уже устарел, отмена вызывается сразу.
+        """
+        with self._condition:
+            if generation == self._generation and not self._closed:
+                self._cancel = (generation, cancel)
+                return
+        self._call_cancel(cancel)
+
+    def _call_cancel(self, cancel):
+        try:
+            cancel()
+        except Exception as e:
+            print(f"Ошибка отмены превью: {e}")
+
+    def _run(self):
+        """Рабочий поток: выполнение последнего запроса"""
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                generation, job = self._pending
+                self._pending = None
+
+            try:
+                job(generation)
+            except Exception as e:
+                print(f"Ошибка генерации превью: {e}")
+            finally:
+                with self._condition:
+                    if self._cancel is not None and self._cancel[0] == generation:
+                        self._cancel = None
+
+    def close(self):
+        """Остановка: ожидающий запрос отбрасывается, выполняющийся отменяется"""
+        with self._condition:
+            self._closed = True
+            self._pending = None
+            self._generation += 1
+            cancel = self._cancel
+            self._cancel = None
+            self._condition.notify()
+
+        if cancel is not None:
+            self._call_cancel(cancel[1])
@@ -0,0 +1,420 @@
+"""
+Рендер-ферма: координатор и воркеры на нескольких машинах
+
+Координатор (FarmExport) делит экспорт на сегменты по ключевым кадрам так же,
+как параллельный экспорт (chunked_export), но кодирование сегментов раздаёт
+подключившимся по TCP воркерам, повторяет упавшие сегменты на других воркерах
+и сам склеивает результат. Файловая система общая: исходник и каталог
+результата должны быть доступны воркерам по тем же путям. Файлы, нужные графу
+(маска скругления Canvas), кладутся в каталог сегментов рядом с результатом.
+
+Протокол - JSON по строке на сообщение:
+    воркер -> координатор: {"type": "hello", "name": ..., "nonce": ...}
+    координатор -> воркер: {"type": "welcome", "nonce": ..., "proof": HMAC(токен, nonce воркера)}
+    воркер -> координатор: {"type": "auth", "proof": HMAC(токен, nonce координатора)}
+    координатор -> воркер: {"type": "segment", "id": N, "args": [аргументы FFmpeg]}
+    воркер -> координатор: {"type": "progress", "id": N, "report": {...}}
+    воркер -> координатор: {"type": "result", "id": N, "returncode": ..., "stderr": ...}
+    координатор -> воркер: {"type": "cancel"} - остановить текущий сегмент
+    координатор -> воркер: {"type": "done"} - задание завершено
+
+Воркер запускает только свой FFmpeg с полученными аргументами, но они задают
+пути записи. Поэтому координатор и воркер доказывают друг другу знание общего
+токена (сам токен по сети не передаётся), а координатор по умолчанию слушает
+только 127.0.0.1. Адрес в локальной сети и токен хранятся в настройках фермы:
+    python render_farm.py config --listen 192.168.1.10
+Сообщения не шифруются - ферма рассчитана на доверенную сеть.
+
+Воркер:
+    python render_farm.py worker --connect 192.168.1.10:8765 --token ТОКЕН
+Проверка на одной машине: несколько воркеров с --connect 127.0.0.1:8765 (токен
+берётся из настроек этой машины).
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import queue
+import secrets
+import socket
+import socketserver
+import threading
+import time
+
+from chunked_export import ChunkedExport
+from ffmpeg_process import run_with_progress
+from media_cache import cache_dir
+from thread_tuning import thread_args
+
+
+# Адрес координатора по умолчанию: только эта машина, пока в настройках фермы
+# не выбран адрес в локальной сети
+FARM_HOST = "127.0.0.1"
+FARM_PORT = 8765
+
+# На сколько сегментов делится задание фермы (число воркеров заранее неизвестно)
+FARM_SEGMENTS = 16
+
+# Попыток на сегмент (на любых воркерах), прежде чем экспорт считается неудачным
+MAX_ATTEMPTS = 3
+
+# Воркер, от которого столько секунд нет сообщений (прогресс идёт дважды в
+# секунду), считается потерянным, а его сегмент передаётся другому
+WORKER_SILENCE_TIMEOUT = 120
+
+# Пауза между попытками воркера подключиться к координатору
+RECONNECT_DELAY = 2.0
+
+# Экспорт считается неудачным, если столько секунд к координатору не подключён
+# ни один воркер (никто не пришёл или все отключились)
+NO_WORKERS_TIMEOUT = 300
+
+
+def _settings_path():
+    """Файл настроек фермы этой машины"""
+    return os.path.join(cache_dir("farm"), "settings.json")
+
+
+def farm_settings():
+    """Настройки фермы {"listen": хост, "token": токен}; токен создаётся при первом вызове"""
+    try:
+        with open(_settings_path(), encoding="utf-8") as f:
+            settings = json.load(f)
+    except (OSError, ValueError):
+        settings = {}
+    if not settings.get("token"):
+        settings["token"] = secrets.token_urlsafe(16)
+        save_farm_settings(settings)
+    settings.setdefault("listen", FARM_HOST)
+    return settings
+
+
+def save_farm_settings(settings):
+    with open(_settings_path(), "w", encoding="utf-8") as f:
+        json.dump(settings, f, indent=2)
+
+
+def _proof(token, role, nonce):
+    """Доказательство знания токена для nonce другой стороны (role - кто доказывает)"""
+    return hmac.new(token.encode("utf-8"), f"{role}:{nonce}".encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def _send(sock, lock, message):
+    """Отправка сообщения протокола (строка JSON)"""
+    data = (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+    with lock:
+        sock.sendall(data)
+
+
+class _FarmServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, export):
+        self.export = export
+        super().__init__(address, _WorkerHandler)
+
+
+class _WorkerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.request.settimeout(WORKER_SILENCE_TIMEOUT)
+        self.server.export._serve_worker(self.request, self.rfile)
+
+
+class FarmExport(ChunkedExport):
+    """Экспорт сегментами на воркерах фермы (см. описание модуля)
+
+    listen - адрес (хост, порт), на котором координатор ждёт воркеров, token -
+    общий токен (None - из настроек фермы, см. farm_settings);
+    no_workers_timeout - сколько секунд ждать, пока не подключён ни один воркер.
+    """
+
+    def __init__(self, *args, listen=None, token=None, max_attempts=MAX_ATTEMPTS,
+                 no_workers_timeout=NO_WORKERS_TIMEOUT, **kwargs):
+        super().__init__(*args, **kwargs)
+        if listen is None or token is None:
+            settings = farm_settings()
+            listen = listen or (settings["listen"], FARM_PORT)
+            token = token or settings["token"]
+        self.listen = listen
+        self.token = token
+        self.max_attempts = max_attempts
+        self.no_workers_timeout = no_workers_timeout
+
+        self._queue = queue.Queue()
+        self._finished = threading.Event()
+        self._attempts = {}
+        self._remaining = 0
+        self._failure = None
+        self._connections = {}  # сокет -> блокировка записи
+
+    def _encode_segments(self, paths, on_segment_progress):
+        self._paths = paths
+        self._on_segment_progress = on_segment_progress
+        self._remaining = len(self.segments)
+        self._attempts = {i: 0 for i in range(len(self.segments))}
+        for i in range(len(self.segments)):
+            self._queue.put(i)
+
+        server = _FarmServer(self.listen, self)
+        print(f"Рендер-ферма: ожидание воркеров на {self.listen[0]}:{server.server_address[1]}")
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            idle_since = time.monotonic()
+            while not self._finished.wait(1.0):
+                with self._lock:
+                    connected = bool(self._connections)
+                if connected:
+                    idle_since = time.monotonic()
+                elif time.monotonic() - idle_since > self.no_workers_timeout:
+                    self._fail(1, f"нет воркеров дольше {self.no_workers_timeout} с")
+        finally:
+            server.shutdown()
+            server.server_close()
+            self._close_connections({"type": "cancel" if self._failure else "done"})
+
+        if self._failure is not None:
+            return self._failure
+        return 0, ""
+
+    def _serve_worker(self, sock, rfile):
+        """Обслуживание одного воркера: выдача сегментов до конца задания"""
+        lock = threading.Lock()
+        try:
+            hello = json.loads(rfile.readline() or b"{}")
+            if hello.get("type") != "hello":
+                return
+            nonce = secrets.token_hex(16)
+            _send(sock, lock, {
+                "type": "welcome", "nonce": nonce,
+                "proof": _proof(self.token, "coordinator", str(hello.get("nonce", ""))),
+            })
+            auth = json.loads(rfile.readline() or b"{}")
+        except (OSError, ValueError):
+            return
+        name = hello.get("name", "?")
+        if not hmac.compare_digest(str(auth.get("proof", "")), _proof(self.token, "worker", nonce)):
+            print(f"Рендер-ферма: воркер {name} ({sock.getpeername()[0]}) отклонён - неверный токен")
+            return
+        print(f"Рендер-ферма: подключился воркер {name}")
+
+        with self._lock:
+            self._connections[sock] = lock
+
+        try:
+            while not self._finished.is_set():
+                try:
+                    i = self._queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+
+                start, end = self.segments[i]
+                # Каждая попытка - в свой файл: FFmpeg потерянного воркера может ещё писать
+                root, extension = os.path.splitext(self._paths[i])
+                attempt_path = f"{root}_{self._attempts[i]}{extension}"
+                # Без опций потоков: воркер добавит свои (один сегмент за раз на всех ядрах)
+                args = self.segment_command(start, end, attempt_path)[1:]
+                result = None
+                try:
+                    _send(sock, lock, {"type": "segment", "id": i, "args": args})
+                    result = self._wait_result(rfile, i)
+                except (OSError, ValueError):
+                    pass
+
+                if result is None:
+                    self._segment_failed(i, 1, f"воркер {name} отключился")
+                    return
+                returncode, stderr_tail = result
+                if returncode == 0:
+                    try:
+                        os.replace(attempt_path, self._paths[i])
+                    except OSError as e:
+                        # Воркер писал не в общий каталог
+                        returncode, stderr_tail = 1, f"сегмент {i} не найден: {e}"
+                if returncode == 0:
+                    self._segment_done()
+                else:
+                    print(f"Рендер-ферма: сегмент {i} упал на воркере {name}")
+                    self._segment_failed(i, returncode, stderr_tail)
+
+            _send(sock, lock, {"type": "done"})
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                self._connections.pop(sock, None)
+
+    def _wait_result(self, rfile, i):
+        """Прогресс и результат сегмента i (None - соединение потеряно)"""
+        for line in rfile:
+            message = json.loads(line)
+            if message.get("id") != i:
+                continue
+            if message.get("type") == "progress":
+                self._on_segment_progress(i, message["report"])
+            elif message.get("type") == "result":
+                return message["returncode"], message.get("stderr", "")
+        return None
+
+    def _segment_done(self):
+        with self._lock:
+            self._remaining -= 1
+            if self._remaining == 0:
+                self._finished.set()
+
+    def _segment_failed(self, i, returncode, stderr_tail):
+        """Повтор сегмента на любом воркере или отказ всего экспорта"""
+        with self._lock:
+            self._attempts[i] += 1
+            if self._attempts[i] < self.max_attempts and not self._cancelled:
+                self._queue.put(i)
+                return
+        self._fail(returncode, stderr_tail)
+
+    def _fail(self, returncode, stderr_tail):
+        """Отказ всего экспорта (сохраняется первая причина)"""
+        with self._lock:
+            if self._failure is None:
+                self._failure = (returncode or 1, stderr_tail)
+        self._finished.set()
+
+    def _close_connections(self, message):
+        """Последнее сообщение воркерам (done или cancel) и закрытие соединений"""
+        with self._lock:
+            connections = list(self._connections.items())
+        for sock, lock in connections:
+            try:
+                _send(sock, lock, message)
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def cancel(self):
+        super().cancel()
+        self._fail(1, "экспорт отменён")
+
+
+def _serve_coordinator(sock, ffmpeg_path, name, token):
+    """Сеанс воркера с одним координатором (до конца задания или разрыва)
+
+    Возвращает False, если координатор не доказал знание токена.
+    """
+    lock = threading.Lock()
+    current = {"process": None}
+
+    def encode(i, args):
+        def on_progress(report):
+            try:
+                _send(sock, lock, {"type": "progress", "id": i, "report": report})
+            except OSError:
+                pass
+
+        def on_start(process):
+            current["process"] = process
+
+        # Потоки по калибровке этой машины: опции декодера и графа - до входа,
+        # кодировщика - перед именем выходного файла
+        input_threads, output_threads = thread_args("-filter_complex" in args)
+        cmd = [ffmpeg_path, *input_threads, *args[:-1], *output_threads, args[-1]]
+        try:
+            returncode, stderr_tail = run_with_progress(cmd, on_progress, on_start=on_start)
+        except OSError as e:
+            returncode, stderr_tail = 1, str(e)
+        current["process"] = None
+        try:
+            _send(sock, lock, {"type": "result", "id": i, "returncode": returncode, "stderr": stderr_tail})
+        except OSError:
+            pass
+
+    def stop_current():
+        process = current["process"]
+        if process is not None and process.poll() is None:
+            process.kill()
+
+    nonce = secrets.token_hex(16)
+    _send(sock, lock, {"type": "hello", "name": name, "nonce": nonce})
+    rfile = sock.makefile("rb")
+    try:
+        welcome = json.loads(rfile.readline() or b"{}")
+        if not hmac.compare_digest(str(welcome.get("proof", "")), _proof(token, "coordinator", nonce)):
+            return False
+        _send(sock, lock, {"type": "auth", "proof": _proof(token, "worker", str(welcome.get("nonce", "")))})
+
+        for line in rfile:
+            message = json.loads(line)
+            if message["type"] == "segment":
+                print(f"Сегмент {message['id']}")
+                threading.Thread(target=encode, args=(message["id"], message["args"]), daemon=True).start()
+            elif message["type"] == "cancel":
+                stop_current()
+            elif message["type"] == "done":
+                return True
+    except (OSError, ValueError):
+        pass
+    finally:
+        stop_current()
+        rfile.close()
+    return True
+
+
+def run_worker(address, ffmpeg_path="ffmpeg", name=None, once=False, token=None):
+    """Воркер: подключение к координатору и кодирование выданных сегментов
+
+    Координатор может запуститься позже - подключение повторяется. После
+    задания воркер ждёт следующего координатора (once=True - завершается).
+    token - общий токен фермы (None - из настроек этой машины).
+    """
+    name = name or f"{socket.gethostname()}:{threading.get_native_id()}"
+    token = token or farm_settings()["token"]
+    while True:
+        try:
+            sock = socket.create_connection(address)
+        except OSError:
+            time.sleep(RECONNECT_DELAY)
+            continue
+
+        print(f"Подключено к координатору {address[0]}:{address[1]}")
+        with sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if not _serve_coordinator(sock, ffmpeg_path, name, token):
+                print("Координатор не подтвердил токен - проверьте --token")
+        if once:
+            return
+        time.sleep(RECONNECT_DELAY)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воркер рендер-фермы FFmpeg Editor")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    worker = subparsers.add_parser("worker", help="кодировать сегменты координатора")
+    worker.add_argument("--connect", default=f"{FARM_HOST}:{FARM_PORT}", help="адрес координатора HOST:PORT")
+    worker.add_argument("--token", help="токен фермы координатора (по умолчанию - из настроек этой машины)")
+    worker.add_argument("--ffmpeg", default="ffmpeg", help="путь к FFmpeg на этой машине")
+    worker.add_argument("--name", help="имя воркера в сообщениях координатора")
+    worker.add_argument("--once", action="store_true", help="завершиться после первого задания")
+    config = subparsers.add_parser("config", help="адрес координатора и токен фермы этой машины")
+    config.add_argument("--listen", help="адрес в локальной сети, на котором координатор ждёт воркеров")
+    config.add_argument("--new-token", action="store_true", help="создать новый токен")
+    args = parser.parse_args()
+
+    if args.command == "config":
+        settings = farm_settings()
+        if args.listen or args.new_token:
+            if args.listen:
+                settings["listen"] = args.listen
+            if args.new_token:
+                settings["token"] = secrets.token_urlsafe(16)
+            save_farm_settings(settings)
+        print(f"Координатор: {settings['listen']}:{FARM_PORT}")
+        print(f"Воркер: python render_farm.py worker --connect {settings['listen']}:{FARM_PORT} "
+              f"--token {settings['token']}")
+        return
+
+    host, _, port = args.connect.rpartition(":")
+    run_worker((host or FARM_HOST, int(port)), args.ffmpeg, args.name, args.once, args.token)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Распределение потоков FFmpeg: декодер, граф фильтров, кодировщик
+
+По умолчанию FFmpeg отдаёт все ядра и кодировщику, и графу фильтров каждого
+процесса. При нескольких одновременных процессах (экспорт по частям) они
+мешают друг другу, а в Canvas (filter_complex) граф упирается в один поток,
+пока кодировщик занимает остальные ядра. Здесь потоки делятся между ролями
+исходя из числа ядер, вида графа и числа одновременных процессов.
+
+Калибровка прогоняет несколько распределений на синтетическом источнике
+(lavfi testsrc2) и сохраняет лучшее для этой машины:
+    python thread_tuning.py calibrate
+Замеряется один процесс, поэтому калибровка применяется только к нему; при
+нескольких одновременных процессах каждый получает свою долю ядер.
+"""
+
+import argparse
+import json
+import os
+import platform
+import time
+
+from ffmpeg_process import run_subprocess
+from media_cache import cache_dir
+
+
+# Распределения для калибровки: доли ядер процесса (декодер, фильтры, кодировщик);
+# "auto" - решает сам FFmpeg
+CANDIDATES = [
+    "auto",
+    (0.25, 1.0, 1.0),
+    (0.25, 1.0, 0.5),
+    (0.25, 0.5, 1.0),
+    (0.5, 0.5, 0.5),
+]
+
+# Без калибровки потоки распределяет FFmpeg: заданные наугад доли (например,
+# четверть ядер декодеру) на части машин медленнее, чем его собственный выбор
+DEFAULT_SHARES = {
+    "simple": "auto",
+    "complex": "auto",
+}
+
+# Синтетический прогон калибровки
+CALIBRATION_SECONDS = 4
+CALIBRATION_SIZE = "1920x1080"
+CALIBRATION_GRAPHS = {
+    "simple": "eq=contrast=1.1:saturation=1.2,unsharp=5:5:1.0",
+    "complex": (
+        "split=2[bg][fg];"
+        "[bg]scale=2208:1242,boxblur=20:1,crop=1920:1080[bgo];"
+        "[fg]scale=1632:918[fgo];"
+        "[bgo][fgo]overlay=(W-w)/2:(H-h)/2"
+    ),
+}
+
+
+def _settings_path():
+    """Файл калибровки этой машины"""
+    return os.path.join(cache_dir("tuning"), f"threads_{platform.node() or 'local'}.json")
+
+
+def load_calibration():
+    """Сохранённые доли {вид графа: (декодер, фильтры, кодировщик) или "auto"}
+
+    Калибровка с другим числом ядер (другая машина, виртуалка) не используется.
+    """
+    try:
+        with open(_settings_path(), encoding="utf-8") as f:
+            settings = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if settings.get("cpu_count") != os.cpu_count():
+        return {}
+    return {
+        kind: tuple(shares) if isinstance(shares, list) else shares
+        for kind, shares in settings.get("shares", {}).items()
+    }
+
+
+def topology(complex_graph, jobs=1, cpu_count=None, shares=None):
+    """Потоки одного процесса: {"decode", "filter", "encode"} или None (решает FFmpeg)
+
+    complex_graph - граф задан через -filter_complex, jobs - одновременных
+    процессов FFmpeg. shares - доли ядер (по умолчанию из калибровки, она
+    замеряет один процесс и при jobs > 1 не используется).
+    """
+    kind = "complex" if complex_graph else "simple"
+    jobs = max(1, jobs)
+    if shares is None:
+        shares = load_calibration().get(kind, DEFAULT_SHARES[kind]) if jobs == 1 else "auto"
+
+    cores = max(1, (cpu_count or os.cpu_count() or 1) // jobs)
+    if shares == "auto":
+        if jobs == 1:
+            return None
+        # Иначе каждый процесс FFmpeg взял бы все ядра машины
+        return {"decode": cores, "filter": cores, "encode": cores}
+
+    decode, filters, encode = (max(1, round(share * cores)) for share in shares)
+    return {"decode": decode, "filter": filters, "encode": encode}
+
+
+def thread_args(complex_graph, jobs=1, cpu_count=None, shares=None):
+    """Опции потоков: (до -i - декодер и граф, после -i - кодировщик)"""
+    threads = topology(complex_graph, jobs, cpu_count, shares)
+    if threads is None:
+        return [], []
+    filter_option = "-filter_complex_threads" if complex_graph else "-filter_threads"
+    return (
+        ["-threads", str(threads["decode"]), filter_option, str(threads["filter"])],
+        ["-threads", str(threads["encode"])],
+    )
+
+
+def calibration_command(ffmpeg_path, complex_graph, shares, seconds=CALIBRATION_SECONDS):
+    """Прогон калибровки: testsrc2 -> граф -> libx264 в никуда"""
+    kind = "complex" if complex_graph else "simple"
+    input_args, output_args = thread_args(complex_graph, shares=shares)
+    graph_option = "-filter_complex" if complex_graph else "-vf"
+    return [
+        ffmpeg_path, "-y", "-nostdin", "-v", "error",
+        *input_args,
+        "-f", "lavfi", "-i", f"testsrc2=size={CALIBRATION_SIZE}:rate=30:duration={seconds}",
+        graph_option, CALIBRATION_GRAPHS[kind],
+        "-c:v", "libx264", "-b:v", "8M", "-preset", "faster",
+        *output_args,
+        "-f", "null", "-",
+    ]
+
+
+def calibrate(ffmpeg_path="ffmpeg", seconds=CALIBRATION_SECONDS):
+    """Замер всех распределений CANDIDATES и сохранение лучших; возвращает доли"""
+    best = {}
+    for kind in ("simple", "complex"):
+        timings = []
+        for shares in CANDIDATES:
+            cmd = calibration_command(ffmpeg_path, kind == "complex", shares, seconds)
+            started = time.perf_counter()
+            result = run_subprocess(cmd, capture_output=True, text=True)
+            elapsed = time.perf_counter() - started
+            if result.returncode != 0:
+                print(f"Калибровка {kind} {shares}: ошибка FFmpeg\n{result.stderr[-500:]}")
+                continue
+            print(f"{kind:8} {str(shares):20} {elapsed:6.2f} с")
+            timings.append((elapsed, CANDIDATES.index(shares), shares))
+        if timings:
+            best[kind] = min(timings)[2]
+
+    with open(_settings_path(), "w", encoding="utf-8") as f:
+        json.dump({"cpu_count": os.cpu_count(), "shares": best}, f, indent=2)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Распределение потоков FFmpeg")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    calibrate_parser = subparsers.add_parser("calibrate", help="замерить и сохранить лучшее распределение")
+    calibrate_parser.add_argument("--ffmpeg", default="ffmpeg", help="путь к FFmpeg")
+    calibrate_parser.add_argument("--seconds", type=float, default=CALIBRATION_SECONDS,
+                                  help="длительность синтетического видео")
+    args = parser.parse_args()
+
+    best = calibrate(args.ffmpeg, args.seconds)
+    for kind, shares in best.items():
+        threads = topology(kind == "complex", shares=shares)
+        print(f"Лучшее для {kind}: {threads or 'по умолчанию FFmpeg'}")
+    print(f"Сохранено: {_settings_path()}")
+
+
+if __name__ == "__main__":
+    main()